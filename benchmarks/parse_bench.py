@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Status parser benchmark for Synth Riders Discord RPC
+
+Parses a corpus of SongStatusOutput.txt samples with the single-pass
+parser (song_status.parse_status_text) and with the dict-based parser it
+replaced, and reports the parse cost and memory per record for both.
+
+The corpus is tests/testdata/SongStatus (the demo songs and corpus.txt,
+samples separated by "---" lines) plus, optionally, every status recorded
+in one or more session traces (see utils.replay).
+
+Usage:
+    python benchmarks/parse_bench.py [--repeat 20000] [--trace record/trace-20250601200000]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, PROJECT_ROOT)
+
+from song_status import make_song_key, parse_status_text
+
+STATUS_DIR = os.path.join(PROJECT_ROOT, "tests", "testdata", "SongStatus")
+
+
+def legacy_parse(content):
+    """
+    The parsing part of parse_song_status before SongInfo, for comparison
+    """
+    content = content.strip()
+    if not content:
+        return None
+    lines = content.split('\n')
+    song_info = {}
+    if lines and ' by ' in lines[0]:
+        song_name, artist = lines[0].split(' by ', 1)
+        song_info['song_name'] = song_name.strip()
+        song_info['artist'] = artist.strip()
+    else:
+        song_info['song_name'] = lines[0].strip() if lines else "Unknown"
+        song_info['artist'] = "Unknown"
+    if len(lines) > 1 and '(mapped by ' in lines[1]:
+        difficulty, mapper_part = lines[1].split('(mapped by ', 1)
+        song_info['difficulty'] = difficulty.strip()
+        song_info['mapper'] = mapper_part.strip().rstrip(')')
+    else:
+        song_info['difficulty'] = lines[1].strip() if len(lines) > 1 else "Unknown"
+        song_info['mapper'] = "Unknown"
+    song_info['song_id'] = make_song_key(song_info['song_name'], song_info['artist'])
+    # Fields parse_song_status always added afterwards
+    song_info['has_cover'] = False
+    song_info['cover_path'] = None
+    song_info['cover_url'] = None
+    song_info['start_time'] = None
+    return song_info
+
+
+def load_corpus(trace_dirs=()):
+    samples = []
+    for name in sorted(os.listdir(STATUS_DIR)):
+        path = os.path.join(STATUS_DIR, name, "SongStatusOutput.txt")
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                samples.append(f.read())
+    with open(os.path.join(STATUS_DIR, "corpus.txt"), "r", encoding="utf-8") as f:
+        samples.extend(sample.strip("\n") for sample in f.read().split("\n---\n") if sample.strip())
+    if trace_dirs:
+        from utils.replay import load_trace
+        for trace_dir in trace_dirs:
+            samples.extend(e["content"] for e in load_trace(trace_dir) if e["type"] == "status" and e["content"])
+    return samples
+
+
+def time_per_record(parse, samples, repeat, rounds=100):
+    # Best of several rounds, so a busy machine doesn't decide which parser wins
+    per_round = max(1, repeat // rounds)
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(per_round):
+            for sample in samples:
+                parse(sample)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / (per_round * len(samples)) * 1e6
+
+
+def memory_per_record(parse, samples, count):
+    inputs = [samples[i % len(samples)] for i in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = [parse(sample) for sample in inputs]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # The parsed strings are kept alive by the records in both cases, so this is the full record cost
+    return (after - before) / len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Status parser benchmark")
+    parser.add_argument("--repeat", type=int, default=20000)
+    parser.add_argument("--trace", action="append", default=[], help="Session trace directory to add to the corpus")
+    args = parser.parse_args()
+
+    samples = load_corpus(args.trace)
+    print(f"corpus: {len(samples)} samples")
+    mismatches = [s for s in samples if legacy_parse(s) and parse_status_text(s).song_name != legacy_parse(s)['song_name']]
+    print(f"titles read differently than before (' by ' in title): {len(mismatches)}")
+
+    print(f"{'parser':<12}{'us/record':>12}{'bytes/record':>15}")
+    for name, parse in (("legacy dict", legacy_parse), ("SongInfo", parse_status_text)):
+        us = time_per_record(parse, samples, args.repeat)
+        size = memory_per_record(parse, samples, 10000)
+        print(f"{name:<12}{us:>12.3f}{size:>15.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for Synth Riders Discord RPC
+
+Measures, each in a fresh interpreter:
+- import time of main.py (python -X importtime), with the slowest imports
+- time from process spawn until the tray icon is ready
+- time from process spawn until the first Discord presence update
+
+Discord and the game process are replaced by stand-ins so only our own
+startup path is measured. Results are compared against startup_budget.json
+and the script exits non-zero when a budget is exceeded.
+
+Usage:
+    python benchmarks/startup_bench.py [--runs 5] [--budget benchmarks/startup_budget.json]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+
+
+def child_env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = PROJECT_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    if sys.platform.startswith("linux") and not env.get("DISPLAY"):
+        # No tray available on a headless machine; time construction only
+        env.setdefault("PYSTRAY_BACKEND", "dummy")
+    return env
+
+
+def measure_imports(top=10):
+    """
+    Run `import main` under -X importtime and return (total ms, slowest imports, module names)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=PROJECT_ROOT, env=child_env(), capture_output=True, text=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nesting is shown as two extra spaces per level after "| "
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(cumulative_us), name.strip(), depth))
+    if result.returncode != 0:
+        raise RuntimeError(f"import main failed:\n{result.stderr[-2000:]}")
+    # Rows are printed children first, so main's subtree is everything between
+    # the previous top-level import and main itself
+    end = next(i for i, (_, name, depth) in enumerate(rows) if name == "main" and depth == 0)
+    start = end
+    while start > 0 and rows[start - 1][2] > 0:
+        start -= 1
+    subtree = rows[start:end]
+    total = rows[end][0]
+    direct = sorted(((c, name) for c, name, depth in subtree if depth == 1), reverse=True)
+    modules = {name for _, name, _ in subtree}
+    return total / 1000, [(name, c / 1000) for c, name in direct[:top]], modules
+
+
+CHILD_SCRIPT = r"""
+import os, sys, json, time, threading
+marks = {}
+import main
+marks["imports_done"] = time.time()
+
+config = json.loads(os.environ["BENCH_CONFIG"])
+tray = main.taskTray(config)
+def setup(icon):
+    icon.visible = True
+    marks["tray_ready"] = time.time()
+    icon.stop()
+if os.environ.get("PYSTRAY_BACKEND") == "dummy":
+    # The dummy backend cannot show an icon; the icon object being ready is the best we get
+    marks["tray_ready"] = time.time()
+else:
+    tray.icon.run(setup=setup)
+
+first_presence = threading.Event()
+class BenchPresence:
+    def update_song_status(self, song_info, config):
+        if song_info and not first_presence.is_set():
+            marks["first_presence"] = time.time()
+            first_presence.set()
+        return True
+    def disconnect(self):
+        pass
+
+watcher = main.SongStatusWatcher(config)
+watcher.upload_image = lambda path: None
+pipeline = main.RPCPipeline(BenchPresence(), watcher, config, lambda: 1)
+threading.Thread(target=pipeline.run, daemon=True).start()
+first_presence.wait(30)
+pipeline.stop()
+print(json.dumps(marks))
+"""
+
+
+def measure_startup(status_dir):
+    """
+    Spawn the app path once and return ms from spawn to each startup mark
+    """
+    config = {
+        "song_status_path": os.path.join(status_dir, "SongStatusOutput.txt"),
+        "cover_image_path": os.path.join(status_dir, "SongStatusImage.png"),
+        "synth_db_path": os.path.join(PROJECT_ROOT, "tests", "testdata", "SynthDB", "SynthDB"),
+        "update_check_interval_hours": 1e9,
+    }
+    env = child_env()
+    env["BENCH_CONFIG"] = json.dumps(config)
+    started = time.time()
+    result = subprocess.run([sys.executable, "-c", CHILD_SCRIPT], cwd=status_dir, env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"startup run failed:\n{result.stderr[-2000:]}")
+    marks = json.loads(result.stdout.strip().splitlines()[-1])
+    return {name: (value - started) * 1000 for name, value in marks.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", default=os.path.join(BENCH_DIR, "startup_budget.json"))
+    args = parser.parse_args()
+
+    with open(args.budget, "r", encoding="utf-8") as f:
+        budget = json.load(f)
+
+    import_runs = [measure_imports() for _ in range(args.runs)]
+    import_ms = statistics.median(run[0] for run in import_runs)
+    print(f"import main: {import_ms:.1f} ms (median of {args.runs})")
+    for name, ms in import_runs[-1][1]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    status_dir = tempfile.mkdtemp()
+    try:
+        shutil.copy(os.path.join(PROJECT_ROOT, "tests", "testdata", "SongStatus", "demosong-1", "SongStatusOutput.txt"),
+                    status_dir)
+        startup_runs = [measure_startup(status_dir) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(status_dir, ignore_errors=True)
+    results = {
+        "import_main_ms": import_ms,
+        "time_to_tray_ms": statistics.median(run["tray_ready"] for run in startup_runs),
+        "time_to_first_presence_ms": statistics.median(run["first_presence"] for run in startup_runs),
+    }
+    print(f"time to tray: {results['time_to_tray_ms']:.1f} ms")
+    print(f"time to first presence: {results['time_to_first_presence_ms']:.1f} ms")
+
+    failures = []
+    for key, limit in budget.get("max_ms", {}).items():
+        if results[key] > limit:
+            failures.append(f"{key} {results[key]:.1f} ms > budget {limit} ms")
+    loaded = import_runs[-1][2]
+    for module in budget.get("deferred_imports", []):
+        if module in loaded:
+            failures.append(f"{module} is imported at startup but should be deferred")
+
+    if failures:
+        print("\nStartup budget exceeded:")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    print("\nStartup within budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,10 @@
 import time
 import os
 from pypresence import Presence as PyPresence
+from utils.metrics import REGISTRY, timed
+from utils.config import Config, presence_buttons
+
+presence_failures = REGISTRY.counter("presence_update_failures_total", "Discord presence updates that failed")
 
 class Presence:
     """
@@ -11,6 +15,20 @@ class Presence:
         self.rpc = PyPresence(client_id)
         self.connected = False
         self.start_time = int(time.time())
+        # Payload of the last successful update, kept for session checkpoints
+        self.last_update = None
+        # Optional PlayStats for the `show_stats` state line
+        self.stats = None
+
+    def apply_config(self, config):
+        """
+        Switch to a new Discord application if the reloaded config names one
+        """
+        client_id = config["discord_application_id"]
+        if client_id != self.client_id:
+            self.disconnect()
+            self.client_id = client_id
+            self.rpc = PyPresence(client_id)
 
     def connect(self):
         """
@@ -45,12 +63,14 @@ class Presence:
 
         try:
             self.rpc.update(**data)
+            self.last_update = data
             return True
         except Exception as e:
             print(f"Failed to update Discord presence: {e}")
             self.connected = False
             return False
 
+    @timed("presence_update_song_status")
     def update_song_status(self, song_info, config):
         """
         Update Discord Rich Presence with song information
@@ -61,13 +81,13 @@ class Presence:
         try:
             if not song_info:
                 # No active song, set idle status
-                self.rpc.update(
-                    state="Idle",
-                    details="looking for a song to play",
-                    large_image="game_synthriders_logo",
-                    large_text="Synth Riders",
-                    start=self.start_time
-                )
+                update_data = {
+                    "state": "Idle",
+                    "details": "looking for a song to play",
+                    "large_image": "game_synthriders_logo",
+                    "large_text": "Synth Riders",
+                    "start": self.start_time,
+                }
             else:
                 # Format song information for Discord
                 song_name = song_info.get("song_name", "Unknown")
@@ -78,21 +98,27 @@ class Presence:
                 bpm = song_info.get("bpm") or "Unknown"
                 year = song_info.get("year", "")
 
-                # Get song duration and start time for progress bar
-                duration = song_info.get("duration")  # Duration in seconds
+                # Start and end for the progress bar, from the status file write time and SynthDB duration
                 song_start_time = song_info.get("start_time")  # When the song started
+                song_end_time = song_info.get("end_time")
+                if song_end_time is None and song_start_time and song_info.get("duration"):
+                    song_end_time = song_start_time + song_info["duration"]
 
                 # Build the update data
                 update_data = {
                     "details": f"{song_name} by {artist}",
                     "state": f"{difficulty} | {bpm} BPM | mapped by {mapper})",
                 }
+                stats_text = self.stats.presence_text() if self.stats and config.get("show_stats") else None
+                if stats_text:
+                    # Discord cuts the state line off at 128 characters
+                    update_data["state"] = f"{update_data['state']} | {stats_text}"[:128]
 
                 # Add progress bar if we have song duration
-                if duration and song_start_time:
-                    # Use song start time for the progress bar
-                    update_data["start"] = song_start_time
-                    update_data["end"] = song_start_time + duration
+                if song_end_time and song_start_time:
+                    # Discord takes whole seconds
+                    update_data["start"] = int(song_start_time)
+                    update_data["end"] = int(song_end_time)
                 else:
                     # Fall back to just showing start time
                     update_data["start"] = self.start_time
@@ -108,19 +134,17 @@ class Presence:
                     update_data["large_image"] = "game_synthriders_logo"
                     update_data["large_text"] = "Synth Riders"
 
-                # Add button if configured
-                if config.get("show_button", True):
-                    button_label = config.get("button_label", "Synth Riders")
-                    button_url = config.get("button_url", "https://synthridersvr.com")
-                    update_data["buttons"] = [{
-                        "label": button_label,
-                        "url": button_url
-                    }]
+                # Add button if configured; a Config carries the payload prebuilt
+                buttons = config.presence_buttons if isinstance(config, Config) else presence_buttons(config)
+                if buttons:
+                    update_data["buttons"] = buttons
 
-                self.rpc.update(**update_data)
+            self.rpc.update(**update_data)
+            self.last_update = update_data
             return True
         except Exception as e:
             print(f"Failed to update Discord presence: {e}")
+            presence_failures.inc()
             self.connected = False
             return False
 
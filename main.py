@@ -1,23 +1,32 @@
 import os
-import time
-import psutil
 import logging
 import json
-from pystray import Icon, Menu, MenuItem
-from PIL import Image
-from threading import Thread
+from threading import Lock, Thread
 import sys
-from datetime import datetime
+import signal
+import argparse
 import configparser
-import requests
-import webbrowser
-import asyncio
-import srt
-from datetime import timedelta
+from datetime import datetime
 
 # Import our new song status watcher
-from song_status import SongStatusWatcher
+from song_status import SharedEnrichment, SongStatusWatcher
 from discordrp import Presence
+from pipeline import RPCPipeline
+from supervisor import NullPresence, PipelineSupervisor, SharedProcessScan, game_dir_of
+from utils.history import HistoryStore
+from utils.log_retention import LogRetentionManager
+from utils.timeline import SessionTimeline
+from utils.update_check import UpdateChecker
+from utils.replay import TraceRecorder
+from utils.metrics import REGISTRY, MetricsServer, timed
+from utils.config import ConfigError, ConfigReloader, ProfileReloader, load_config, profile_configs
+from utils.broadcast import NowPlayingServer
+from utils.cover_cache import CoverCache
+from utils.paths import app_dir
+from utils.shutdown import Shutdown
+from utils.checkpoint import SessionCheckpoint
+from utils.steam import InstallDiscovery
+from utils.stats import PlayStats
 
 # Setup basic stderr logging for critical errors that might occur before proper logging setup
 logging.basicConfig(
@@ -26,7 +35,16 @@ logging.basicConfig(
     stream=sys.stderr
 )
 
-script_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
+script_dir = app_dir()
+log_dir = os.path.join(script_dir, "log")
+# Cover cache, found install paths and the update check
+cache_dir = os.path.join(script_dir, "cache")
+# Seconds from Exit (or SIGTERM) until the process is gone
+SHUTDOWN_BUDGET = 5
+# Seconds a process scan is reused by the other profiles
+PROCESS_SCAN_MAX_AGE = 2
+# Session logs go through the root logger, which is pointed at one file at a time
+log_lock = Lock()
 
 def read_ini():
     conf = configparser.ConfigParser()
@@ -34,33 +52,25 @@ def read_ini():
     if os.path.isfile(path):
         conf.read(path, encoding="UTF-8")
     else:
-        conf.read(rf"{script_dir}\settings\appinfo.ini", encoding="UTF-8")
+        conf.read(os.path.join(script_dir, "settings", "appinfo.ini"), encoding="UTF-8")
     return conf["PROFILE"]["AppVersion"]
 
-def read_server_ini():
-    try:
-        url = "https://raw.githubusercontent.com/6uhrmittag/Synth-Riders-DiscordRPC/master/settings/appinfo.ini"
-        r = requests.get(url)
-        if r.status_code == 200:
-            conf = configparser.ConfigParser()
-            conf.read_string(r.text)
-            return conf["PROFILE"]["AppVersion"]
-        else:
-            # Return local version if server version can't be accessed
-            return read_ini()
-    except Exception as e:
-        logging.error(f"Error fetching server version: {e}")
-        # Return local version as fallback
-        return read_ini()
-
 def resource_path(relative_path):
     if hasattr(sys, '_MEIPASS'):
         return os.path.join(sys._MEIPASS, relative_path)
     return os.path.join(os.path.abspath("."), relative_path)
 
 class taskTray:
-    def __init__(self):
+    def __init__(self, config=None, profiler=None, shutdown=None, stats=None):
+        # Imported here so headless mode never needs a display
+        from pystray import Icon, Menu, MenuItem
+        from PIL import Image
+
         self.status = False
+        self.profiler = profiler
+        self.shutdown = shutdown
+        self.stats = stats
+        config = config or {}
 
         try:
             image = Image.open(resource_path("assets/game_synthriders_logo_square.jpg"))
@@ -70,48 +80,89 @@ class taskTray:
             image = Image.new('RGB', (64, 64), color = 'blue')
 
         try:
-            local_version = read_ini()
-            server_version = read_server_ini()
-
-            # Only show update menu if server version is different and not a fallback
-            visible = local_version != server_version and server_version != local_version
+            self.local_version = read_ini()
         except Exception as e:
-            logging.error(f"Error checking versions: {e}")
-            local_version = "Unknown"
-            server_version = "Unknown"
-            visible = False
+            logging.error(f"Error reading local version: {e}")
+            self.local_version = "Unknown"
+
+        # Show the last known server version right away, the fresh check runs in the background
+        self.update_checker = UpdateChecker(
+            os.path.join(cache_dir, "update_check.json"),
+            interval_hours=config.get("update_check_interval_hours", 24)
+        )
+        self.server_version = self.update_checker.cached_version()
 
         menu = Menu(
-            MenuItem(f"Update is available! (->v{server_version})", self.open_gitpage, visible=visible),
-            MenuItem(f"Version: {local_version}", enabled=False, action=None),
+            MenuItem(lambda item: f"Update is available! (->v{self.server_version})", self.open_gitpage,
+                     visible=lambda item: self.update_available),
+            MenuItem(f"Version: {self.local_version}", enabled=False, action=None),
+            MenuItem("Play stats", Menu(lambda: (MenuItem(line, None, enabled=False)
+                                                 for line in self.stats.summary_lines())),
+                     visible=stats is not None),
+            MenuItem("Save profiling snapshot", self.save_profile, visible=profiler is not None),
             MenuItem("Exit", self.stop_program),
         )
 
         self.icon = Icon(name="SynthRidersRPC", title="Synth Riders Discord RPC", icon=image, menu=menu)
+        if stats:
+            stats.on_change = self.icon.update_menu
+
+    @property
+    def update_available(self):
+        return bool(self.server_version) and self.local_version not in ("Unknown", self.server_version)
+
+    def on_server_version(self, version):
+        self.server_version = version
+        self.icon.update_menu()
 
     def open_gitpage(self):
+        # Only needed when the menu item is clicked
+        import webbrowser
         url = "https://github.com/6uhrmittag/Synth-Riders-DiscordRPC/releases"
         webbrowser.open(url)
 
+    def save_profile(self):
+        try:
+            path = self.profiler.snapshot("manual")
+            print(f"Profiling snapshot written to {path}")
+        except Exception as e:
+            logging.error(f"Error writing profiling snapshot: {e}")
+
     def stop_program(self, icon):
         self.status = False
+        if self.shutdown:
+            # Wake the workers now, they wind down while the icon goes away
+            self.shutdown.request()
         icon.stop()
 
     def run_program(self):
         self.status = True
+        self.update_checker.start(self.on_server_version)
         self.icon.run()
 
-def get_config():
-    try:
-        with open("./settings/config.json", "r", encoding="UTF-8") as f:
-            data = json.load(f)
-    except FileNotFoundError:
-        with open(rf"{script_dir}\settings\config.json", "r", encoding="UTF-8") as f:
-            data = json.load(f)
+def find_config(path=None):
+    """
+    Path of config.json: the given path, ./settings, or settings next to the program
+    """
+    if path:
+        return path
+    if os.path.isfile("./settings/config.json"):
+        return "./settings/config.json"
+    return os.path.join(script_dir, "settings", "config.json")
 
-    return data
+def get_config(path=None, overrides=None):
+    """
+    Load and validate config.json
+
+    Raises:
+        ConfigError: If the file is missing or invalid
+    """
+    return load_config(find_config(path), overrides)
 
+@timed("process_check")
 def process_check():
+    # Imported on first use so psutil loads in the worker thread, not before the tray
+    import psutil
     for proc in psutil.process_iter():
         try:
             get_proc = proc.exe()
@@ -122,198 +173,415 @@ def process_check():
                 return proc.pid
     return False
 
-def log_song_event(dt, event_type, song_info):
+@timed("process_scan")
+def find_game_processes():
+    """
+    PID and executable path of every running Synth Riders, for profiles sharing one scan
+    """
+    import psutil
+    found = []
+    for proc in psutil.process_iter():
+        try:
+            exe = proc.exe()
+        except (psutil.AccessDenied, psutil.NoSuchProcess):
+            pass
+        else:
+            if "SynthRiders.exe" in exe:
+                found.append((proc.pid, exe))
+    return found
+
+def log_song_event(dt, event_type, song_info, directory=None):
     """
     Log song start/stop events with all available song info.
     event_type: 'start' or 'stop'
-    song_info: dict with song details or None
+    song_info: SongInfo (or dict) with song details or None
+    directory: Log folder of a profile, the main log folder by default
     """
-    log_dir = os.path.join(script_dir, "log")
-    os.makedirs(log_dir, exist_ok=True)
+    directory = directory or log_dir
+    os.makedirs(directory, exist_ok=True)
     log_file = f"rpc{dt}.log"
-    log_path = os.path.join(log_dir, log_file)
+    log_path = os.path.join(directory, log_file)
     try:
-        logging.basicConfig(
-            filename=log_path,
-            encoding="utf-8",
-            level=logging.INFO,
-            format="[%(asctime)s] %(message)s",
-            force=True
-        )
-        logger = logging.getLogger("song_event")
-        if event_type == 'start' and song_info:
-            logger.info(f"SONG START: {json.dumps(song_info, ensure_ascii=False)}")
-        elif event_type == 'stop' and song_info:
-            logger.info(f"SONG STOP: {json.dumps(song_info, ensure_ascii=False)}")
-        elif event_type == 'stop' and not song_info:
-            logger.info("SONG STOP: No song info available.")
+        with log_lock:
+            logging.basicConfig(
+                filename=log_path,
+                encoding="utf-8",
+                level=logging.INFO,
+                format="[%(asctime)s] %(message)s",
+                force=True
+            )
+            logger = logging.getLogger("song_event")
+            if event_type == 'start' and song_info:
+                logger.info(f"SONG START: {json.dumps(dict(song_info), ensure_ascii=False)}")
+            elif event_type == 'stop' and song_info:
+                logger.info(f"SONG STOP: {json.dumps(dict(song_info), ensure_ascii=False)}")
+            elif event_type == 'stop' and not song_info:
+                logger.info("SONG STOP: No song info available.")
     except Exception as e:
         print(f"Failed to write song event to log: {e}")
 
-def write_srt_event(dt, event_type, song_info, srt_state):
+def history_db_path(config):
+    return config.get("history_db_path") or os.path.join(log_dir, "history.db")
+
+def get_history(config):
     """
-    Write an SRT file with a 5 second subtitle block for song start/stop or idle.
-    event_type: 'start', 'stop', or 'idle'
-    song_info: dict with song details or None
-    srt_state: dict to keep track of subtitle index and last end time
+    Open the play history store, or return None if history is disabled
     """
-    log_dir = os.path.join(script_dir, "log")
-    os.makedirs(log_dir, exist_ok=True)
-    srt_file = f"rpc{dt}.srt"
-    srt_path = os.path.join(log_dir, srt_file)
+    if not config.get("history_enabled", True):
+        return None
+    db_path = history_db_path(config)
+    try:
+        return HistoryStore(db_path).start()
+    except Exception as e:
+        logging.error(f"Error opening play history: {e}")
+        return None
 
-    # Determine subtitle text
-    if event_type == 'start' and song_info:
-        text = f"START: {song_info.get('artist', 'Unknown')} - {song_info.get('song_name', 'Unknown')}"
-    elif event_type == 'stop' and song_info:
-        text = f"STOP: {song_info.get('artist', 'Unknown')} - {song_info.get('song_name', 'Unknown')}"
-    else:
-        text = "ideingling"
-
-    # Determine start and end time for the subtitle
-    # Use last end time if available, else start at 0
-    start_td = srt_state.get('last_end', timedelta(seconds=0))
-    end_td = start_td + timedelta(seconds=5)
-    srt_state['last_end'] = end_td
-
-    # Increment subtitle index
-    srt_state['index'] = srt_state.get('index', 0) + 1
-    subtitle = srt.Subtitle(index=srt_state['index'], start=start_td, end=end_td, content=text)
-
-    # Append to SRT file (read existing, add, write back)
-    subtitles = []
-    if os.path.exists(srt_path):
-        with open(srt_path, 'r', encoding='utf-8') as f:
-            try:
-                subtitles = list(srt.parse(f.read()))
-            except Exception:
-                subtitles = []
-    subtitles.append(subtitle)
-    with open(srt_path, 'w', encoding='utf-8') as f:
-        f.write(srt.compose(subtitles))
-
-def rpc_loop(presence, song_watcher, config, dt_now=None, srt_state=None):
-    prev_song_id = None
-    prev_song_info = None
-    if dt_now is None:
-        dt_now = datetime.now().strftime("%Y%m%d%H%M%S%f")
-    if srt_state is None:
-        srt_state = {'index': 0, 'last_end': timedelta(seconds=0)}
-    while True:
-        if process_check():
-            song_info = song_watcher.get_song_status()
-            song_id = song_info.get('song_id') if song_info else None
-            if song_id and song_id != prev_song_id:
-                log_song_event(dt_now, 'start', song_info)
-                write_srt_event(dt_now, 'start', song_info, srt_state)
-            if prev_song_id and not song_id:
-                log_song_event(dt_now, 'stop', prev_song_info)
-                write_srt_event(dt_now, 'stop', prev_song_info, srt_state)
-            prev_song_id = song_id
-            prev_song_info = song_info if song_id else None
-            presence.update_song_status(song_info, config)
-            time.sleep(5)
-        else:
-            break
-    presence.update_song_status(None, config)
-    presence.disconnect()
+def get_play_stats(config):
+    """
+    Load the running play totals, rebuilding them from the play history if they are missing
+    """
+    return PlayStats(os.path.join(log_dir, "stats.json")).load(history_db_path(config))
 
-def log_write(dt, status, app, content):
-    # Create log directory using correct path handling
-    log_dir = os.path.join(script_dir, "log")
-    os.makedirs(log_dir, exist_ok=True)
+def get_log_retention(config, pipeline, shutdown=None, directory=None):
+    """
+    Start background housekeeping of the log directory (or a profile's log folder)
+    """
+    return LogRetentionManager(directory or log_dir, config.get("log_retention"),
+                               active_session=lambda: pipeline.session_id if pipeline else None,
+                               stop_event=shutdown and shutdown.event).start()
+
+def get_metrics_server(config):
+    """
+    Serve stage metrics on localhost if `metrics_port` is set, otherwise return None
+    """
+    port = config.get("metrics_port")
+    if not port:
+        return None
+    try:
+        return MetricsServer(port).start()
+    except OSError as e:
+        logging.error(f"Error starting metrics endpoint on port {port}: {e}")
+        return None
+
+def get_cover_cache(config):
+    """
+    Open the on-disk cover cache unless disabled in the config
+    """
+    settings = config.get("cover_cache") or {}
+    if not settings.get("enabled", True):
+        return None
+    try:
+        return CoverCache(os.path.join(cache_dir, "covers"), settings)
+    except OSError as e:
+        logging.error(f"Error opening cover cache: {e}")
+        return None
+
+def get_overlay_server(config):
+    """
+    Start the now-playing server for stream overlays if enabled, otherwise return None
+    """
+    settings = config.get("overlay_server") or {}
+    if not settings.get("enabled"):
+        return None
+    port = settings.get("port", 8765)
+    try:
+        return NowPlayingServer(port).start()
+    except OSError as e:
+        logging.error(f"Error starting overlay server on port {port}: {e}")
+        return None
+
+def get_scrobbler(config, shutdown=None):
+    """
+    Start sending finished plays to the configured scrobble services, or return None if scrobbling is off
+    """
+    settings = config.get("scrobble") or {}
+    if not settings.get("enabled"):
+        return None
+    # Imported only when scrobbling is on, so it costs nothing otherwise
+    from utils.scrobble import ScrobbleQueue, ScrobbleSender, make_backends
+    backends = make_backends(settings.get("services"))
+    if not backends:
+        logging.error("Scrobbling is enabled but no usable service is configured")
+        return None
+    try:
+        queue = ScrobbleQueue(os.path.join(log_dir, "scrobble.db"))
+    except Exception as e:
+        logging.error(f"Error opening scrobble queue: {e}")
+        return None
+    return ScrobbleSender(queue, backends, settings, stop_event=shutdown and shutdown.event).start()
+
+def get_profiler(config, shutdown=None):
+    """
+    Start the profiler if enabled in config or by SYNTHRIDERS_RPC_PROFILE=1, otherwise return None
+    """
+    settings = config.get("profiling") or {}
+    if not (settings.get("enabled") or os.environ.get("SYNTHRIDERS_RPC_PROFILE") not in (None, "", "0")):
+        return None
+    # Imported only when profiling is on, so it costs nothing otherwise
+    from utils.profiling import Profiler
+    return Profiler(os.path.join(log_dir, "profile"), settings, stop_event=shutdown and shutdown.event).start()
+
+def log_write(dt, status, app, content, directory=None):
+    # Create log directory using correct path handling (a profile's own folder if given)
+    directory = directory or log_dir
+    os.makedirs(directory, exist_ok=True)
 
     # Use os.path.join for cross-platform path handling
     log_file = f"rpc{dt}.log"
-    log_path = os.path.join(log_dir, log_file)
+    log_path = os.path.join(directory, log_file)
     
     try:
-        # Configure logging for file output
-        logging.basicConfig(
-            filename=log_path, 
-            encoding="utf-8", 
-            level=logging.INFO, 
-            format="[%(asctime)s] %(message)s",
-            force=True  # Force reconfiguration to handle multiple calls
-        )
-        
-        logger = logging.getLogger(__name__)
-        
-        if status == "ok":
-            if app:
-                info_text = f"Synth Riders is running(PID: {app}). Executing RPC function."
-            else:
-                info_text = f"Synth Riders is not running. waiting..."
-            logger.info(info_text)
-        elif status == "error":
-            logger.error(f"Unexpected error occurred.\n{content}")
+        with log_lock:
+            # Configure logging for file output
+            logging.basicConfig(
+                filename=log_path, 
+                encoding="utf-8", 
+                level=logging.INFO, 
+                format="[%(asctime)s] %(message)s",
+                force=True  # Force reconfiguration to handle multiple calls
+            )
+            
+            logger = logging.getLogger(__name__)
+            
+            if status == "ok":
+                if app:
+                    info_text = f"Synth Riders is running(PID: {app}). Executing RPC function."
+                else:
+                    info_text = f"Synth Riders is not running. waiting..."
+                logger.info(info_text)
+            elif status == "stats":
+                logger.info(f"POLLING STATS: {json.dumps(content)}")
+            elif status == "metrics":
+                logger.info(f"STAGE METRICS: {json.dumps(content)}")
+            elif status == "error":
+                logger.error(f"Unexpected error occurred.\n{content}")
     except Exception as e:
         # Fallback to console logging if file logging fails
         print(f"Failed to write to log: {e}")
         print(f"Status: {status}, Content: {content}")
 
-import asyncio
+class SessionRecorder:
+    """
+    Pipeline sink writing the session log, subtitle timeline and play history
+    """
+    def __init__(self, history=None, directory=None):
+        self.history = history
+        # A profile's own log folder; None for the main log folder
+        self.directory = directory
+        self.timeline = None
+        self.last_session_id = None
 
-def app_run():
-    dt_now = datetime.now().strftime("%Y%m%d%H%M%S%f")
-    last_seen_running = time.time()
-    not_running_since = None
-    idle_timeout = 10 * 60  # 10 minutes in seconds
-    rpc_active = False
-    srt_state = None
-    while True:
-        try:
-            pid = process_check()
-            if pid:
-                # If game is running again after being stopped, start new log/SRT
-                if not rpc_active:
-                    dt_now = datetime.now().strftime("%Y%m%d%H%M%S%f")
-                    srt_state = {'index': 0, 'last_end': timedelta(seconds=0)}
-                    try:
-                        log_write(dt=dt_now, status="ok", app=pid, content=None)
-                    except Exception:
-                        pass
-                    rpc_active = True
-                last_seen_running = time.time()
-                not_running_since = None
-                rpc_loop(presence, song_watcher, config, dt_now=dt_now, srt_state=srt_state)
-            else:
-                if rpc_active:
-                    # Mark the time when the process stopped
-                    if not not_running_since:
-                        not_running_since = time.time()
-                    # Write idle SRT event
-                    if srt_state is None:
-                        srt_state = {'index': 0, 'last_end': timedelta(seconds=0)}
-                    write_srt_event(dt_now, 'idle', None, srt_state)
-                    try:
-                        log_write(dt=dt_now, status="ok", app=False, content=None)
-                    except Exception:
-                        pass
-                    # If not running for more than 10 minutes, finish log/SRT and reset
-                    if time.time() - not_running_since > idle_timeout:
-                        # Optionally, write a closing entry to log/SRT
-                        try:
-                            log_write(dt=dt_now, status="ok", app=None, content="Session ended after 10 minutes idle.")
-                        except Exception:
-                            pass
-                        write_srt_event(dt_now, 'idle', None, srt_state)
-                        rpc_active = False
-                        dt_now = None
-                        srt_state = None
-                else:
-                    # Not running and not active, just idle
-                    pass
-            time.sleep(5)
-        except Exception as e:
-            print(f"Error in main loop: {e}")
-            try:
-                if dt_now:
-                    log_write(dt=dt_now, status="error", app=None, content=e)
-            except Exception:
-                pass
-            break
+    def on_event(self, event, session_id, data, timestamp):
+        self.last_session_id = session_id
+        if event == "session_start":
+            self.timeline = SessionTimeline(self.directory or log_dir, session_id, started_at=timestamp)
+            if self.history:
+                log_name = os.path.relpath(os.path.join(self.directory or log_dir, f"rpc{session_id}.log"), log_dir)
+                self.history.start_session(session_id, timestamp, log_name)
+        elif event == "game_start":
+            log_write(dt=session_id, status="ok", app=data, content=None, directory=self.directory)
+        elif event == "song_start":
+            log_song_event(session_id, 'start', data, self.directory)
+            self.timeline.song_start(data)
+        elif event == "song_stop":
+            log_song_event(session_id, 'stop', data, self.directory)
+            self.timeline.song_stop(data, at=timestamp)
+            if self.history:
+                self.history.record_play(session_id, data, timestamp)
+        elif event == "game_stop":
+            self.timeline.idle(at=timestamp)
+            log_write(dt=session_id, status="ok", app=False, content=None, directory=self.directory)
+            if data:
+                log_write(dt=session_id, status="stats", app=None, content=data, directory=self.directory)
+        elif event == "session_end":
+            log_write(dt=session_id, status="ok", app=None, content="Session ended after 10 minutes idle.",
+                      directory=self.directory)
+            if self.history:
+                self.history.end_session(session_id, timestamp)
+            self.timeline = None
+
+    def checkpoint(self):
+        return {"timeline": self.timeline.state() if self.timeline else None}
+
+    def resume(self, session_id, state):
+        """
+        Continue writing the session's timeline after a restart
+        """
+        self.last_session_id = session_id
+        self.timeline = SessionTimeline(self.directory or log_dir, session_id)
+        if state and state.get("timeline"):
+            self.timeline.restore(state["timeline"])
+
+def get_profile_pipelines(config, profiles, config_reloader, install, history, stats, shared_sinks, shutdown,
+                          profiler=None):
+    """
+    One pipeline per profile, sharing the process scan, enrichment, play history and the given sinks
+
+    Returns:
+        tuple: (PipelineSupervisor, SharedEnrichment, the profiles' services, their SessionRecorders)
+    """
+    enrichment = config.get("enrichment") or {}
+    shared = SharedEnrichment(enrichment.get("workers", 4), get_cover_cache(config))
+    scan = profiler.wrap(find_game_processes) if profiler else find_game_processes
+    scan = SharedProcessScan(scan, PROCESS_SCAN_MAX_AGE)
+    if config.get("record_session_dir") or any(c.get("record_session_dir") for _, c in profiles):
+        logging.error("record_session_dir is not available with profiles, sessions are not recorded")
+    pipelines, services, recorders = [], [], []
+    for index, (name, profile_config) in enumerate(profiles):
+        directory = os.path.join(log_dir, name)
+        song_watcher = SongStatusWatcher(profile_config, install=install, shared=shared)
+        # Discord shows one status per PC, so unless set otherwise only the first profile updates it
+        if profile_config.get("discord_presence", index == 0):
+            presence = Presence(profile_config["discord_application_id"])
+            presence.stats = stats
+        else:
+            presence = NullPresence()
+        recorder = SessionRecorder(history, directory)
+        if profiler:
+            profiler.profile_methods(song_watcher, "check_for_updates", "parse_song_status")
+            profiler.profile_methods(presence, "update_song_status")
+            profiler.profile_methods(recorder, "on_event")
+        # Shared totals, but each profile keeps its own current session
+        sinks = [recorder, stats.profile(name), *shared_sinks]
+        overlay_server = get_overlay_server(profile_config)
+        if overlay_server:
+            sinks.append(overlay_server)
+            services.append(overlay_server)
+        # The game process of a profile is the one started from its install
+        game_dir = profile_config.get("game_dir") or game_dir_of(song_watcher.song_status_path)
+        pipeline = RPCPipeline(presence, song_watcher, profile_config, scan.checker(game_dir), sinks=sinks,
+                               config_reloader=ProfileReloader(config_reloader, name, profile_config),
+                               checkpoint=SessionCheckpoint(os.path.join(directory, "session.json")))
+        services.append(get_log_retention(profile_config, pipeline, shutdown, directory))
+        pipelines.append(pipeline)
+        recorders.append(recorder)
+    return PipelineSupervisor(pipelines, [name for name, _ in profiles]), shared, services, recorders
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Synth Riders Discord Rich Presence")
+    parser.add_argument("--headless", action="store_true",
+                        help="Run without the tray icon, e.g. on a capture machine or under a process supervisor")
+    parser.add_argument("--config", help="Path to config.json")
+    parser.add_argument("--log-dir", help="Directory for session logs, subtitles and play history")
+    parser.add_argument("--cache-dir", help="Directory for cached covers, install paths and the update check")
+    parser.add_argument("--poll-interval", type=float,
+                        help="Fixed poll interval in seconds for the process and status file (disables adaptive polling)")
+    return parser.parse_args(argv)
+
+def run_headless(shutdown, worker):
+    """
+    Block until SIGTERM/SIGINT arrives (or the pipeline ends)
+    """
+    def handle_signal(signum, frame):
+        print(f"Received signal {signum}, shutting down...")
+        shutdown.request()
+
+    for name in ("SIGTERM", "SIGINT", "SIGBREAK"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), handle_signal)
+    # Wait in short steps so signal handlers get a chance to run
+    while worker.is_alive() and not shutdown.wait(0.5):
+        pass
+
+def shutdown_app(shutdown, worker, enrichment, services, history, session_recorder=None):
+    """
+    Wake all workers, let the pipeline clear the presence and log the last song, stop the background services,
+    then flush history and logs, all within the shutdown budget
+    """
+    shutdown.request()
+    worker.join(shutdown.remaining())
+    if worker.is_alive():
+        print("Pipeline did not stop in time")
+    # Queued lookups are dropped, a running upload may still finish and be cached
+    enrichment.close(min(1.0, shutdown.remaining()))
+    for service in services:
+        service.stop(timeout=shutdown.remaining())
+    if session_recorder and session_recorder.last_session_id:
+        log_write(dt=session_recorder.last_session_id, status="metrics", app=None, content=REGISTRY.summary(),
+                  directory=session_recorder.directory)
+    if history:
+        # Whatever is still queued is committed in one batch
+        history.close(timeout=max(0.5, shutdown.remaining()))
+    logging.shutdown()
+
+def main(argv=None):
+    global log_dir, cache_dir
+    args = parse_args(argv)
+    if args.log_dir:
+        log_dir = os.path.abspath(args.log_dir)
+    if args.cache_dir:
+        cache_dir = os.path.abspath(args.cache_dir)
+
+    # Command line options win over config.json, also after a reload
+    overrides = {}
+    if args.poll_interval:
+        overrides["poll_intervals"] = {"process": args.poll_interval, "status_file": args.poll_interval}
+        overrides["adaptive_polling"] = {"enabled": False}
+    config_path = find_config(args.config)
+    try:
+        config = get_config(config_path, overrides)
+    except ConfigError as e:
+        logging.error(f"Invalid configuration: {e}")
+        return 1
+
+    install = InstallDiscovery(os.path.join(cache_dir, "install_paths.json"))
+    history = get_history(config)
+    stats = get_play_stats(config)
+    shutdown = Shutdown(SHUTDOWN_BUDGET)
+    profiler = get_profiler(config, shutdown)
+    config_reloader = ConfigReloader(config_path, config, overrides)
+    scrobbler = get_scrobbler(config, shutdown)
+    profiles = profile_configs(config)
+    if profiles:
+        shared_sinks = [scrobbler] if scrobbler else []
+        pipeline, enrichment, services, recorders = get_profile_pipelines(
+            config, profiles, config_reloader, install, history, stats, shared_sinks, shutdown, profiler)
+        session_recorder = recorders[0]
+        # Profiles write to their own log folders; the main one only holds older sessions
+        retention = get_log_retention(config, None, shutdown)
+    else:
+        song_watcher = SongStatusWatcher(config, get_cover_cache(config), install=install)
+        # A single watcher runs its own lookups and uploads
+        enrichment = song_watcher
+        presence = Presence(config["discord_application_id"])
+        recorder = None
+        if config.get("record_session_dir"):
+            trace_name = datetime.now().strftime("trace-%Y%m%d%H%M%S")
+            recorder = TraceRecorder(os.path.join(config["record_session_dir"], trace_name))
+        session_recorder = SessionRecorder(history)
+        presence.stats = stats
+        check = process_check
+        if profiler:
+            # Only the stages run by the worker threads are profiled, never the tray
+            check = profiler.wrap(process_check)
+            profiler.profile_methods(song_watcher, "check_for_updates", "parse_song_status")
+            profiler.profile_methods(presence, "update_song_status")
+            profiler.profile_methods(session_recorder, "on_event")
+        sinks = [session_recorder, stats]
+        services = []
+        overlay_server = get_overlay_server(config)
+        if overlay_server:
+            sinks.append(overlay_server)
+            services.append(overlay_server)
+        if scrobbler:
+            sinks.append(scrobbler)
+        pipeline = RPCPipeline(presence, song_watcher, config, check, sinks=sinks,
+                               recorder=recorder, config_reloader=config_reloader,
+                               checkpoint=SessionCheckpoint(os.path.join(log_dir, "session.json")))
+        retention = get_log_retention(config, pipeline, shutdown)
+    shutdown.on_request(pipeline.stop)
+    metrics_server = get_metrics_server(config)
+    # The pipeline, or the supervisor running one pipeline per profile
+    worker = Thread(target=pipeline.run, name="RPCPipeline", daemon=True)
+    worker.start()
+
+    if args.headless:
+        run_headless(shutdown, worker)
+    else:
+        taskTray(config, profiler, shutdown, stats).run_program()
+    services = [service for service in [retention, metrics_server, profiler, *services, scrobbler, stats] if service]
+    shutdown_app(shutdown, worker, enrichment, services, history, session_recorder)
+    return 0
 
 if __name__ == "__main__":
-    Thread(target=app_run, daemon=True).start()
-    taskTray().run_program()
+    sys.exit(main())
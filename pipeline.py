@@ -0,0 +1,442 @@
+import time
+import asyncio
+import threading
+from datetime import datetime
+from utils.cadence import PollingCadence
+from utils.metrics import REGISTRY
+
+DEFAULT_INTERVALS = {
+    "process": 5,
+    "status_file": 1,
+    "presence_refresh": 15,
+    "config_reload": 2,
+    "checkpoint": 30,
+}
+
+task_restarts = REGISTRY.counter("pipeline_task_restarts_total", "Pipeline tasks restarted after an unexpected error")
+songs_started = REGISTRY.counter("songs_started_total", "Songs detected as started")
+
+
+def new_session_id():
+    """
+    Session ids double as the timestamp part of the rpc*.log/.srt file names
+    """
+    return datetime.now().strftime("%Y%m%d%H%M%S%f")
+
+
+def offer(q, item):
+    """
+    Put an item on a size-1 queue, replacing whatever is still waiting there
+    """
+    if q.full():
+        q.get_nowait()
+    q.put_nowait(item)
+
+
+class RPCPipeline:
+    """
+    Single asyncio scheduler for detection, enrichment and publishing.
+
+    Independent tasks are linked by queues:
+        process task  -> states     game up/down transitions and idle timeout
+        status task   -> changes    SongStatusOutput.txt was modified
+        enrich task   -> states     parsed and enriched song info
+        session task  -> sinks      session/game/song events
+                      -> presence   latest state to show
+        presence task               Discord updates and periodic refreshes
+        config task                 reloads config.json when it changes (optional)
+        checkpoint task -> states   asks for the session to be checkpointed (optional)
+
+    Sinks are objects with an `on_event(event, session_id, data, timestamp)`
+    method. Events are "session_start", "game_start" (data is the PID),
+    "song_start", "song_update" (late SynthDB details or cover), "song_stop"
+    (data is the song info), "game_stop" (data is the polling report) and
+    "session_end". Blocking work runs in the default
+    executor so the loop itself never waits on disk, network or process scans;
+    Discord calls get a daemon thread each, so a hung Discord cannot hold up
+    stop().
+
+    Poll intervals come from a PollingCadence, which adapts them to the game
+    state unless adaptive polling is disabled in the config.
+
+    With a SessionCheckpoint the session is saved right after it or the song
+    changes and every `checkpoint` seconds otherwise, and resumed on start if
+    the saved session has not timed out yet. Sinks take part by providing
+    `checkpoint()` (returning JSON-serializable state) and
+    `resume(session_id, state)`.
+    """
+    def __init__(self, presence, song_watcher, config, process_check, sinks=None, idle_timeout=10 * 60,
+                 recorder=None, config_reloader=None, finish_timeout=3.0, checkpoint=None):
+        self.presence = presence
+        self.song_watcher = song_watcher
+        self.config = config
+        self.process_check = process_check
+        self.sinks = list(sinks or [])
+        # Optional TraceRecorder capturing inputs for utils.replay
+        self.recorder = recorder
+        # Optional ConfigReloader; changes are applied without a restart
+        self.config_reloader = config_reloader
+        # Optional SessionCheckpoint to resume the session after a restart
+        self.checkpoint = checkpoint
+        self.idle_timeout = idle_timeout
+        # Longest time stop() may take to clear the presence on the way out
+        self.finish_timeout = finish_timeout
+        self.intervals = dict(DEFAULT_INTERVALS)
+        self.intervals.update(config.get("poll_intervals") or {})
+        self.cadence = PollingCadence(config.get("adaptive_polling"), self.intervals)
+
+        self.session_id = None
+        self.pid = None
+        self.current_song = None
+        # (song_id, start_time) of a song whose song_stop went out on shutdown while it kept playing
+        self._stopped_song = None
+
+        self._loop = None
+        self._stop_requested = False
+
+    def run(self):
+        """
+        Run the scheduler until stop() is called (blocks the calling thread)
+        """
+        asyncio.run(self.run_async())
+
+    def stop(self):
+        """
+        Ask the scheduler to finish; safe to call from any thread
+        """
+        self._stop_requested = True
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._stopping.set)
+            except RuntimeError:
+                # The loop already finished
+                pass
+
+    async def run_async(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._game_running = asyncio.Event()
+        self._wake_status = asyncio.Event()
+        self._states = asyncio.Queue()
+        self._changes = asyncio.Queue(maxsize=1)
+        self._presence_updates = asyncio.Queue(maxsize=1)
+        self._checkpoint_due = asyncio.Event()
+        if self._stop_requested:
+            self._stopping.set()
+        if self.checkpoint:
+            presence = await asyncio.to_thread(self._resume)
+            if self.pid:
+                self._game_running.set()
+                if presence:
+                    offer(self._presence_updates, ("payload", presence))
+
+        tasks = [
+            asyncio.create_task(self._guard(self._process_task), name="process"),
+            asyncio.create_task(self._guard(self._status_task), name="status"),
+            asyncio.create_task(self._guard(self._enrich_task), name="enrich"),
+            asyncio.create_task(self._guard(self._session_task), name="session"),
+            asyncio.create_task(self._guard(self._presence_task), name="presence"),
+        ]
+        if self.config_reloader:
+            tasks.append(asyncio.create_task(self._guard(self._config_task), name="config"))
+        if self.checkpoint:
+            tasks.append(asyncio.create_task(self._guard(self._checkpoint_task), name="checkpoint"))
+        try:
+            await self._stopping.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._finish()
+            self._loop = None
+
+    async def _guard(self, task):
+        # Keep a task alive across unexpected errors, like app_run used to
+        while True:
+            try:
+                await task()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in {task.__name__}: {e}")
+                task_restarts.inc()
+                await asyncio.sleep(1)
+
+    async def _finish(self):
+        # Handle what was detected but not processed yet, so the last song is logged
+        while not self._states.empty():
+            await self._on_state(*self._states.get_nowait())
+        now = time.time()
+        if self.current_song and not self._already_stopped(self.current_song):
+            await self._emit("song_stop", self.current_song, now)
+            # Saved with the song, so a restart picks it up as the same play instead of announcing it again
+            self._stopped_song = (self.current_song.get('song_id'), self.current_song.get('start_time'))
+        if self.pid:
+            try:
+                await asyncio.wait_for(self._call_presence(self._clear_presence), self.finish_timeout)
+            except asyncio.TimeoutError:
+                print("Discord did not respond, exiting without clearing the presence")
+        if self.checkpoint:
+            await asyncio.to_thread(self._save_checkpoint)
+        self.current_song = None
+
+    # Tasks
+
+    async def _process_task(self):
+        # A resumed session starts out with the game it was tracking
+        running = bool(self.pid)
+        not_running_since = None
+        while True:
+            pid = await asyncio.to_thread(self.process_check)
+            now = time.time()
+            if bool(pid) != running:
+                running = bool(pid)
+                not_running_since = None if running else now
+                if self.recorder:
+                    self.recorder.record_process(pid, now)
+                self._states.put_nowait(("process", pid, now))
+            elif not running and not_running_since and now - not_running_since > self.idle_timeout:
+                not_running_since = None
+                self._states.put_nowait(("timeout", None, now))
+            self.cadence.record_wakeup("process")
+            await asyncio.sleep(self.cadence.process_interval(running))
+
+    async def _status_task(self):
+        while True:
+            await self._game_running.wait()
+            self.cadence.record_wakeup("status_file")
+            if await asyncio.to_thread(self.song_watcher.check_for_updates):
+                now = time.time()
+                self.cadence.record_latency(now - self.song_watcher.last_modified)
+                if self.recorder:
+                    await asyncio.to_thread(self.recorder.record_status, self.song_watcher.song_status_path,
+                                            self.song_watcher.cover_image_path, self.song_watcher.last_modified)
+                offer(self._changes, now)
+            # Sleep until the interval passes or the game state changes
+            self._wake_status.clear()
+            try:
+                await asyncio.wait_for(self._wake_status.wait(), self.cadence.status_interval(self.current_song))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _enrich_task(self):
+        while True:
+            await self._changes.get()
+            song_info = await asyncio.to_thread(self.song_watcher.parse_song_status, self._late_song)
+            latest = self.song_watcher.current_song
+            if song_info and latest is not song_info and latest and latest.get('song_id') == song_info.get('song_id'):
+                # The rest of the enrichment finished before this returned and was handed over as a late
+                # update already (possibly ahead of this state); don't let the incomplete song replace it
+                song_info = latest
+            self._states.put_nowait(("song", song_info, time.time()))
+
+    def _late_song(self, song_info):
+        # Called from an enrichment worker once SynthDB details or the cover arrive after the deadline
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._states.put_nowait, ("song", song_info, time.time()))
+            except RuntimeError:
+                # The loop already finished
+                pass
+
+    async def _session_task(self):
+        while True:
+            await self._on_state(*await self._states.get())
+
+    async def _config_task(self):
+        while True:
+            await asyncio.sleep(self.intervals["config_reload"])
+            config = await asyncio.to_thread(self.config_reloader.check)
+            if config:
+                await self._apply_config(config)
+
+    async def _checkpoint_task(self):
+        while True:
+            self._checkpoint_due.clear()
+            try:
+                await asyncio.wait_for(self._checkpoint_due.wait(), self.intervals["checkpoint"])
+            except asyncio.TimeoutError:
+                pass
+            # Saved by the session task, so the state never changes halfway through
+            self._states.put_nowait(("checkpoint", None, time.time()))
+
+    async def _presence_task(self):
+        song_info = None
+        while True:
+            try:
+                kind, song_info = await asyncio.wait_for(self._presence_updates.get(), self.intervals["presence_refresh"])
+            except asyncio.TimeoutError:
+                self.cadence.record_wakeup("presence")
+                # Periodic refresh also reconnects after Discord was restarted
+                if not self._game_running.is_set():
+                    continue
+                kind = "song"
+            if kind == "clear":
+                await self._call_presence(self._clear_presence)
+            elif kind == "payload":
+                # Restored from the checkpoint, shown until the status file has been read again
+                await self._call_presence(self.presence.set, song_info)
+                song_info = self.current_song
+            else:
+                await self._call_presence(self.presence.update_song_status, song_info, self.config)
+
+    # Session state
+
+    async def _on_state(self, kind, value, timestamp):
+        if kind == "process":
+            await self._on_process(value, timestamp)
+        elif kind == "song":
+            await self._on_song(value, timestamp)
+        elif kind == "timeout" and self.session_id:
+            await self._emit("session_end", None, timestamp)
+            self.session_id = None
+            self._checkpoint_due.set()
+        elif kind == "checkpoint" and self.checkpoint:
+            await asyncio.to_thread(self._save_checkpoint)
+
+    async def _on_process(self, pid, timestamp):
+        if pid:
+            if not self.session_id:
+                self.session_id = new_session_id()
+                await self._emit("session_start", None, timestamp)
+            self.pid = pid
+            self.cadence.burst()
+            self._game_running.set()
+            await self._emit("game_start", pid, timestamp)
+            offer(self._presence_updates, ("song", self.current_song))
+            self._checkpoint_due.set()
+        else:
+            self._game_running.clear()
+            if self.current_song and not self._already_stopped(self.current_song):
+                await self._emit("song_stop", self.current_song, timestamp)
+            self.current_song = None
+            self.pid = None
+            await self._emit("game_stop", self.cadence.report(), timestamp)
+            offer(self._presence_updates, ("clear", None))
+            self._checkpoint_due.set()
+
+    async def _on_song(self, song_info, timestamp):
+        song_id = song_info.get('song_id') if song_info else None
+        prev_song_id = self.current_song.get('song_id') if self.current_song else None
+        if prev_song_id and song_id != prev_song_id:
+            self.cadence.burst()
+            self._wake_status.set()
+            if not self._already_stopped(self.current_song):
+                await self._emit("song_stop", self.current_song, timestamp)
+        if song_id and song_id != prev_song_id:
+            await self._emit("song_start", song_info, timestamp)
+            songs_started.inc()
+        elif song_id and song_info is not self.current_song and not self._already_stopped(song_info):
+            await self._emit("song_update", song_info, timestamp)
+        if song_id != prev_song_id:
+            self._checkpoint_due.set()
+        self.current_song = song_info if song_id else None
+        offer(self._presence_updates, ("song", song_info))
+
+    async def _apply_config(self, config):
+        self.config = config
+        self.intervals = dict(DEFAULT_INTERVALS)
+        self.intervals.update(config.get("poll_intervals") or {})
+        self.cadence.configure(config.get("adaptive_polling"), self.intervals)
+        await asyncio.to_thread(self._reconfigure, config)
+        print("Config reloaded")
+        # Show the new settings right away and re-check the status file with the new paths
+        self._wake_status.set()
+        if self.pid:
+            offer(self._presence_updates, ("song", self.current_song))
+
+    def _resume(self):
+        """
+        Take over the session from the checkpoint if it is recent enough
+
+        Returns:
+            dict: The last presence payload of the resumed session, or None
+        """
+        state = self.checkpoint.load(max_age=self.idle_timeout)
+        if not state:
+            return None
+        self.session_id = state["session_id"]
+        self.pid = state.get("pid")
+        if state.get("song"):
+            self.current_song = self.song_watcher.resume(state["song"])
+            if state.get("song_stopped"):
+                self._stopped_song = (self.current_song.get('song_id'), self.current_song.get('start_time'))
+        saved = state.get("sinks") or {}
+        for sink in self.sinks:
+            if hasattr(sink, "resume"):
+                try:
+                    sink.resume(self.session_id, saved.get(type(sink).__name__))
+                except Exception as e:
+                    print(f"Error resuming {type(sink).__name__}: {e}")
+        print(f"Resumed session {self.session_id}")
+        return state.get("presence")
+
+    def _save_checkpoint(self):
+        if not self.session_id:
+            self.checkpoint.clear()
+            return
+        sinks = {}
+        for sink in self.sinks:
+            if hasattr(sink, "checkpoint"):
+                sinks[type(sink).__name__] = sink.checkpoint()
+        self.checkpoint.save({
+            "session_id": self.session_id,
+            "pid": self.pid,
+            "song": dict(self.current_song) if self.current_song else None,
+            "song_stopped": self._already_stopped(self.current_song),
+            "presence": getattr(self.presence, "last_update", None),
+            "sinks": sinks,
+        })
+
+    def _already_stopped(self, song_info):
+        # The play was logged when the app was stopped; it is not started or stopped a second time
+        return bool(song_info) and self._stopped_song == (song_info.get('song_id'), song_info.get('start_time'))
+
+    def _reconfigure(self, config):
+        self.song_watcher.apply_config(config)
+        self.presence.apply_config(config)
+
+    async def _call_presence(self, func, *args):
+        # asyncio.run() waits for every default executor thread on exit, so Discord calls don't use it
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def settle(result, error):
+            if future.done():
+                return
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        def run():
+            result, error = None, None
+            try:
+                result = func(*args)
+            except Exception as e:
+                error = e
+            try:
+                loop.call_soon_threadsafe(settle, result, error)
+            except RuntimeError:
+                # The loop already finished
+                pass
+
+        threading.Thread(target=run, name="Presence", daemon=True).start()
+        return await future
+
+    def _clear_presence(self):
+        self.presence.update_song_status(None, self.config)
+        self.presence.disconnect()
+
+    async def _emit(self, event, data, timestamp):
+        await asyncio.to_thread(self._dispatch, event, self.session_id, data, timestamp)
+
+    def _dispatch(self, event, session_id, data, timestamp):
+        for sink in self.sinks:
+            try:
+                sink.on_event(event, session_id, data, timestamp)
+            except Exception as e:
+                print(f"Error handling {event} event: {e}")
@@ -1,42 +1,306 @@
 import os
 import time
 import re
-import requests
+import hashlib
 import tempfile
+import threading
 from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 from utils.synth_db import get_song_details_from_synthdb
+from utils.metrics import REGISTRY, timed
+from utils.file_watch import FileWatch
+from utils.single_flight import SingleFlight
+from utils.steam import DEFAULT_PATHS
+
+upload_failures = REGISTRY.counter("upload_failures_total", "Cover uploads that did not return a URL")
+enrichment_late = REGISTRY.counter("enrichment_late_total",
+                                   "Songs whose SynthDB details or cover missed the enrichment deadline")
+upload_duplicates = REGISTRY.counter("upload_duplicates_total",
+                                     "Cover uploads that joined an upload of the same image already in flight")
+lookup_duplicates = REGISTRY.counter("lookup_duplicates_total",
+                                     "SynthDB lookups that joined a lookup of the same song already in flight")
+synthdb_index_hits = REGISTRY.counter("synthdb_index_hits_total",
+                                     "SynthDB lookups answered by a profile sharing the same SynthDB")
+detection_lag = REGISTRY.histogram("song_detection_lag_seconds",
+                                   "Time from the game writing the status file until a new song was parsed")
+
+def make_song_key(song_name, artist):
+    """
+    Build a stable key identifying a song independent of difficulty
+    """
+    return f"{artist.strip().lower()}|{song_name.strip().lower()}"
+
+class SongInfo:
+    """
+    Parsed and enriched song status.
+
+    Slotted to keep the per-song record small. Supports the read-only dict
+    access (`info['song_name']`, `info.get(...)`, `in`) the rest of the app
+    used before; SynthDB fields that were not found behave like missing keys.
+    Fields still at their default are not stored: creating a record only
+    sets the five fields read from the status file, which is what makes
+    parsing cheaper than the dict it replaced.
+    """
+    __slots__ = ('song_name', 'artist', 'difficulty', 'mapper', 'song_id', 'has_cover', 'cover_path', 'cover_url',
+                 'synthdb_id', 'image_file', 'duration', 'bpm', 'year', 'is_custom', 'environment', 'start_time',
+                 'end_time', 'detection_lag')
+
+    # Only present once SynthDB knows the song
+    OPTIONAL_FIELDS = frozenset(('synthdb_id', 'image_file', 'duration', 'bpm', 'year', 'is_custom', 'environment',
+                                 'end_time'))
+
+    # Values of the fields not set yet. start_time is seconds since the epoch with sub-second precision, from the
+    # status file's write time; detection_lag the seconds between the game writing the status file and us parsing it
+    DEFAULTS = {'has_cover': False, 'cover_path': None, 'cover_url': None, 'synthdb_id': None, 'image_file': None,
+                'duration': None, 'bpm': None, 'year': None, 'is_custom': None, 'environment': None,
+                'start_time': None, 'end_time': None, 'detection_lag': None}
+
+    def __init__(self, song_name="Unknown", artist="Unknown", difficulty="Unknown", mapper="Unknown"):
+        self.song_name = song_name
+        self.artist = artist
+        self.difficulty = difficulty
+        self.mapper = mapper
+        self.song_id = make_song_key(song_name, artist)
+
+    def __getattr__(self, name):
+        # Only called for slots that were never set
+        try:
+            return SongInfo.DEFAULTS[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def set_title(self, song_name, artist):
+        # song_id stays the key of the status line, so a late SynthDB answer doesn't look like a new song
+        self.song_name = song_name
+        self.artist = artist
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuild a song from to_dict() output, e.g. from a session checkpoint
+        """
+        info = cls()
+        for key, value in data.items():
+            if key in cls.__slots__:
+                setattr(info, key, value)
+        return info
+
+    def copy(self):
+        other = SongInfo.__new__(SongInfo)
+        for key in self.__slots__:
+            setattr(other, key, getattr(self, key))
+        return other
+
+    def apply_synthdb(self, db_details):
+        self.synthdb_id = db_details['id']
+        self.image_file = db_details.get('image_file')
+        self.duration = db_details['duration']
+        self.bpm = db_details['bpm']
+        self.year = db_details['year']
+        self.is_custom = db_details['is_custom']
+        self.environment = db_details['environment']
+        # If mapper wasn't detected from the status text but exists in DB, use the DB value
+        if self.mapper == "Unknown" and db_details['mapper']:
+            self.mapper = db_details['mapper']
+
+    def __contains__(self, key):
+        return key in self.__slots__ and (key not in self.OPTIONAL_FIELDS or getattr(self, key) is not None)
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self else default
+
+    def keys(self):
+        return [key for key in self.__slots__ if key in self]
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.keys()}
+
+    def __eq__(self, other):
+        if isinstance(other, SongInfo):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"SongInfo({self.to_dict()!r})"
+
+
+def title_splits(line):
+    """
+    Possible (song_name, artist) readings of a "<title> by <artist>" line
+
+    The last " by " is the most likely separator since titles contain " by "
+    far more often than artist names do ("Stand by Me by Ben E. King").
+    """
+    splits = []
+    end = len(line)
+    while True:
+        index = line.rfind(' by ', 0, end)
+        if index < 0:
+            return splits
+        splits.append((line[:index].strip(), line[index + 4:].strip()))
+        end = index
+
+
+def parse_status_text(content):
+    """
+    Parse SongStatusOutput.txt content in a single pass
+
+    Returns:
+        SongInfo: Title, artist, difficulty and mapper, or None for an empty status
+    """
+    lines = content.strip().split('\n', 2)
+    first = lines[0]
+    if not first:
+        return None
+    # The record is created once, with everything the two lines give
+    song_name, by, artist = first.rpartition(' by ')
+    if by:
+        song_name = song_name.strip()
+        artist = artist.strip()
+    else:
+        song_name = artist.strip()
+        artist = "Unknown"
+    if len(lines) > 1:
+        difficulty, marker, mapper = lines[1].partition('(mapped by ')
+        if marker:
+            mapper = mapper.strip()
+            if mapper[-1:] == ')':
+                mapper = mapper[:-1]
+            return SongInfo(song_name, artist, difficulty.strip(), mapper)
+        difficulty = difficulty.strip()
+        if difficulty:
+            return SongInfo(song_name, artist, difficulty)
+    return SongInfo(song_name, artist)
+
+
+class SharedEnrichment:
+    """
+    Enrichment shared by the watchers of several profiles.
+
+    One thread pool, one cover cache and one set of in-flight lookups and
+    uploads serve all watchers. SynthDB results are remembered per database
+    file until the file changes, so profiles pointing at the same SynthDB
+    look each song up once between them; profiles with their own SynthDB
+    never see each other's results.
+    """
+    def __init__(self, workers=4, cover_cache=None, max_songs=1024):
+        self.workers = workers
+        self.cover_cache = cover_cache
+        self.max_songs = max_songs
+        self.uploads = SingleFlight(upload_duplicates)
+        self.lookups = SingleFlight(lookup_duplicates)
+        self._known = OrderedDict()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="Enrich")
+            return self._executor
+
+    def known(self, db_path, song_id, lookup, *args):
+        """
+        SynthDB details of a song, from a watcher with the same SynthDB if one looked it up already
+        """
+        try:
+            stamp = os.stat(db_path).st_mtime_ns
+        except OSError:
+            stamp = None
+        key = (db_path, song_id)
+        with self._lock:
+            hit = self._known.get(key)
+            if hit and hit[0] == stamp:
+                self._known.move_to_end(key)
+                synthdb_index_hits.inc()
+                return hit[1]
+        result = lookup(*args)
+        with self._lock:
+            self._known[key] = (stamp, result)
+            while len(self._known) > self.max_songs:
+                self._known.popitem(last=False)
+        return result
+
+    def close(self, timeout=5.0):
+        """
+        Same as SongStatusWatcher.close, for all watchers at once
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is None:
+            return True
+        executor.shutdown(wait=False, cancel_futures=True)
+        deadline = time.monotonic() + timeout
+        for thread in list(executor._threads):
+            thread.join(max(0.0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in executor._threads)
 
 class SongStatusWatcher:
     """
     Watches the SongStatusOutput.txt file for changes and parses song information
     """
-    def __init__(self, config):
-        self.config = config
-        self.song_status_path = config.get("song_status_path",
-                                         "C:\\Program Files (x86)\\Steam\\steamapps\\common\\SynthRiders\\SynthRidersUC\\SongStatusOutput.txt")
-        self.cover_image_path = config.get("cover_image_path",
-                                         "C:\\Program Files (x86)\\Steam\\steamapps\\common\\SynthRiders\\SynthRidersUC\\SongStatusImage.png")
-        self.image_upload_url = config.get("image_upload_url", "https://uguu.se/upload")
-        self.db_path = config.get("synth_db_path",
-                                "C:\\Program Files (x86)\\Steam\\steamapps\\common\\SynthRiders\\SynthDB")
+    def __init__(self, config, cover_cache=None, clock=time.time, install=None, shared=None):
+        # Optional SharedEnrichment when several profiles are watched; its cover cache is used then
+        self.shared = shared
+        # Optional CoverCache keeping covers and upload URLs across songs
+        self.cover_cache = shared.cover_cache if shared else cover_cache
+        # Optional InstallDiscovery filling in paths that don't exist from the Steam libraries
+        self.install = install
+        self.clock = clock
         self.last_modified = 0
         self.current_song = None
         self.has_cover_image = False
         self.song_start_time = None
+        self.song_detection_lag = None
+        self.status_watch = None
+        self._executor = None
+        # Status rewrites while browsing menus or restarting a song share the request already running
+        self._uploads = shared.uploads if shared else SingleFlight(upload_duplicates)
+        self._lookups = shared.lookups if shared else SingleFlight(lookup_duplicates)
+        self.apply_config(config)
+
+    def apply_config(self, config):
+        """
+        Take over paths and upload settings from a (re)loaded config
+        """
+        previous = (getattr(self, "song_status_path", None), getattr(self, "cover_image_path", None),
+                    getattr(self, "db_path", None))
+        self.config = config
+        if self.install:
+            paths = self.install.resolve(config)
+        else:
+            paths = {key: config.get(key, default) for key, default in DEFAULT_PATHS.items()}
+        self.song_status_path = paths["song_status_path"]
+        self.cover_image_path = paths["cover_image_path"]
+        self.image_upload_url = config.get("image_upload_url", "https://uguu.se/upload")
+        self.db_path = paths["synth_db_path"]
+        enrichment = config.get("enrichment") or {}
+        # Seconds to wait for SynthDB and the cover before the first presence update
+        self.enrich_deadline = enrichment.get("deadline", 1.5)
+        self.enrich_workers = enrichment.get("workers", 4)
+        # Re-read the status on the next check so a new path or SynthDB takes effect
+        if self.status_watch and previous != (self.song_status_path, self.cover_image_path, self.db_path):
+            self.status_watch.reset()
 
     def check_for_updates(self):
         """
         Check if the song status file has been updated
         """
         try:
-            if not os.path.exists(self.song_status_path):
-                return False
-
-            current_modified = os.path.getmtime(self.song_status_path)
+            if self.status_watch is None or self.status_watch.path != self.song_status_path:
+                self.status_watch = FileWatch(self.song_status_path)
 
             # Check if file has been modified
-            if current_modified != self.last_modified:
-                self.last_modified = current_modified
+            if self.status_watch.changed():
+                self.last_modified = self.status_watch.last_modified
                 return True
 
             return False
@@ -44,17 +308,20 @@ class SongStatusWatcher:
             print(f"Error checking song status file: {e}")
             return False
 
+    @timed("upload_image")
     def upload_image(self, image_path):
         """
         Upload an image to uguu.se and return the URL
         """
+        # Deferred so startup doesn't pay for requests until a cover is uploaded
+        import requests
         try:
             if not os.path.exists(image_path) or os.path.getsize(image_path) == 0:
                 return None
 
             # Upload the image
             with open(image_path, "rb") as image_file:
-                response = requests.post(self.image_upload_url, files={"files[]": image_file})
+                response = requests.post(self.image_upload_url, files={"files[]": image_file}, timeout=30)
 
             # Parse and return the URL from response
             if response.status_code == 200:
@@ -62,97 +329,227 @@ class SongStatusWatcher:
                     return response.json()["files"][0]["url"]
                 except (KeyError, IndexError, ValueError):
                     print(f"Unexpected response format: {response.text}")
+                    upload_failures.inc()
                     return None
             else:
                 print(f"Upload failed with status code {response.status_code}")
+                upload_failures.inc()
                 return None
 
         except Exception as e:
             print(f"Error uploading image: {e}")
+            upload_failures.inc()
             return None
 
-    def parse_song_status(self):
+    @timed("parse_song_status")
+    def parse_song_status(self, on_late=None):
         """
         Parse the song status file and extract information
+
+        Without `on_late` this waits for all enrichment. With it, the song is
+        returned once the enrichment deadline passes, and `on_late` is called
+        from a worker thread with the completed song when the rest arrives.
         """
         try:
-            if not os.path.exists(self.song_status_path):
+            try:
+                with open(self.song_status_path, 'r', encoding='utf-8') as file:
+                    content = file.read()
+                    # When the game wrote what we just read
+                    written_at = os.fstat(file.fileno()).st_mtime_ns / 1e9
+            except FileNotFoundError:
                 return None
+            parsed_at = self.clock()
 
-            # Check if file is empty (no active song)
-            if os.path.getsize(self.song_status_path) == 0:
+            song_info = parse_status_text(content)
+            if song_info is None:
+                # Empty file, no active song
                 self.current_song = None
                 self.has_cover_image = False
                 return None
 
-            with open(self.song_status_path, 'r', encoding='utf-8') as file:
-                content = file.read().strip()
+            # A new song started when the game wrote the file, not when we noticed
+            if self.current_song is None or self.current_song.get('song_id') != song_info.song_id:
+                self.song_start_time = written_at
+                self.song_detection_lag = max(0.0, parsed_at - written_at)
+                detection_lag.observe(self.song_detection_lag)
+            song_info.start_time = self.song_start_time
+            song_info.detection_lag = self.song_detection_lag
 
-            if not content:
-                self.current_song = None
-                self.has_cover_image = False
-                return None
+            # SynthDB lookup and cover processing/upload run side by side
+            executor = self._enrich_executor()
+            lookup = self._lookups.submit(executor, (self.db_path, song_info.song_id), self._lookup,
+                                          song_info.song_id, song_info.song_name, song_info.artist)
+            cover = executor.submit(self._prepare_cover)
+            futures = [lookup, cover]
+            wait(futures, timeout=self.enrich_deadline if on_late else None)
+            upload = self._apply_enrichment(song_info, lookup, cover)
+            if upload:
+                futures.append(upload)
+                if not on_late:
+                    upload.result()
+                    self._apply_enrichment(song_info, lookup, cover, upload)
+            self.has_cover_image = song_info.has_cover
+            self.current_song = song_info
 
-            # Parse song information from content
-            lines = content.split('\n')
+            if not all(future.done() for future in futures):
+                enrichment_late.inc()
+                lock = threading.Lock()
+                state = {"finished": False}
 
-            # Basic parsing - extract song and artist from first line
-            song_info = {}
+                def follow_up(_):
+                    with lock:
+                        if state["finished"] or not all(future.done() for future in futures):
+                            return
+                        completed = song_info.copy()
+                        upload = self._apply_enrichment(completed, lookup, cover,
+                                                        futures[2] if len(futures) > 2 else None)
+                        if upload:
+                            # The cached cover's URL expired; follow up again once it is uploaded
+                            futures.append(upload)
+                        else:
+                            state["finished"] = True
+                    if upload:
+                        upload.add_done_callback(follow_up)
+                        return
+                    # Drop it if another song or an empty status came in meanwhile
+                    if self.current_song is song_info:
+                        self.current_song = completed
+                        self.has_cover_image = completed.has_cover
+                        on_late(completed)
 
-            if lines and ' by ' in lines[0]:
-                song_name, artist = lines[0].split(' by ', 1)
-                song_info['song_name'] = song_name.strip()
-                song_info['artist'] = artist.strip()
-            else:
-                song_info['song_name'] = lines[0].strip() if lines else "Unknown"
-                song_info['artist'] = "Unknown"
-
-            # Extract difficulty and mapper from second line
-            if len(lines) > 1 and '(mapped by ' in lines[1]:
-                difficulty, mapper_part = lines[1].split('(mapped by ', 1)
-                song_info['difficulty'] = difficulty.strip()
-                song_info['mapper'] = mapper_part.strip().rstrip(')')
-            else:
-                song_info['difficulty'] = lines[1].strip() if len(lines) > 1 else "Unknown"
-                song_info['mapper'] = "Unknown"
+                for future in list(futures):
+                    future.add_done_callback(follow_up)
+            return song_info
 
-            # Check if cover image exists
-            self.has_cover_image = os.path.exists(self.cover_image_path) and os.path.getsize(self.cover_image_path) > 0
-            song_info['has_cover'] = self.has_cover_image
-            song_info['cover_path'] = self.cover_image_path if self.has_cover_image else None
+        except Exception as e:
+            print(f"Error parsing song status: {e}")
+            return None
 
-            # Upload cover image if available
-            if self.has_cover_image:
-                song_info['cover_url'] = self.upload_image(self.cover_image_path)
-            else:
-                song_info['cover_url'] = None
+    def _enrich_executor(self):
+        if self.shared:
+            return self.shared.executor()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.enrich_workers, thread_name_prefix="Enrich")
+        return self._executor
 
-            # Get song details from SynthDB
-            db_details = get_song_details_from_synthdb(self.db_path, song_info['song_name'], song_info['artist'])
-            if db_details:
-                # Add database details to song_info
-                song_info['duration'] = db_details['duration']
-                song_info['bpm'] = db_details['bpm']
-                song_info['year'] = db_details['year']
-                song_info['is_custom'] = db_details['is_custom']
-                song_info['environment'] = db_details['environment']
+    def close(self, timeout=5.0):
+        """
+        Drop queued enrichment and give lookups and uploads already running up to `timeout` seconds to finish
 
-                # If mapper wasn't detected from the status text but exists in DB, use the DB value
-                if song_info['mapper'] == "Unknown" and db_details['mapper']:
-                    song_info['mapper'] = db_details['mapper']
+        Returns:
+            bool: True if nothing is left running
+        """
+        executor, self._executor = self._executor, None
+        if executor is None:
+            return True
+        executor.shutdown(wait=False, cancel_futures=True)
+        deadline = time.monotonic() + timeout
+        for thread in list(executor._threads):
+            thread.join(max(0.0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in executor._threads)
 
-            # Set the song start time when a new song is detected
-            if self.current_song is None or self.current_song.get('song_name') != song_info['song_name']:
-                self.song_start_time = int(time.time())
+    def _lookup(self, song_id, song_name, artist):
+        if self.shared:
+            return self.shared.known(self.db_path, song_id, self._lookup_synthdb, song_name, artist)
+        return self._lookup_synthdb(song_name, artist)
 
-            song_info['start_time'] = self.song_start_time
+    def _lookup_synthdb(self, song_name, artist):
+        """
+        Get song details from SynthDB, trying other readings of titles containing " by "
 
-            self.current_song = song_info
-            return song_info
+        Returns:
+            tuple: (song_name, artist, details) of the reading SynthDB knows, or None
+        """
+        splits = title_splits(f"{song_name} by {artist}") if artist != "Unknown" else []
+        for song_name, artist in splits or [(song_name, artist)]:
+            db_details = get_song_details_from_synthdb(self.db_path, song_name, artist)
+            if db_details:
+                return song_name, artist, db_details
+        return None
 
-        except Exception as e:
-            print(f"Error parsing song status: {e}")
+    def _prepare_cover(self):
+        """
+        Store (if cached) and upload the current status image
+
+        Returns:
+            tuple: (digest, path, url) of the cover, or None if the game wrote no image
+        """
+        try:
+            with open(self.cover_image_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if not data:
             return None
+        if not self.cover_cache:
+            digest = hashlib.sha1(data).hexdigest()
+            return digest, self.cover_image_path, self._uploads.do(digest, self.upload_image, self.cover_image_path)
+        return self._upload_cached(self.cover_cache.put(data))
+
+    def _upload_cached(self, entry):
+        # Reuse the upload URL while it is still valid
+        url = self.cover_cache.upload_url(entry.digest)
+        if url is None:
+            url = self._uploads.do(entry.digest, self._upload_entry, entry)
+        return entry.digest, entry.path, url
+
+    def _upload_entry(self, entry):
+        url = self.upload_image(entry.path)
+        if url:
+            self.cover_cache.set_upload_url(entry.digest, url)
+        return url
+
+    def _apply_enrichment(self, song_info, lookup, cover, upload=None):
+        """
+        Copy finished enrichment results onto a song
+
+        Returns:
+            Future: A re-upload of a cached cover whose URL expired, started here when `upload` is None
+        """
+        if lookup.done() and not lookup.exception() and lookup.result():
+            song_name, artist, db_details = lookup.result()
+            song_info.set_title(song_name, artist)
+            song_info.apply_synthdb(db_details)
+            if song_info.duration:
+                song_info.end_time = song_info.start_time + song_info.duration
+        if not cover.done() or cover.exception():
+            return
+        result = cover.result()
+        if self.cover_cache and song_info.synthdb_id is not None:
+            if result:
+                self.cover_cache.link(result[0], song_info.synthdb_id, song_info.image_file)
+            else:
+                # Repeat play after the game already replaced the image: take the cover from the cache
+                entry = self.cover_cache.lookup(song_info.synthdb_id, song_info.image_file)
+                if entry:
+                    url = self.cover_cache.upload_url(entry.digest)
+                    if url is None and upload is None:
+                        # Uploaded in the background so the enrichment deadline still holds
+                        song_info.has_cover = True
+                        song_info.cover_path = entry.path
+                        return self._uploads.submit(self._enrich_executor(), entry.digest, self._upload_entry,
+                                                    entry)
+                    if url is None and upload.done() and not upload.exception():
+                        url = upload.result()
+                    result = entry.digest, entry.path, url
+        if result:
+            song_info.has_cover = True
+            song_info.cover_path, song_info.cover_url = result[1], result[2]
+        return None
+
+    def resume(self, data):
+        """
+        Continue the song from a session checkpoint, keeping its start time when the status file still shows it
+
+        Returns:
+            SongInfo: The restored song
+        """
+        song_info = SongInfo.from_dict(data)
+        self.current_song = song_info
+        self.has_cover_image = song_info.has_cover
+        self.song_start_time = song_info.start_time
+        self.song_detection_lag = song_info.detection_lag
+        return song_info
 
     def get_song_status(self):
         """
@@ -0,0 +1,122 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.metrics import REGISTRY
+
+scan_reuses = REGISTRY.counter("process_scan_reuses_total",
+                               "Process checks of a profile answered by a scan another profile just made")
+
+
+class SharedProcessScan:
+    """
+    One process scan for all profiles.
+
+    Listing processes and reading their executable paths is the most
+    expensive thing the app does while idle. Every profile checks through
+    its own `checker`, and a scan younger than `max_age` seconds is reused,
+    so the number of scans stays about the same however many profiles run.
+    A check may see the game up to `max_age` seconds late.
+    """
+    def __init__(self, scan, max_age=2.0, clock=time.monotonic):
+        # Callable returning (pid, executable path) pairs of the running game processes
+        self.scan = scan
+        self.max_age = max_age
+        self.clock = clock
+        self._result = []
+        self._scanned_at = None
+        self._lock = threading.Lock()
+
+    def processes(self):
+        # Profiles checking at the same moment wait for one scan instead of running their own
+        with self._lock:
+            if self._scanned_at is not None and self.clock() - self._scanned_at < self.max_age:
+                scan_reuses.inc()
+                return self._result
+            self._result = self.scan()
+            self._scanned_at = self.clock()
+            return self._result
+
+    def checker(self, game_dir):
+        """
+        process_check for a pipeline: the PID of a game process started from inside `game_dir`
+        """
+        # With the separator, D:\Games\SynthRiders does not claim D:\Games\SynthRiders-Beta
+        prefix = os.path.join(os.path.normcase(os.path.normpath(game_dir)), "")
+
+        def process_check():
+            for pid, exe in self.processes():
+                if os.path.normcase(os.path.normpath(exe)).startswith(prefix):
+                    return pid
+            return False
+        return process_check
+
+
+def game_dir_of(song_status_path):
+    """
+    Install directory of the game a status file belongs to (<game>/SynthRidersUC/SongStatusOutput.txt)
+    """
+    return os.path.dirname(os.path.dirname(os.path.abspath(song_status_path)))
+
+
+class NullPresence:
+    """
+    Stand-in for Presence in profiles that don't update Discord
+    """
+    last_update = None
+
+    def apply_config(self, config):
+        pass
+
+    def set(self, data):
+        self.last_update = data
+
+    def update_song_status(self, song_info, config):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+class PipelineSupervisor:
+    """
+    Runs the pipelines of several profiles on one event loop.
+
+    Each pipeline keeps its own session, watcher, presence and sinks; they
+    share the loop, its worker threads and whatever was passed to several of
+    them (process scan, enrichment, history). A pipeline that fails does not
+    take the others down.
+    """
+    def __init__(self, pipelines, names=None):
+        self.pipelines = list(pipelines)
+        self.names = list(names or (f"profile {i}" for i in range(len(self.pipelines))))
+
+    def run(self):
+        """
+        Run all pipelines until stop() is called (blocks the calling thread)
+        """
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
+        # The default executor sizes itself for one pipeline's blocking calls
+        workers = min(32, 4 + 2 * len(self.pipelines))
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Pipeline"))
+        results = await asyncio.gather(*(pipeline.run_async() for pipeline in self.pipelines),
+                                       return_exceptions=True)
+        for name, result in zip(self.names, results):
+            if isinstance(result, Exception):
+                print(f"Pipeline of {name} stopped with an error: {result}")
+
+    def stop(self):
+        """
+        Ask all pipelines to finish; safe to call from any thread
+        """
+        for pipeline in self.pipelines:
+            pipeline.stop()
+
+    @property
+    def session_ids(self):
+        return {name: pipeline.session_id for name, pipeline in zip(self.names, self.pipelines)}
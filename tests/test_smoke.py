@@ -12,17 +12,54 @@ import sys
 import tempfile
 import shutil
 import time
+import threading
+import cProfile
+import pstats
 import json
 import sqlite3
+import gzip
+import tarfile
+import socket
+import base64
+import asyncio
+import urllib.request
+import signal
+import subprocess
+from datetime import date, datetime
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import Mock, patch, MagicMock
 import unittest
 
+from PIL import Image
+
 # Add the project root to the path so we can import our modules
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from song_status import SongStatusWatcher
+from song_status import SharedEnrichment, SongStatusWatcher, SongInfo, parse_status_text
 from discordrp import Presence
+from pipeline import RPCPipeline
+from supervisor import NullPresence, PipelineSupervisor, SharedProcessScan, game_dir_of
 from utils.synth_db import get_song_details_from_synthdb
+from utils.history import APP_LOG_DIR, HistoryStore
+from utils.log_retention import LogRetentionManager
+from utils.timeline import SessionTimeline
+from utils.cadence import PollingCadence
+from utils.update_check import UpdateChecker
+from utils.replay import TraceRecorder, ReplayDriver
+from utils.metrics import MetricsRegistry, MetricsServer, timed
+from utils.profiling import Profiler
+from utils.config import Config, ConfigError, ConfigReloader, ProfileReloader, load_config, profile_configs
+from utils.broadcast import NowPlayingServer, read_ws_frame
+from utils.cover_cache import CoverCache
+from utils.single_flight import SingleFlight
+from utils.shutdown import Shutdown
+from utils.checkpoint import SessionCheckpoint
+from utils.steam import InstallDiscovery, parse_vdf, steam_roots
+from utils.stats import PlayStats
+from utils.paths import app_dir
+from utils.log_import import import_logs
+from utils.scrobble import (ListenBrainzBackend, HttpBackend, ScrobbleQueue, ScrobbleReceiver, ScrobbleSender,
+                            make_backends)
 
 
 class TestSongStatusWatcher(unittest.TestCase):
@@ -181,6 +218,119 @@ class TestSongStatusWatcher(unittest.TestCase):
         self.assertIsNotNone(result)
         self.assertEqual(result['song_name'], 'Eden')
         self.assertEqual(result['artist'], 'Au5 & Danyka Nadeau')
+    
+    def test_title_containing_by_uses_synthdb_fallback(self):
+        """Test the other readings of a title with several " by " are tried against SynthDB"""
+        with open(self.song_status_path, 'w') as f:
+            f.write("Killed by Death by Motörhead\nMaster (mapped by riffmaster :))")
+        
+        details = {'id': 7, 'duration': 200, 'bpm': 160, 'year': '', 'is_custom': True, 'environment': '',
+                   'mapper': 'riffmaster :)'}
+        lookups = []
+        
+        def lookup(db_path, song_name, artist):
+            lookups.append((song_name, artist))
+            return details if artist == "Death by Motörhead" else None
+        
+        watcher = SongStatusWatcher(self.config)
+        with patch('song_status.get_song_details_from_synthdb', side_effect=lookup):
+            result = watcher.parse_song_status()
+        
+        self.assertEqual(lookups, [("Killed by Death", "Motörhead"), ("Killed", "Death by Motörhead")])
+        self.assertEqual(result['song_name'], 'Killed')
+        self.assertEqual(result['synthdb_id'], 7)
+        self.assertEqual(result['mapper'], 'riffmaster :)')
+    
+    def test_start_time_from_status_file_write(self):
+        """Test the start time comes from the file's mtime, not from when it was parsed"""
+        with open(self.song_status_path, 'w') as f:
+            f.write("Berzerk by Eminem\nMaster (mapped by AudioTiZm)")
+        written_ns = 1_700_000_000_250_000_000
+        os.utime(self.song_status_path, ns=(written_ns, written_ns))
+        details = {'id': 1, 'duration': 180, 'bpm': 140, 'year': '', 'is_custom': True, 'environment': '',
+                   'mapper': 'AudioTiZm'}
+        
+        watcher = SongStatusWatcher(self.config, clock=lambda: written_ns / 1e9 + 2.5)
+        with patch.object(watcher, 'upload_image', return_value=None), \
+                patch('song_status.get_song_details_from_synthdb', return_value=details):
+            result = watcher.parse_song_status()
+        
+        self.assertAlmostEqual(result['start_time'], 1_700_000_000.25, places=3)
+        self.assertAlmostEqual(result['end_time'], 1_700_000_180.25, places=3)
+        self.assertAlmostEqual(result['detection_lag'], 2.5, places=3)
+        
+        with patch('discordrp.PyPresence') as mock_pypresence:
+            presence = Presence("test_client_id")
+            presence.connected = True
+            presence.update_song_status(result, self.config)
+        activity = mock_pypresence.return_value.update.call_args.kwargs
+        self.assertEqual((activity['start'], activity['end']), (1_700_000_000, 1_700_000_180))
+    
+    def test_late_enrichment_follows_up(self):
+        """Test a slow SynthDB lookup misses the deadline and arrives in a follow-up"""
+        with open(self.song_status_path, 'w') as f:
+            f.write("Berzerk by Eminem\nMaster (mapped by AudioTiZm)")
+        with open(self.cover_image_path, 'wb') as f:
+            f.write(b"cover")
+        details = {'id': 1, 'duration': 180, 'bpm': 140, 'year': '', 'is_custom': True, 'environment': '',
+                   'mapper': 'AudioTiZm'}
+        release = threading.Event()
+        late = []
+        arrived = threading.Event()
+        
+        def slow_lookup(db_path, song_name, artist):
+            release.wait(5)
+            return details
+        
+        def on_late(song_info):
+            late.append(song_info)
+            arrived.set()
+        
+        watcher = SongStatusWatcher(dict(self.config, enrichment={"deadline": 0.05}))
+        with patch.object(watcher, 'upload_image', return_value="https://example.com/cover.png"), \
+                patch('song_status.get_song_details_from_synthdb', side_effect=slow_lookup):
+            first = watcher.parse_song_status(on_late=on_late)
+            release.set()
+            self.assertTrue(arrived.wait(5))
+        
+        # The cover was ready in time, the SynthDB details were not
+        self.assertEqual(first['cover_url'], "https://example.com/cover.png")
+        self.assertNotIn('bpm', first)
+        self.assertEqual(late[0]['bpm'], 140)
+        self.assertEqual(late[0]['song_id'], first['song_id'])
+        self.assertIs(watcher.current_song, late[0])
+
+
+class TestSongInfo(unittest.TestCase):
+    """Test the slotted song record and the single-pass parser"""
+    
+    def test_parse_status_text(self):
+        """Test titles containing " by " and CRLF line endings"""
+        info = parse_status_text("Stand by Me by Ben E. King\r\nHard (mapped by Kinetic)\r\n")
+        self.assertEqual((info.song_name, info.artist), ("Stand by Me", "Ben E. King"))
+        self.assertEqual((info.difficulty, info.mapper), ("Hard", "Kinetic"))
+        self.assertEqual(info.song_id, "ben e. king|stand by me")
+        self.assertIsNone(parse_status_text("\n\n"))
+        
+        info = parse_status_text("Sleeping Sun\nNormal")
+        self.assertEqual((info.artist, info.difficulty, info.mapper), ("Unknown", "Normal", "Unknown"))
+    
+    def test_dict_compatibility(self):
+        """Test missing SynthDB fields behave like missing dict keys"""
+        info = parse_status_text("Berzerk by Eminem\nMaster (mapped by AudioTiZm)")
+        self.assertFalse(hasattr(info, '__dict__'))
+        self.assertNotIn('duration', info)
+        self.assertEqual(info.get('year', ''), '')
+        with self.assertRaises(KeyError):
+            info['bpm']
+        
+        info.apply_synthdb({'id': 1, 'duration': 180, 'bpm': 140, 'year': '', 'is_custom': True,
+                            'environment': '', 'mapper': 'AudioTiZm'})
+        self.assertEqual(info['bpm'], 140)
+        as_dict = json.loads(json.dumps(dict(info)))
+        self.assertEqual(as_dict, info.to_dict())
+        self.assertEqual(as_dict['duration'], 180)
+        self.assertIsNone(as_dict['cover_url'])
 
 
 class TestSynthDB(unittest.TestCase):
@@ -469,6 +619,283 @@ class TestIntegrationSmoke(unittest.TestCase):
         self.assertTrue(watcher.check_for_updates())
 
 
+class TestPipelineSmoke(unittest.TestCase):
+    """Test the asyncio detection/enrichment/presence pipeline"""
+    
+    def setUp(self):
+        """Set up a status file, a fake game process and a recording sink"""
+        self.test_dir = tempfile.mkdtemp()
+        self.song_status_path = os.path.join(self.test_dir, "SongStatusOutput.txt")
+        self.config = {
+            "song_status_path": self.song_status_path,
+            "cover_image_path": os.path.join(self.test_dir, "SongStatusImage.png"),
+            "synth_db_path": os.path.join(self.test_dir, "SynthDB"),
+            "poll_intervals": {"process": 0.02, "status_file": 0.02, "presence_refresh": 0.5},
+            "adaptive_polling": {"enabled": False}
+        }
+        self.game_pid = 1234
+        self.events = []
+        self.presence = Mock()
+        
+        watcher = SongStatusWatcher(self.config)
+        watcher.upload_image = Mock(return_value=None)
+        self.pipeline = RPCPipeline(self.presence, watcher, self.config, lambda: self.game_pid, sinks=[self])
+        self.thread = threading.Thread(target=self.pipeline.run, daemon=True)
+    
+    def tearDown(self):
+        """Stop the pipeline and clean up"""
+        self.pipeline.stop()
+        self.thread.join(5)
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def on_event(self, event, session_id, data, timestamp):
+        self.events.append((event, session_id, data))
+    
+    def wait_for(self, event, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if any(e[0] == event for e in self.events):
+                return True
+            time.sleep(0.01)
+        return False
+    
+    def wait_for_count(self, event, count, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if sum(e[0] == event for e in self.events) >= count:
+                return True
+            time.sleep(0.01)
+        return False
+    
+    def write_status(self, content):
+        with open(self.song_status_path, 'w') as f:
+            f.write(content)
+        # Make sure the modification time changes between writes
+        stamp = time.time() + len(self.events)
+        os.utime(self.song_status_path, (stamp, stamp))
+    
+    def test_song_and_game_lifecycle(self):
+        """Test events flow from the status file and process check to sinks and presence"""
+        self.write_status("Berzerk by Eminem\nMaster (mapped by AudioTiZm)")
+        self.thread.start()
+        
+        self.assertTrue(self.wait_for("song_start"))
+        self.write_status("")
+        self.assertTrue(self.wait_for("song_stop"))
+        self.game_pid = False
+        self.assertTrue(self.wait_for("game_stop"))
+        
+        names = [e[0] for e in self.events]
+        self.assertEqual(names, ["session_start", "game_start", "song_start", "song_stop", "game_stop"])
+        self.assertEqual(len({e[1] for e in self.events}), 1)
+        self.assertEqual(self.events[2][2]['song_name'], 'Berzerk')
+        self.presence.update_song_status.assert_called()
+        self.pipeline.stop()
+        self.thread.join(5)
+        self.presence.disconnect.assert_called()
+        
+        report = [e[2] for e in self.events if e[0] == "game_stop"][0]
+        self.assertFalse(report['adaptive'])
+        self.assertGreater(report['detections'], 0)
+    
+    def test_restart_resumes_session_from_checkpoint(self):
+        """Test a restarted pipeline continues the session and song from the checkpoint"""
+        checkpoint_path = os.path.join(self.test_dir, "session.json")
+        self.pipeline.checkpoint = SessionCheckpoint(checkpoint_path)
+        self.presence.last_update = {"details": "Berzerk by Eminem"}
+        self.write_status("Berzerk by Eminem\nMaster (mapped by AudioTiZm)")
+        self.thread.start()
+        self.assertTrue(self.wait_for("song_start"))
+        deadline = time.time() + 5
+        while time.time() < deadline and not (self.pipeline.checkpoint.load() or {}).get("song"):
+            time.sleep(0.01)
+        # Crash: the checkpoint is left as it was while the song played
+        with open(checkpoint_path) as f:
+            saved = f.read()
+        session_id = self.events[0][1]
+        started = self.events[2][2]['start_time']
+        self.pipeline.stop()
+        self.thread.join(5)
+        with open(checkpoint_path, 'w') as f:
+            f.write(saved)
+        
+        self.events = []
+        presence = Mock()
+        watcher = SongStatusWatcher(self.config)
+        self.pipeline = RPCPipeline(presence, watcher, self.config, lambda: self.game_pid, sinks=[self],
+                                    checkpoint=SessionCheckpoint(checkpoint_path))
+        self.thread = threading.Thread(target=self.pipeline.run, daemon=True)
+        self.thread.start()
+        self.assertTrue(self.wait_for("song_update"))
+        
+        self.assertEqual([e[0] for e in self.events], ["song_update"])
+        self.assertEqual(self.events[0][1], session_id)
+        self.assertEqual(self.events[0][2]['start_time'], started)
+        presence.set.assert_called_with({"details": "Berzerk by Eminem"})
+    
+    def test_stop_and_restart_mid_song_logs_one_play(self):
+        """Test a song stopped on shutdown is not started or stopped again by the resumed session"""
+        checkpoint_path = os.path.join(self.test_dir, "session.json")
+        self.pipeline.checkpoint = SessionCheckpoint(checkpoint_path)
+        self.presence.last_update = {"details": "Berzerk by Eminem"}
+        self.write_status("Berzerk by Eminem\nMaster (mapped by AudioTiZm)")
+        self.thread.start()
+        self.assertTrue(self.wait_for("song_start"))
+        self.pipeline.stop()
+        self.thread.join(5)
+        self.assertEqual([e[0] for e in self.events][-1], "song_stop")
+        
+        presence = Mock(last_update=None)
+        watcher = SongStatusWatcher(self.config)
+        watcher.upload_image = Mock(return_value=None)
+        self.pipeline = RPCPipeline(presence, watcher, self.config, lambda: self.game_pid, sinks=[self],
+                                    checkpoint=SessionCheckpoint(checkpoint_path))
+        self.thread = threading.Thread(target=self.pipeline.run, daemon=True)
+        resumed = len(self.events)
+        self.thread.start()
+        deadline = time.time() + 5
+        while time.time() < deadline and not presence.update_song_status.called:
+            time.sleep(0.01)
+        self.write_status("Hammer by Queen\nExpert (mapped by Kiwi)")
+        self.assertTrue(self.wait_for_count("song_start", 2))
+        
+        self.assertEqual([e[0] for e in self.events[resumed:]], ["song_start"])
+        self.assertEqual(self.events[-1][2]['song_name'], 'Hammer')
+        plays = [e[2]['song_name'] for e in self.events if e[0] == "song_stop"]
+        self.assertEqual(plays, ['Berzerk'])
+    
+    def test_late_enrichment_before_return_is_kept(self):
+        """Test a late update handed over before parsing returned is not replaced by the incomplete song"""
+        watcher = self.pipeline.song_watcher
+        parse = watcher.parse_song_status
+        
+        def parse_with_early_follow_up(on_late=None):
+            song_info = parse()
+            completed = song_info.copy()
+            completed.bpm = 140
+            # The follow-up ran on the parsing thread, before the incomplete song was returned
+            watcher.current_song = completed
+            on_late(completed)
+            return song_info
+        
+        watcher.parse_song_status = parse_with_early_follow_up
+        self.write_status("Berzerk by Eminem\nMaster (mapped by AudioTiZm)")
+        self.thread.start()
+        self.assertTrue(self.wait_for("song_start"))
+        deadline = time.time() + 5
+        while time.time() < deadline and not self.presence.update_song_status.called:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        self.assertEqual(self.pipeline.current_song['bpm'], 140)
+        self.assertEqual(self.presence.update_song_status.call_args.args[0]['bpm'], 140)
+        self.assertNotIn("song_update", [e[0] for e in self.events])
+    
+    def test_stop_is_bounded_when_discord_hangs(self):
+        """Test stopping logs the current song and gives up on a Discord that does not respond"""
+        hung = threading.Event()
+        self.addCleanup(hung.set)
+        self.write_status("Berzerk by Eminem\nMaster (mapped by AudioTiZm)")
+        self.thread.start()
+        self.assertTrue(self.wait_for("song_start"))
+        
+        self.presence.update_song_status.side_effect = lambda *args: hung.wait(10)
+        self.pipeline.finish_timeout = 0.2
+        started = time.time()
+        self.pipeline.stop()
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+        self.assertLess(time.time() - started, 2)
+        self.assertEqual(self.events[-1][0], "song_stop")
+
+
+class TestPollingCadence(unittest.TestCase):
+    """Test adaptive poll intervals"""
+    
+    def setUp(self):
+        """Set up a cadence with a fake clock"""
+        self.now = 1000.0
+        self.cadence = PollingCadence(clock=lambda: self.now)
+    
+    def test_intervals_follow_game_state(self):
+        """Test slow polling while closed or mid-song, fast around song ends"""
+        self.assertEqual(self.cadence.process_interval(False), 30)
+        self.assertEqual(self.cadence.status_interval(None), 1.5)
+        
+        song = {'start_time': 1000.0, 'duration': 180}
+        self.assertEqual(self.cadence.status_interval(song), 10)
+        self.now = 1172.0
+        self.assertEqual(self.cadence.status_interval(song), 3.0)
+        self.now = 1176.0
+        self.assertEqual(self.cadence.status_interval(song), 0.5)
+        
+        self.cadence.burst()
+        self.assertEqual(self.cadence.status_interval(None), 0.5)
+    
+    def test_fixed_intervals_when_disabled(self):
+        """Test the configured fixed intervals are used when adaptive polling is off"""
+        cadence = PollingCadence({"enabled": False}, {"process": 5, "status_file": 1})
+        self.assertEqual(cadence.process_interval(False), 5)
+        self.assertEqual(cadence.status_interval({'start_time': 1, 'duration': 100}), 1)
+    
+    def test_report(self):
+        """Test wakeups per hour and latency percentiles are reported"""
+        for latency in (0.1, 0.2, 0.3, 2.0):
+            self.cadence.record_wakeup("status_file")
+            self.cadence.record_latency(latency)
+        self.now += 360
+        
+        report = self.cadence.report()
+        self.assertEqual(report['wakeups_per_hour'], 40.0)
+        self.assertEqual(report['legacy_wakeups_per_hour'], 720.0)
+        self.assertEqual(report['latency_max'], 2.0)
+        self.assertEqual(report['detections'], 4)
+
+
+@unittest.skipIf(sys.platform == "win32", "SIGTERM cannot be sent to a console process on Windows")
+class TestHeadlessSmoke(unittest.TestCase):
+    """Test the headless daemon mode"""
+    
+    def setUp(self):
+        """Set up a config and log directory for a headless run"""
+        self.test_dir = tempfile.mkdtemp()
+        self.log_dir = os.path.join(self.test_dir, "log")
+        self.config_path = os.path.join(self.test_dir, "config.json")
+        with open(self.config_path, 'w') as f:
+            json.dump({
+                "discord_application_id": "test_client_id",
+                "song_status_path": os.path.join(self.test_dir, "SongStatusOutput.txt"),
+                "cover_image_path": os.path.join(self.test_dir, "SongStatusImage.png"),
+                "synth_db_path": os.path.join(self.test_dir, "SynthDB"),
+                "log_retention": {"enabled": False}
+            }, f)
+    
+    def tearDown(self):
+        """Clean up test files"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_headless_exits_cleanly_on_sigterm(self):
+        """Test the headless mode starts without a tray and stops on SIGTERM"""
+        main_py = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+        env = dict(os.environ, PYSTRAY_BACKEND="does-not-exist")
+        proc = subprocess.Popen(
+            [sys.executable, main_py, "--headless", "--config", self.config_path,
+             "--log-dir", self.log_dir, "--cache-dir", os.path.join(self.test_dir, "cache"),
+             "--poll-interval", "0.2"],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env
+        )
+        try:
+            time.sleep(1.5)
+            self.assertIsNone(proc.poll(), proc.stdout.read() if proc.poll() is not None else "")
+            proc.send_signal(signal.SIGTERM)
+            output, _ = proc.communicate(timeout=10)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+        self.assertEqual(proc.returncode, 0, output)
+        self.assertIn(b"shutting down", output)
+        self.assertTrue(os.path.exists(os.path.join(self.log_dir, "history.db")))
+
+
 class TestErrorHandlingSmoke(unittest.TestCase):
     """Test error handling and edge cases"""
     
@@ -525,6 +952,1290 @@ class TestErrorHandlingSmoke(unittest.TestCase):
         self.assertIsNone(result)
 
 
+class TestHistoryStore(unittest.TestCase):
+    """Test the play history database"""
+    
+    def setUp(self):
+        """Set up a temporary history database"""
+        self.test_dir = tempfile.mkdtemp()
+        self.store = HistoryStore(os.path.join(self.test_dir, "history.db"), flush_interval=0.05).start()
+    
+    def tearDown(self):
+        """Clean up test files"""
+        self.store.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def play(self, song_name, start, seconds, mapper="OST"):
+        """Record a finished play starting at a local date/time string"""
+        started_at = time.mktime(time.strptime(start, "%Y-%m-%d %H:%M"))
+        song_info = {
+            'song_id': f"artist|{song_name.lower()}",
+            'song_name': song_name,
+            'artist': 'Artist',
+            'mapper': mapper,
+            'difficulty': 'Master',
+            'start_time': started_at
+        }
+        self.store.record_play("session", song_info, started_at + seconds)
+    
+    def test_top_songs_and_count(self):
+        """Test play counts are grouped per song"""
+        self.play("Berzerk", "2025-06-01 20:00", 180)
+        self.play("Berzerk", "2025-06-02 20:00", 180)
+        self.play("Eden", "2025-06-02 20:05", 200)
+        self.assertTrue(self.store.flush())
+        
+        top = self.store.top_songs()
+        self.assertEqual(top[0][0], "Berzerk")
+        self.assertEqual(top[0][2], 2)
+        self.assertEqual(self.store.play_count("Berzerk", since="2025-06-02"), 1)
+    
+    def test_duplicate_plays_ignored(self):
+        """Test the same play is only stored once"""
+        self.play("Berzerk", "2025-06-01 20:00", 180)
+        self.play("Berzerk", "2025-06-01 20:00", 180)
+        self.store.flush()
+        self.assertEqual(self.store.play_count("Berzerk"), 1)
+    
+    def test_playtime_per_day_and_mapper(self):
+        """Test playtime aggregation per day and mapper"""
+        self.play("Berzerk", "2025-06-01 20:00", 180, mapper="AudioTiZm")
+        self.play("Eden", "2025-06-01 20:05", 200)
+        self.play("Eden", "2025-06-03 20:05", 200)
+        self.store.flush()
+        
+        daily = self.store.playtime_per_day(since="2025-06-01", until="2025-06-03")
+        self.assertEqual(daily, [("2025-06-01", 2, 380.0)])
+        mappers = self.store.playtime_per_mapper()
+        self.assertEqual(mappers[0][0], "OST")
+        self.assertEqual(mappers[0][2], 400.0)
+    
+    def test_streaks(self):
+        """Test longest and current daily streaks"""
+        for day in ("2025-06-01", "2025-06-02", "2025-06-03", "2025-06-05", "2025-06-06"):
+            self.play("Berzerk", f"{day} 20:00", 180)
+        self.store.flush()
+        
+        streaks = self.store.streaks(today=date(2025, 6, 7))
+        self.assertEqual(streaks['longest'], 3)
+        self.assertEqual(str(streaks['longest_start']), "2025-06-01")
+        self.assertEqual(streaks['current'], 2)
+    
+    def test_history_cli_uses_app_log_dir(self):
+        """Test the history command finds the database in the same log folder as the app, also when frozen"""
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(APP_LOG_DIR, os.path.join(project_root, "log"))
+        exe = os.path.join(self.test_dir, "SynthRidersRPC.exe")
+        with patch.object(sys, "frozen", True, create=True), patch.object(sys, "executable", exe):
+            self.assertEqual(app_dir(), self.test_dir)
+
+
+class TestLogRetention(unittest.TestCase):
+    """Test log directory housekeeping"""
+    
+    def setUp(self):
+        """Create a log directory with a few old sessions"""
+        self.log_dir = tempfile.mkdtemp()
+        self.now = time.mktime(time.strptime("2025-06-15 12:00", "%Y-%m-%d %H:%M"))
+        self.sessions = ["20250101200000000000", "20250501200000000000", "20250614200000000000", "20250615110000000000"]
+        for session in self.sessions:
+            for ext in ("log", "srt"):
+                path = os.path.join(self.log_dir, f"rpc{session}.{ext}")
+                with open(path, 'w') as f:
+                    f.write("x" * 100)
+                mtime = time.mktime(time.strptime(session[:12], "%Y%m%d%H%M"))
+                os.utime(path, (mtime, mtime))
+    
+    def tearDown(self):
+        """Clean up test files"""
+        shutil.rmtree(self.log_dir, ignore_errors=True)
+    
+    def test_compress_and_age_limit(self):
+        """Test finished sessions are gzipped and expired ones removed"""
+        manager = LogRetentionManager(self.log_dir, {"max_age_days": 90},
+                                      active_session=lambda: "20250614200000000000")
+        stats = manager.run_once(now=self.now)
+        
+        names = sorted(os.listdir(self.log_dir))
+        self.assertNotIn("rpc20250101200000000000.log.gz", names)
+        self.assertIn("rpc20250501200000000000.log.gz", names)
+        # Active and recently written sessions stay untouched
+        self.assertIn("rpc20250614200000000000.log", names)
+        self.assertIn("rpc20250615110000000000.srt", names)
+        self.assertEqual(stats["deleted"], 2)
+    
+    def test_count_limit_and_monthly_merge(self):
+        """Test small sessions are merged per month and the count limit applies"""
+        manager = LogRetentionManager(self.log_dir, {"max_files": 3, "merge_monthly": True})
+        manager.run_once(now=self.now)
+        
+        names = sorted(os.listdir(self.log_dir))
+        self.assertIn("rpc-archive-202505.tar", names)
+        self.assertNotIn("rpc-archive-202501.tar", names)
+        self.assertIn("rpc20250615110000000000.log", names)
+    
+    def test_merge_retry_does_not_duplicate_members(self):
+        """Test logs archived by a merge that could not remove them are not added again by the next run"""
+        settings = {"max_age_days": 365, "merge_monthly": True}
+        LogRetentionManager(self.log_dir, dict(settings, merge_monthly=False)).run_once(now=self.now)
+        with patch('utils.log_retention.os.remove', side_effect=OSError("in use")):
+            LogRetentionManager(self.log_dir, settings).run_once(now=self.now)
+        self.assertIn("rpc20250501200000000000.log.gz", os.listdir(self.log_dir))
+        LogRetentionManager(self.log_dir, settings).run_once(now=self.now)
+        
+        with tarfile.open(os.path.join(self.log_dir, "rpc-archive-202505.tar")) as tar:
+            self.assertEqual(tar.getnames(), ["rpc20250501200000000000.log.gz", "rpc20250501200000000000.srt.gz"])
+        self.assertNotIn("rpc20250501200000000000.log.gz", os.listdir(self.log_dir))
+
+
+class TestSessionTimeline(unittest.TestCase):
+    """Test the wall-clock SRT/WebVTT timeline"""
+    
+    def setUp(self):
+        """Set up a timeline driven by a fake clock"""
+        self.log_dir = tempfile.mkdtemp()
+        self.now = 1000.0
+        self.timeline = SessionTimeline(self.log_dir, "session", clock=lambda: self.now)
+        self.song = {'song_name': 'Berzerk', 'artist': 'Eminem', 'duration': 180, 'start_time': 1010.0}
+    
+    def tearDown(self):
+        """Clean up test files"""
+        shutil.rmtree(self.log_dir, ignore_errors=True)
+    
+    def read(self, ext):
+        with open(os.path.join(self.log_dir, f"rpcsession.{ext}"), encoding='utf-8') as f:
+            return f.read()
+    
+    def test_song_cue_uses_elapsed_time_and_duration(self):
+        """Test a song cue starts at its real offset and spans its duration"""
+        self.now = 1012.0
+        self.timeline.song_start(self.song)
+        
+        self.assertEqual(self.read("srt"), "1\n00:00:10,000 --> 00:03:10,000\nSTART: Eminem - Berzerk\n\n")
+        self.assertTrue(self.read("vtt").startswith("WEBVTT\n\n1\n00:00:10.000 --> 00:03:10.000\n"))
+    
+    def test_stop_rewrites_open_cue(self):
+        """Test stopping early shortens the song cue in place"""
+        self.timeline.song_start(self.song)
+        self.now = 1100.0
+        self.timeline.song_stop(self.song)
+        self.now = 4600.5
+        self.timeline.idle()
+        
+        srt_text = self.read("srt")
+        self.assertIn("1\n00:00:10,000 --> 00:01:40,000\nSTART: Eminem - Berzerk", srt_text)
+        self.assertIn("2\n00:01:40,000 --> 00:01:45,000\nSTOP: Eminem - Berzerk", srt_text)
+        self.assertIn("3\n01:00:00,500 --> 01:00:05,500\nIdle", srt_text)
+        self.assertNotIn("00:03:10", self.read("vtt"))
+
+
+class TestUpdateChecker(unittest.TestCase):
+    """Test the cached, conditional version check"""
+    
+    def setUp(self):
+        """Set up a checker with a temporary cache"""
+        self.test_dir = tempfile.mkdtemp()
+        self.checker = UpdateChecker(os.path.join(self.test_dir, "cache", "update_check.json"), interval_hours=1)
+    
+    def tearDown(self):
+        """Clean up test files"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def response(self, status_code, text="", headers=None):
+        return Mock(status_code=status_code, text=text, headers=headers or {})
+    
+    def test_fetch_then_cache_then_conditional_get(self):
+        """Test the server is asked once per interval and revalidated with ETag"""
+        ok = self.response(200, "[PROFILE]\nAppVersion = 2.1.0\n", {"ETag": '"abc"'})
+        with patch('requests.get', return_value=ok) as mock_get:
+            self.assertEqual(self.checker.check(now=1000), "2.1.0")
+            self.assertEqual(self.checker.check(now=2000), "2.1.0")
+            self.assertEqual(mock_get.call_count, 1)
+            self.assertIn("timeout", mock_get.call_args[1])
+        
+        with patch('requests.get', return_value=self.response(304)) as mock_get:
+            self.assertEqual(self.checker.check(now=5000), "2.1.0")
+            self.assertEqual(mock_get.call_args[1]["headers"]["If-None-Match"], '"abc"')
+        self.assertEqual(self.checker.load_cache()["checked_at"], 5000)
+    
+    def test_network_error_keeps_cached_version(self):
+        """Test a failing request falls back to the cached answer"""
+        self.checker.save_cache({"version": "2.0.5", "checked_at": 0})
+        with patch('requests.get', side_effect=Exception("offline")):
+            self.assertEqual(self.checker.check(now=10000), "2.0.5")
+
+
+class TestReplayHarness(unittest.TestCase):
+    """Test recording a session and replaying it on a fake clock"""
+    
+    def setUp(self):
+        """Record a short evening: game start, two songs, game stop"""
+        self.test_dir = tempfile.mkdtemp()
+        self.trace_dir = os.path.join(self.test_dir, "trace")
+        testdata = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testdata")
+        self.synth_db = os.path.join(testdata, "SynthDB", "SynthDB")
+        status_path = os.path.join(self.test_dir, "SongStatusOutput.txt")
+        cover_path = os.path.join(testdata, "SongStatus", "demosong-1", "SongStatusImage.png")
+        
+        recorder = TraceRecorder(self.trace_dir)
+        recorder.record_process(1234, 1000.0)
+        for t, content in ((1010.0, "Berzerk by Eminem\nMaster (mapped by AudioTiZm)"), (1200.0, ""),
+                           (1230.0, "Eden by Au5 & Danyka Nadeau\nExpert (mapped by OST)"), (1430.0, "")):
+            with open(status_path, 'w') as f:
+                f.write(content)
+            recorder.record_status(status_path, cover_path, t)
+        recorder.record_process(None, 1500.0)
+    
+    def tearDown(self):
+        """Clean up test files"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_accelerated_replay_reports_latency(self):
+        """Test a replay runs faster than real time and reports per-stage costs"""
+        driver = ReplayDriver(self.trace_dir, {"synth_db_path": self.synth_db})
+        try:
+            report = driver.run()
+        finally:
+            driver.close()
+        
+        self.assertEqual(report["events"], 6)
+        self.assertEqual(report["simulated_seconds"], 500.0)
+        self.assertLess(report["wall_seconds"], 10)
+        self.assertEqual(report["end_to_end"]["count"], 4)
+        self.assertEqual(report["presence_updates"], 4)
+        self.assertIn("synthdb_lookup", report["stages"])
+        self.assertIn("parse_song_status", report["stages"])
+        # Detection can never be faster than the poll schedule allows
+        self.assertGreaterEqual(report["end_to_end"]["p50_ms"], 0)
+        self.assertLessEqual(report["end_to_end"]["max_ms"], 10500)
+        self.assertEqual(driver.discord.updates[0]["details"], "Berzerk by Eminem")
+
+
+class TestMetrics(unittest.TestCase):
+    """Test stage timing histograms and the metrics endpoint"""
+    
+    def setUp(self):
+        self.registry = MetricsRegistry()
+    
+    def test_timed_records_calls_and_errors(self):
+        """Test the decorator observes every call and counts exceptions"""
+        @timed("stage", registry=self.registry)
+        def stage(fail=False):
+            if fail:
+                raise ValueError("boom")
+            return 42
+        
+        self.assertEqual(stage(), 42)
+        with self.assertRaises(ValueError):
+            stage(fail=True)
+        
+        summary = self.registry.summary()
+        self.assertEqual(summary["stage_seconds"]["count"], 2)
+        self.assertEqual(summary["stage_errors_total"], 1)
+    
+    def test_prometheus_endpoint(self):
+        """Test the endpoint serves cumulative buckets in Prometheus text format"""
+        histogram = self.registry.histogram("upload_seconds", buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        self.registry.counter("uploads_total").inc(3)
+        
+        server = MetricsServer(0, registry=self.registry).start()
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics", timeout=5) as r:
+                body = r.read().decode("utf-8")
+        finally:
+            server.stop()
+        
+        self.assertIn('synthriders_rpc_upload_seconds_bucket{le="0.1"} 1', body)
+        self.assertIn('synthriders_rpc_upload_seconds_bucket{le="1"} 2', body)
+        self.assertIn('synthriders_rpc_upload_seconds_count 2', body)
+        self.assertIn('synthriders_rpc_uploads_total 3', body)
+
+
+class TestProfiler(unittest.TestCase):
+    """Test opt-in cProfile and tracemalloc snapshots"""
+    
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.profiler = Profiler(self.test_dir, {"interval_minutes": 60, "keep": 2})
+    
+    def tearDown(self):
+        self.profiler.stop()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_snapshot_covers_worker_threads(self):
+        """Test calls made in another thread show up in the snapshot and old snapshots are pruned"""
+        
+        def busy_stage():
+            return [str(i) * 10 for i in range(20000)]
+        
+        self.profiler.start()
+        profiled = self.profiler.wrap(busy_stage)
+        worker = threading.Thread(target=profiled)
+        worker.start()
+        worker.join()
+        
+        report_path = self.profiler.snapshot("manual")
+        with open(report_path, encoding="utf-8") as f:
+            report = f.read()
+        self.assertIn("busy_stage", report)
+        self.assertIn("== Memory", report)
+        self.assertTrue(os.path.exists(report_path[:-len(".txt")] + ".pstats"))
+        
+        # The next snapshot only covers calls made since the previous one
+        second = self.profiler.snapshot("manual")
+        with open(second, encoding="utf-8") as f:
+            self.assertNotIn("busy_stage", f.read())
+        
+        self.profiler.snapshot("manual")
+        reports = [name for name in os.listdir(self.test_dir) if name.endswith(".txt")]
+        self.assertEqual(len(reports), 2)
+    
+    def test_overlapping_stages_are_profiled(self):
+        """Test stages running at the same time in different threads both run and show up in the snapshot"""
+        started, release = threading.Event(), threading.Event()
+        results = []
+        
+        def slow_stage():
+            started.set()
+            release.wait(5)
+            return "slow"
+        
+        def quick_stage():
+            return "quick"
+        
+        worker = threading.Thread(target=lambda: results.append(self.profiler.wrap(slow_stage)()))
+        worker.start()
+        self.assertTrue(started.wait(5))
+        results.append(self.profiler.wrap(quick_stage)())
+        release.set()
+        worker.join(5)
+        self.assertEqual(sorted(results), ["quick", "slow"])
+        report_path = self.profiler.snapshot("manual")
+        functions = {name for _, _, name in pstats.Stats(report_path[:-len(".txt")] + ".pstats").stats}
+        self.assertIn("slow_stage", functions)
+        self.assertIn("quick_stage", functions)
+    
+    def test_stage_runs_while_another_profiler_is_active(self):
+        """Test a wrapped stage still runs when some other profiler holds the interpreter's hook"""
+        other = cProfile.Profile()
+        other.enable()
+        try:
+            result = self.profiler.wrap(lambda: "ran")()
+        finally:
+            other.disable()
+        self.assertEqual(result, "ran")
+
+
+class TestConfig(unittest.TestCase):
+    """Test the validated config object and hot reload"""
+    
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.test_dir, "config.json")
+        self.data = {
+            "discord_application_id": "test_client_id",
+            "song_status_path": os.path.join(self.test_dir, "SongStatusOutput.txt"),
+            "button_label": "Play Synth Riders",
+            "poll_intervals": {"process": 5, "status_file": 1},
+        }
+        self.write(self.data)
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def write(self, data, mtime=None):
+        with open(self.config_path, 'w') as f:
+            f.write(data if isinstance(data, str) else json.dumps(data))
+        if mtime:
+            os.utime(self.config_path, (mtime, mtime))
+    
+    def test_validation_and_read_only(self):
+        """Test invalid values are rejected and a loaded config cannot be changed"""
+        with self.assertRaises(ConfigError) as ctx:
+            Config(dict(self.data, show_button="yes", poll_intervals={"process": 0}, metrics_port=70000))
+        for key in ("show_button", "poll_intervals.process", "metrics_port"):
+            self.assertIn(key, str(ctx.exception))
+        
+        # Counts and intervals that 0 would break
+        with self.assertRaises(ConfigError) as ctx:
+            Config(dict(self.data, enrichment={"workers": 0, "deadline": 0}, adaptive_polling={"fast": 0},
+                        log_retention={"interval_minutes": 0}, profiling={"keep": 1.5}))
+        for problem in ("enrichment.workers must be a whole number greater than 0",
+                        "adaptive_polling.fast must be greater than 0",
+                        "log_retention.interval_minutes must be greater than 0",
+                        "profiling.keep must be a whole number greater than 0"):
+            self.assertIn(problem, str(ctx.exception))
+        self.assertNotIn("deadline", str(ctx.exception))
+        
+        config = load_config(self.config_path, {"poll_intervals": {"status_file": 2}})
+        self.assertEqual(config["poll_intervals"]["status_file"], 2)
+        self.assertEqual(config["poll_intervals"]["process"], 5)
+        self.assertEqual(config.presence_buttons, [{"label": "Play Synth Riders", "url": "https://synthridersvr.com"}])
+        with self.assertRaises(TypeError):
+            config["button_label"] = "Changed"
+        with self.assertRaises(TypeError):
+            config["poll_intervals"]["process"] = 1
+    
+    def test_reload_keeps_last_good_config(self):
+        """Test a broken edit is ignored and a later valid edit is picked up"""
+        config = load_config(self.config_path)
+        reloader = ConfigReloader(self.config_path, config)
+        self.assertIsNone(reloader.check())
+        
+        self.write('{"discord_application_id": "test_client_id", ', mtime=time.time() + 10)
+        self.assertIsNone(reloader.check())
+        self.assertIs(reloader.config, config)
+        
+        self.write(dict(self.data, button_label="Join me"), mtime=time.time() + 20)
+        new_config = reloader.check()
+        self.assertEqual(new_config.presence_buttons[0]["label"], "Join me")
+        
+        # The watcher and presence take over the new config without a restart
+        watcher = SongStatusWatcher(config)
+        watcher.apply_config(dict(new_config, song_status_path=os.path.join(self.test_dir, "Other.txt")))
+        self.assertTrue(watcher.song_status_path.endswith("Other.txt"))
+        with patch('discordrp.PyPresence') as mock_pypresence:
+            presence = Presence("test_client_id")
+            presence.apply_config(dict(new_config, discord_application_id="other_id"))
+        self.assertEqual(presence.client_id, "other_id")
+        mock_pypresence.assert_called_with("other_id")
+
+
+class TestNowPlayingServer(unittest.TestCase):
+    """Test the SSE/WebSocket broadcast server for stream overlays"""
+    
+    def setUp(self):
+        testdata = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testdata")
+        self.cover_path = os.path.join(testdata, "SongStatus", "demosong-1", "SongStatusImage.png")
+        self.song = {"song_name": "Berzerk", "artist": "Eminem", "difficulty": "Master", "mapper": "AudioTiZm",
+                     "cover_path": self.cover_path, "start_time": 1000}
+        self.server = NowPlayingServer(0).start()
+    
+    def tearDown(self):
+        self.server.stop()
+    
+    def read_event(self, stream):
+        lines = []
+        while True:
+            line = stream.readline().decode("utf-8").rstrip("\n")
+            if not line:
+                if lines:
+                    return lines
+                continue
+            if not line.startswith(":"):
+                lines.append(line)
+    
+    def test_sse_and_websocket_fan_out(self):
+        """Test new subscribers get the current state and then every event"""
+        
+        sse = socket.create_connection(("127.0.0.1", self.server.port), timeout=5)
+        sse.sendall(b"GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        sse_stream = sse.makefile("rb")
+        while sse_stream.readline() not in (b"\r\n", b""):
+            pass
+        self.assertEqual(self.read_event(sse_stream)[0], "event: state")
+        
+        ws = socket.create_connection(("127.0.0.1", self.server.port), timeout=5)
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        ws.sendall((f"GET /ws HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                    f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode("ascii"))
+        ws_stream = ws.makefile("rb")
+        self.assertIn(b"101", ws_stream.readline())
+        while ws_stream.readline() not in (b"\r\n", b""):
+            pass
+        
+        class Reader:
+            async def readexactly(self, n):
+                return ws_stream.read(n)
+        
+        def read_ws():
+            opcode, payload = asyncio.run(read_ws_frame(Reader()))
+            self.assertEqual(opcode, 0x1)
+            return json.loads(payload)
+        
+        self.assertEqual(read_ws()["event"], "state")
+        
+        self.server.on_event("song_start", "session", self.song, 1000)
+        event, data = self.read_event(sse_stream)
+        self.assertEqual(event, "event: song_start")
+        message = json.loads(data[len("data: "):])
+        self.assertEqual(message["song"]["song_name"], "Berzerk")
+        self.assertNotIn("cover_path", message["song"])
+        self.assertEqual(read_ws(), message)
+        
+        with urllib.request.urlopen(message["song"]["cover"], timeout=5) as r:
+            with open(self.cover_path, "rb") as f:
+                self.assertEqual(r.read(), f.read())
+        
+        self.server.on_event("song_stop", "session", self.song, 1200)
+        self.server.on_event("game_stop", "session", None, 1210)
+        self.assertEqual(read_ws()["event"], "song_stop")
+        self.assertEqual(read_ws()["event"], "idle")
+        with urllib.request.urlopen(f"http://127.0.0.1:{self.server.port}/now-playing", timeout=5) as r:
+            self.assertEqual(json.loads(r.read())["event"], "idle")
+        sse.close()
+        ws.close()
+
+
+class TestCoverCache(unittest.TestCase):
+    """Test the on-disk cover store and upload URL reuse"""
+    
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.test_dir, "covers")
+        testdata = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testdata", "SongStatus")
+        with open(os.path.join(testdata, "demosong-1", "SongStatusImage.png"), "rb") as f:
+            self.small_cover = f.read()
+        with open(os.path.join(testdata, "demosong-2", "SongStatusImage.png"), "rb") as f:
+            self.large_cover = f.read()
+        self.now = 1000.0
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def cache(self, **settings):
+        return CoverCache(self.cache_dir, settings, clock=lambda: self.now)
+    
+    def test_thumbnails_lookup_and_lru(self):
+        """Test covers are shrunk, found again by SynthDB id after a restart and evicted least recently used first"""
+        cache = self.cache(max_files=2)
+        large = cache.put(self.large_cover, synthdb_id=1, image_file="large.png")
+        self.assertEqual(max(Image.open(large.path).size), 256)
+        self.assertEqual(cache.put(self.large_cover).path, large.path)
+        
+        self.now += 1
+        small = cache.put(self.small_cover, synthdb_id=2)
+        self.now += 1
+        self.assertEqual(cache.lookup(image_file="large.png"), large)
+        
+        # Reopened from disk, then a third cover pushes out the least recently used one
+        cache = self.cache(max_files=2)
+        self.assertEqual(cache.lookup(synthdb_id=1), large)
+        self.now += 1
+        cache.put(self.small_cover + b"\0", synthdb_id=3)
+        self.assertIsNone(cache.lookup(synthdb_id=2))
+        self.assertFalse(os.path.exists(small.path))
+        self.assertEqual(cache.lookup(synthdb_id=1), large)
+    
+    def test_lookup_batches_index_writes(self):
+        """Test hits only touch the index on disk once access times are old enough to matter"""
+        cache = self.cache()
+        entry = cache.put(self.large_cover, synthdb_id=1)
+        with patch.object(cache, '_save', wraps=cache._save) as save:
+            for _ in range(5):
+                self.now += 1
+                self.assertEqual(cache.lookup(synthdb_id=1), entry)
+            save.assert_not_called()
+            
+            self.now += CoverCache.TOUCH_SAVE_SECONDS
+            cache.lookup(synthdb_id=1)
+            save.assert_called_once()
+        
+        self.assertEqual(self.cache()._index["covers"][entry.digest]["last_used"], self.now)
+    
+    def test_repeat_play_reuses_cover_and_upload(self):
+        """Test a repeat play takes the cover from disk and the upload URL from the cache"""
+        status_path = os.path.join(self.test_dir, "SongStatusOutput.txt")
+        cover_path = os.path.join(self.test_dir, "SongStatusImage.png")
+        with open(status_path, 'w') as f:
+            f.write("Berzerk by Eminem\nMaster (mapped by AudioTiZm)")
+        with open(cover_path, 'wb') as f:
+            f.write(self.large_cover)
+        details = {'id': 7, 'image_file': 'berzerk.png', 'duration': 180, 'bpm': 140, 'year': '',
+                   'is_custom': True, 'environment': '', 'mapper': 'AudioTiZm'}
+        watcher = SongStatusWatcher({"song_status_path": status_path, "cover_image_path": cover_path},
+                                    cover_cache=self.cache())
+        
+        with patch('song_status.get_song_details_from_synthdb', return_value=details), \
+                patch.object(watcher, 'upload_image', return_value="https://example.com/berzerk.png") as upload:
+            first = watcher.parse_song_status()
+            # The game already replaced the image for the next song
+            os.remove(cover_path)
+            second = watcher.parse_song_status()
+        
+        upload.assert_called_once_with(first['cover_path'])
+        self.assertTrue(first['cover_path'].startswith(self.cache_dir))
+        self.assertTrue(second['has_cover'])
+        self.assertEqual(second['cover_path'], first['cover_path'])
+        self.assertEqual(second['cover_url'], "https://example.com/berzerk.png")
+        
+        # Expired upload URLs are not reused
+        self.now += 3 * 3600
+        self.assertIsNone(watcher.cover_cache.upload_url(os.path.basename(first['cover_path'])[:-4]))
+        
+        # The re-upload runs in the background and follows up, the deadline still holds
+        release = threading.Event()
+        late = []
+        
+        def slow_upload(path):
+            release.wait(5)
+            return "https://example.com/again.png"
+        
+        watcher.enrich_deadline = 0.2
+        watcher.status_watch = None
+        with patch('song_status.get_song_details_from_synthdb', return_value=details), \
+                patch.object(watcher, 'upload_image', side_effect=slow_upload):
+            started = time.monotonic()
+            third = watcher.parse_song_status(on_late=late.append)
+            self.assertLess(time.monotonic() - started, 2)
+            self.assertEqual(third['cover_path'], first['cover_path'])
+            self.assertIsNone(third.get('cover_url'))
+            release.set()
+            deadline = time.time() + 5
+            while not late and time.time() < deadline:
+                time.sleep(0.01)
+        watcher.close()
+        self.assertEqual(late[0]['cover_url'], "https://example.com/again.png")
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Test concurrent requests for the same resource share one call"""
+    
+    def test_concurrent_calls_share_one_flight(self):
+        """Test callers of a key in flight get its result, later callers start a new one"""
+        registry = MetricsRegistry()
+        duplicates = registry.counter("duplicates_total")
+        flight = SingleFlight(duplicates)
+        release = threading.Event()
+        calls = []
+        
+        def fetch(key):
+            calls.append(key)
+            release.wait(5)
+            return key.upper()
+        
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            shared = [flight.submit(executor, "a", fetch, "a") for _ in range(3)]
+            other = flight.submit(executor, "b", fetch, "b")
+            release.set()
+            self.assertEqual([future.result(5) for future in shared], ["A"] * 3)
+            self.assertEqual(other.result(5), "B")
+        self.assertEqual(sorted(calls), ["a", "b"])
+        self.assertEqual(duplicates.value, 2)
+        self.assertEqual(len(flight), 0)
+        
+        # Finished flights are not cached, and errors reach the caller
+        self.assertEqual(flight.do("a", str.upper, "again"), "AGAIN")
+        with self.assertRaises(ZeroDivisionError):
+            flight.do("a", lambda: 1 / 0)
+    
+    def test_status_rewrites_share_lookup_and_upload(self):
+        """Test rewrites of the status file while enrichment runs start no duplicate lookup or upload"""
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_dir, True)
+        status_path = os.path.join(test_dir, "SongStatusOutput.txt")
+        cover_path = os.path.join(test_dir, "SongStatusImage.png")
+        with open(status_path, 'w') as f:
+            f.write("Berzerk by Eminem\nMaster (mapped by AudioTiZm)")
+        with open(cover_path, 'wb') as f:
+            f.write(b"cover")
+        details = {'id': 1, 'duration': 180, 'bpm': 140, 'year': '', 'is_custom': True, 'environment': '',
+                   'mapper': 'AudioTiZm'}
+        release = threading.Event()
+        late = []
+        done = threading.Event()
+        
+        def slow(*args):
+            release.wait(5)
+            return details
+        
+        def slow_upload(path):
+            release.wait(5)
+            return "https://example.com/cover.png"
+        
+        def on_late(song_info):
+            late.append(song_info)
+            done.set()
+        
+        watcher = SongStatusWatcher({"song_status_path": status_path, "cover_image_path": cover_path,
+                                     "enrichment": {"deadline": 0.05}})
+        with patch('song_status.get_song_details_from_synthdb', side_effect=slow) as lookup, \
+                patch.object(watcher, 'upload_image', side_effect=slow_upload) as upload:
+            watcher.parse_song_status(on_late=on_late)
+            # Restarting the song rewrites the file with the same content
+            watcher.parse_song_status(on_late=on_late)
+            release.set()
+            self.assertTrue(done.wait(5))
+        
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual(upload.call_count, 1)
+        self.assertEqual(len(watcher._lookups) + len(watcher._uploads), 0)
+        self.assertEqual(watcher.current_song['cover_url'], "https://example.com/cover.png")
+        self.assertEqual(watcher.current_song['bpm'], 140)
+
+
+class TestShutdown(unittest.TestCase):
+    """Test the shared shutdown event and exit budget"""
+    
+    def test_request_wakes_workers_and_tracks_budget(self):
+        """Test one request wakes all waiting workers at once, runs callbacks once and counts down the budget"""
+        now = [100.0]
+        shutdown = Shutdown(budget=5, clock=lambda: now[0])
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_dir, True)
+        retention = LogRetentionManager(test_dir, {"enabled": True}, stop_event=shutdown.event).start()
+        profiler = Profiler(os.path.join(test_dir, "profile"), {"interval_minutes": 60}, stop_event=shutdown.event)
+        profiler.start()
+        stopped = []
+        shutdown.on_request(lambda: stopped.append("pipeline"))
+        self.assertEqual(shutdown.remaining(), 5)
+        
+        started = time.time()
+        shutdown.request()
+        shutdown.request()
+        retention._thread.join(2)
+        profiler._thread.join(2)
+        self.assertFalse(retention._thread.is_alive())
+        self.assertFalse(profiler._thread.is_alive())
+        self.assertLess(time.time() - started, 1)
+        profiler.stop(timeout=0)
+        self.assertEqual(stopped, ["pipeline"])
+        
+        now[0] += 2
+        self.assertEqual(shutdown.remaining(), 3)
+        now[0] += 10
+        self.assertEqual(shutdown.remaining(), 0)
+        # Late registrations run right away
+        shutdown.on_request(lambda: stopped.append("late"))
+        self.assertEqual(stopped, ["pipeline", "late"])
+
+
+class TestInstallDiscovery(unittest.TestCase):
+    """Test finding Synth Riders in a fake Steam tree"""
+    
+    def setUp(self):
+        """Create a Linux Steam install whose second library holds the game"""
+        self.test_dir = tempfile.mkdtemp()
+        self.home = os.path.join(self.test_dir, "home")
+        self.steam = os.path.join(self.home, ".local", "share", "Steam")
+        self.library = os.path.join(self.test_dir, "games", "SteamLibrary")
+        self.game_dir = os.path.join(self.library, "steamapps", "common", "SynthRiders")
+        os.makedirs(os.path.join(self.steam, "steamapps"))
+        os.makedirs(os.path.join(self.game_dir, "SynthRidersUC"))
+        open(os.path.join(self.game_dir, "SynthDB"), 'w').close()
+        with open(os.path.join(self.steam, "steamapps", "libraryfolders.vdf"), 'w') as f:
+            f.write(f"""
+"libraryfolders"
+{{
+    // Steam's own library
+    "0"
+    {{
+        "path"      "{self.steam}"
+        "apps"      {{ "250820" "123" }}
+    }}
+    "1"
+    {{
+        "path"      "{self.library}"
+        "apps"
+        {{
+            "885000"        "4567"
+        }}
+    }}
+}}
+""")
+        self.cache_path = os.path.join(self.test_dir, "cache", "install_paths.json")
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_parse_vdf(self):
+        """Test nested sections, comments and escaped Windows paths"""
+        data = parse_vdf('"LibraryFolders"\n{\n\t"TimeNextStatsReport"\t"1"\n\t"1"\t"D:\\\\SteamLibrary" // old\n}\n')
+        self.assertEqual(data, {"LibraryFolders": {"TimeNextStatsReport": "1", "1": "D:\\SteamLibrary"}})
+    
+    def test_missing_paths_are_found_in_steam_libraries_and_cached(self):
+        """Test default Windows paths are replaced by the game found through libraryfolders.vdf"""
+        roots = steam_roots(platform="linux", home=self.home)
+        self.assertIn(self.steam, roots)
+        paths = InstallDiscovery(self.cache_path, roots).resolve({})
+        self.assertEqual(paths["synth_db_path"], os.path.join(self.game_dir, "SynthDB"))
+        self.assertEqual(paths["song_status_path"],
+                         os.path.join(self.game_dir, "SynthRidersUC", "SongStatusOutput.txt"))
+        
+        # A new run takes the install from the cache without searching
+        discovery = InstallDiscovery(self.cache_path, roots=[])
+        self.assertEqual(discovery.game_dir(), self.game_dir)
+        
+        # Configured paths that exist win
+        db_path = os.path.join(self.test_dir, "SynthDB")
+        open(db_path, 'w').close()
+        self.assertEqual(discovery.resolve({"synth_db_path": db_path})["synth_db_path"], db_path)
+        
+        # A cached install that is gone is searched for again
+        shutil.rmtree(self.game_dir)
+        self.assertIsNone(InstallDiscovery(self.cache_path, roots).game_dir())
+    
+    def test_failed_search_is_retried_later(self):
+        """Test a game installed after a search that found nothing is found once the retry interval passed"""
+        roots = steam_roots(platform="linux", home=self.home)
+        moved = os.path.join(self.test_dir, "not-installed-yet")
+        os.rename(self.game_dir, moved)
+        now = [0.0]
+        discovery = InstallDiscovery(self.cache_path, roots, retry_interval=300, clock=lambda: now[0])
+        self.assertIsNone(discovery.game_dir())
+        os.rename(moved, self.game_dir)
+        now[0] = 60.0
+        self.assertIsNone(discovery.game_dir())
+        now[0] = 301.0
+        self.assertEqual(discovery.game_dir(), self.game_dir)
+    
+    def test_watcher_uses_discovered_paths(self):
+        """Test the status watcher reads the game's status file from the discovered install"""
+        discovery = InstallDiscovery(self.cache_path, steam_roots(platform="linux", home=self.home))
+        watcher = SongStatusWatcher({}, install=discovery)
+        self.assertEqual(watcher.db_path, os.path.join(self.game_dir, "SynthDB"))
+        self.assertTrue(watcher.song_status_path.startswith(self.game_dir))
+
+
+class TestPlayStats(unittest.TestCase):
+    """Test the running play totals"""
+    
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.start = datetime(2025, 6, 1, 20, 0).timestamp()
+        self.now = self.start + 3600
+        self.path = os.path.join(self.test_dir, "stats.json")
+        self.plays = [
+            ("s1", {'song_id': 'eminem|berzerk', 'song_name': 'Berzerk', 'artist': 'Eminem', 'mapper': 'AudioTiZm',
+                    'start_time': self.start}, self.start + 180),
+            ("s1", {'song_id': 'eminem|berzerk', 'song_name': 'Berzerk', 'artist': 'Eminem', 'mapper': 'AudioTiZm',
+                    'start_time': self.start + 200}, self.start + 260),
+            ("s2", {'song_id': 'queen|hammer', 'song_name': 'Hammer', 'artist': 'Queen', 'mapper': 'Kiwi',
+                    'start_time': self.start + 600}, self.start + 700),
+        ]
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def stats(self):
+        return PlayStats(self.path, clock=lambda: self.now)
+    
+    def test_totals_from_events_survive_restart(self):
+        """Test song stops update every total, which are saved and read back"""
+        stats = self.stats()
+        changes = []
+        stats.on_change = lambda: changes.append(1)
+        for session_id, song, ended_at in self.plays:
+            stats.on_event("song_stop", session_id, song, ended_at)
+        
+        self.assertEqual(stats.session("s1"), (2, 240.0))
+        self.assertEqual(stats.session(), (1, 100.0))
+        self.assertEqual(stats.day(), (3, 340.0))
+        self.assertEqual(stats.song('eminem|berzerk'), (2, 240.0))
+        self.assertEqual(stats.mapper('Kiwi'), (1, 100.0))
+        self.assertEqual(stats.summary_lines(), ["This session: 1 song, 1m", "Today: 3 songs, 5m"])
+        self.assertEqual(len(changes), 3)
+        
+        stats.stop()
+        reloaded = self.stats().load()
+        self.assertEqual(reloaded.day(), (3, 340.0))
+        self.assertEqual(reloaded.songs, stats.songs)
+    
+    def test_profiles_keep_their_own_session(self):
+        """Test profiles add up in the shared totals without taking over each other's current session"""
+        stats = self.stats()
+        left, right = stats.profile("Left"), stats.profile("Right")
+        left.on_event("session_start", "s1", None, self.start)
+        right.on_event("session_start", "s2", None, self.start)
+        for session_id, song, ended_at in self.plays:
+            (left if session_id == "s1" else right).on_event("song_stop", session_id, song, ended_at)
+        left.on_event("song_start", "s1", self.plays[0][1], self.start + 800)
+        
+        self.assertEqual((left.session(), right.session()), ((2, 240.0), (1, 100.0)))
+        self.assertEqual(stats.day(), (3, 340.0))
+        self.assertEqual(stats.summary_lines(), ["Left session: 2 songs, 4m", "Right session: 1 song, 1m",
+                                                 "Today: 3 songs, 5m"])
+    
+    def test_rebuild_from_history(self):
+        """Test missing totals are recounted from the play history"""
+        db_path = os.path.join(self.test_dir, "history.db")
+        store = HistoryStore(db_path).start()
+        for session_id, song, ended_at in self.plays:
+            store.record_play(session_id, song, ended_at)
+        store.close()
+        
+        stats = self.stats().load(history_db=db_path)
+        self.assertEqual(stats.session("s1"), (2, 240.0))
+        self.assertEqual(stats.day(), (3, 340.0))
+        self.assertEqual(stats.songs['queen|hammer'], [1, 100.0, "Hammer by Queen"])
+        self.assertEqual(stats.mapper('AudioTiZm'), (2, 240.0))
+        self.assertTrue(os.path.exists(self.path))
+    
+    def test_presence_state_line(self):
+        """Test today's totals are added to the Discord state line only when enabled"""
+        stats = self.stats()
+        stats.add(*self.plays[0])
+        with patch('discordrp.PyPresence') as mock_pypresence:
+            presence = Presence("test_client_id")
+            presence.stats = stats
+            song = {'song_name': 'Berzerk', 'artist': 'Eminem', 'difficulty': 'Master', 'mapper': 'AudioTiZm'}
+            presence.update_song_status(song, {"show_stats": True})
+            state = mock_pypresence.return_value.update.call_args.kwargs['state']
+            self.assertTrue(state.endswith("| 1 song, 3m today"))
+            presence.update_song_status(song, {})
+            self.assertNotIn("today", mock_pypresence.return_value.update.call_args.kwargs['state'])
+
+
+class TestLogImport(unittest.TestCase):
+    """Test rebuilding play history from session logs"""
+    
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.log_dir = os.path.join(self.test_dir, "log")
+        os.makedirs(self.log_dir)
+        self.db_path = os.path.join(self.test_dir, "history.db")
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def session_log(self, session_id, start_time=True):
+        started = datetime.strptime(session_id, "%Y%m%d%H%M%S%f")
+        song = {'song_name': 'Berzerk', 'artist': 'Eminem', 'mapper': 'AudioTiZm', 'song_id': 'eminem|berzerk',
+                'start_time': started.timestamp() + 10 if start_time else None}
+        stamp = lambda seconds: f"[{datetime.fromtimestamp(started.timestamp() + seconds):%Y-%m-%d %H:%M:%S},000]"
+        return "\n".join([
+            f"{stamp(0)} Synth Riders is running(PID: 1234). Executing RPC function.",
+            f"{stamp(10)} SONG START: {json.dumps(song)}",
+            f"{stamp(190)} SONG STOP: {json.dumps(song)}",
+            f"{stamp(200)} SONG STOP: No song info available.",
+            f"{stamp(210)} SONG STOP: {{\"song_name\": \"cut off by a cra",
+        ]).encode("utf-8") + b"\n"
+    
+    def test_import_plain_gzipped_and_archived_logs(self):
+        """Test plays are read from every log format once, including logs without start times"""
+        with open(os.path.join(self.log_dir, "rpc20250601200000000000.log"), "wb") as f:
+            f.write(self.session_log("20250601200000000000"))
+        with gzip.open(os.path.join(self.log_dir, "rpc20250602200000000000.log.gz"), "wb") as f:
+            f.write(self.session_log("20250602200000000000", start_time=False))
+        member = os.path.join(self.test_dir, "rpc20250501200000000000.log.gz")
+        with gzip.open(member, "wb") as f:
+            f.write(self.session_log("20250501200000000000"))
+        with tarfile.open(os.path.join(self.log_dir, "rpc-archive-202505.tar"), "w") as tar:
+            tar.add(member, arcname=os.path.basename(member))
+        
+        report = import_logs(self.db_path, [self.log_dir], workers=1)
+        self.assertEqual((report["files"], report["plays"], report["inserted"]), (3, 3, 3))
+        self.assertEqual(report["lines"], 15)
+        store = HistoryStore(self.db_path)
+        self.assertEqual(store.top_songs()[0][2:], (3, 540.0))
+        self.assertEqual(len(store.playtime_per_day()), 3)
+        
+        # Importing again adds nothing
+        self.assertEqual(import_logs(self.db_path, [self.log_dir], workers=1)["inserted"], 0)
+    
+    def test_import_in_process_pool(self):
+        """Test many logs are parsed by worker processes with the same result"""
+        for day in range(1, 11):
+            with open(os.path.join(self.log_dir, f"rpc202506{day:02d}200000000000.log"), "wb") as f:
+                f.write(self.session_log(f"202506{day:02d}200000000000"))
+        report = import_logs(self.db_path, [self.log_dir], workers=2, batch_size=3)
+        self.assertEqual((report["files"], report["plays"], report["inserted"]), (10, 10, 10))
+
+
+class TestScrobble(unittest.TestCase):
+    """Test the scrobble outbox, sender and stand-in receiver"""
+    
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "scrobble.db")
+        self.receiver = ScrobbleReceiver().start()
+        self.queue = ScrobbleQueue(self.db_path)
+        self.now = 1000.0
+    
+    def tearDown(self):
+        self.receiver.stop()
+        self.queue.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def sender(self, **settings):
+        backend = HttpBackend({"url": self.receiver.url, "name": "stats"})
+        return ScrobbleSender(self.queue, [backend], settings, clock=lambda: self.now)
+    
+    def play(self, sender, name, played=180):
+        song = SongInfo.from_dict({"song_name": name, "artist": "Artist", "mapper": "Mapper",
+                                   "song_id": f"artist|{name}", "start_time": 1750000000.0})
+        sender.on_event("song_stop", "20250601200000000000", song, 1750000000.0 + played)
+    
+    def test_plays_are_queued_once_and_sent_in_batches(self):
+        """Test finished plays survive a reopen and are sent in batches with idempotency keys"""
+        sender = self.sender(batch_size=2)
+        for name in ("One", "Two", "Three"):
+            self.play(sender, name)
+        self.play(sender, "One")
+        self.play(sender, "Skipped", played=10)
+        self.queue.close()
+        self.queue = sender.queue = ScrobbleQueue(self.db_path)
+        self.assertEqual(self.queue.depth(), 3)
+        
+        self.assertIsNone(sender.send_once())
+        self.assertEqual(self.queue.depth(), 0)
+        self.assertEqual([len(body["plays"]) for _, _, body in self.receiver.requests], [2, 1])
+        self.assertTrue(all(headers.get("Idempotency-Key") for _, headers, _ in self.receiver.requests))
+        self.assertEqual(sorted(play["song_name"] for play in self.receiver.plays.values()), ["One", "Three", "Two"])
+        self.assertEqual(self.receiver.duplicates, 0)
+    
+    def test_outage_is_retried_with_backoff(self):
+        """Test a failed batch stays queued and is sent again, unchanged, once the backoff has passed"""
+        sender = self.sender()
+        self.play(sender, "One")
+        self.receiver.fail_next(2, 503)
+        delay = sender.send_once()
+        self.assertGreater(delay, 0)
+        self.assertEqual(self.queue.summary(), [("stats", 1, 1)])
+        
+        # Still backing off
+        self.now += delay / 2
+        sender.send_once()
+        self.assertEqual(self.queue.depth(), 1)
+        
+        self.now += delay
+        second = sender.send_once()
+        self.assertGreater(second, delay / 2)
+        self.now += second + 1
+        self.assertIsNone(sender.send_once())
+        self.assertEqual(self.queue.depth(), 0)
+        self.assertEqual(len(self.receiver.plays), 1)
+        
+        # A batch sent again after a lost response carries the same key
+        key = self.receiver.requests[0][1]["Idempotency-Key"]
+        HttpBackend({"url": self.receiver.url}).send([dict(play) for play in self.receiver.plays.values()])
+        self.assertEqual(self.receiver.requests[-1][1]["Idempotency-Key"], key)
+        self.assertEqual(self.receiver.duplicates, 1)
+    
+    def test_refused_batch_is_dropped(self):
+        """Test plays a service refuses as invalid do not block the queue"""
+        sender = self.sender()
+        self.play(sender, "One")
+        self.receiver.fail_next(1, 422)
+        self.assertIsNone(sender.send_once())
+        self.assertEqual(self.queue.depth(), 0)
+        self.assertEqual(self.receiver.plays, {})
+    
+    def test_background_sender_sends_full_batch(self):
+        """Test the sender thread wakes up as soon as a batch is full"""
+        sender = self.sender(batch_size=1, interval=60).start()
+        try:
+            self.play(sender, "One")
+            deadline = time.time() + 5
+            while not self.receiver.plays and time.time() < deadline:
+                time.sleep(0.02)
+            self.assertEqual(len(self.receiver.plays), 1)
+        finally:
+            sender.stop(timeout=2)
+    
+    def test_stop_during_a_send_leaves_the_queue_to_the_thread(self):
+        """Test a send outlasting stop() still records its result before the queue is closed"""
+        started, release = threading.Event(), threading.Event()
+        sent = []
+        
+        class SlowBackend:
+            name = "slow"
+            batch_size = 1
+            
+            def send(self, plays):
+                started.set()
+                release.wait(5)
+                sent.extend(plays)
+        
+        sender = ScrobbleSender(self.queue, [SlowBackend()], {"batch_size": 1, "interval": 60}).start()
+        self.play(sender, "One")
+        self.assertTrue(started.wait(5))
+        sender.stop(timeout=0.05)
+        self.assertTrue(sender._thread.is_alive())
+        release.set()
+        sender._thread.join(5)
+        self.assertFalse(sender._thread.is_alive())
+        self.assertEqual(len(sent), 1)
+        self.queue = ScrobbleQueue(self.db_path)
+        self.assertEqual(self.queue.depth(), 0)
+    
+    def test_listenbrainz_payload(self):
+        """Test plays are submitted as ListenBrainz listens"""
+        backend = ListenBrainzBackend({"token": "secret", "url": self.receiver.url})
+        sender = ScrobbleSender(self.queue, [backend], clock=lambda: self.now)
+        self.play(sender, "One")
+        self.play(sender, "Two")
+        sender.send_once()
+        _, headers, body = self.receiver.requests[0]
+        self.assertEqual(headers["Authorization"], "Token secret")
+        self.assertEqual(body["listen_type"], "import")
+        self.assertEqual(body["payload"][0]["listened_at"], 1750000000)
+        self.assertEqual(body["payload"][0]["track_metadata"]["track_name"], "One")
+    
+    def test_config_validation(self):
+        """Test scrobble services are checked when the config is loaded"""
+        Config({"discord_application_id": "1", "scrobble": {"enabled": True, "services": [
+            {"type": "http", "url": "http://127.0.0.1:8766/"}, {"type": "listenbrainz", "token": "x"}]}})
+        with self.assertRaises(ConfigError) as ctx:
+            Config({"discord_application_id": "1", "scrobble": {"services": [{"type": "lastfm"}]}})
+        self.assertIn("scrobble.services[0].type", str(ctx.exception))
+        
+        # Plays are queued per service name, so two services cannot share one
+        two_hooks = [{"type": "http", "url": self.receiver.url}, {"type": "http", "url": "http://127.0.0.1:9/"}]
+        with self.assertRaises(ConfigError) as ctx:
+            Config({"discord_application_id": "1", "scrobble": {"services": two_hooks}})
+        self.assertIn("scrobble.services[1] needs a name of its own", str(ctx.exception))
+        self.assertEqual([backend.name for backend in make_backends(two_hooks)], ["http"])
+        two_hooks[1]["name"] = "backup"
+        for name in ("batch_size", "interval"):
+            with self.assertRaises(ConfigError) as ctx:
+                Config({"discord_application_id": "1", "scrobble": {name: 0, "services": two_hooks}})
+            self.assertIn(f"scrobble.{name} must be greater than 0", str(ctx.exception))
+        Config({"discord_application_id": "1", "scrobble": {"services": two_hooks}})
+        self.assertEqual([backend.name for backend in make_backends(two_hooks)], ["http", "backup"])
+
+
+class TestProfiles(unittest.TestCase):
+    """Test running several game installs side by side"""
+    
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.games = {}
+        for name in ("bay1", "bay2"):
+            game_dir = os.path.join(self.test_dir, name, "SynthRiders")
+            os.makedirs(os.path.join(game_dir, "SynthRidersUC"))
+            with open(os.path.join(game_dir, "SynthDB"), "w") as f:
+                f.write("")
+            self.games[name] = game_dir
+        self.config_path = os.path.join(self.test_dir, "config.json")
+        self.write_config()
+    
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def write_config(self, button_label="Play Synth Riders"):
+        profiles = [{
+            "name": name,
+            "song_status_path": os.path.join(game_dir, "SynthRidersUC", "SongStatusOutput.txt"),
+            "cover_image_path": os.path.join(game_dir, "SynthRidersUC", "SongStatusImage.png"),
+            # Both bays use the first install's song library
+            "synth_db_path": os.path.join(self.games["bay1"], "SynthDB"),
+        } for name, game_dir in self.games.items()]
+        profiles[1]["button_label"] = "Bay 2"
+        with open(self.config_path, "w") as f:
+            json.dump({"discord_application_id": "1", "button_label": button_label,
+                       "poll_intervals": {"process": 0.02, "status_file": 0.02, "presence_refresh": 0.5},
+                       "adaptive_polling": {"enabled": False}, "profiles": profiles}, f)
+    
+    def write_status(self, name, content):
+        path = os.path.join(self.games[name], "SynthRidersUC", "SongStatusOutput.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+    
+    def test_profile_configs_and_reload(self):
+        """Test profiles inherit the main config, are validated and follow config.json changes"""
+        config = load_config(self.config_path)
+        profiles = dict(profile_configs(config))
+        self.assertEqual(list(profiles), ["bay1", "bay2"])
+        self.assertEqual(profiles["bay1"]["button_label"], "Play Synth Riders")
+        self.assertEqual(profiles["bay2"]["button_label"], "Bay 2")
+        self.assertEqual(profiles["bay2"]["poll_intervals"]["process"], 0.02)
+        self.assertNotIn("profiles", profiles["bay1"])
+        with self.assertRaises(ConfigError) as ctx:
+            Config({"discord_application_id": "1", "profiles": [{"name": "a"}, {"name": "a", "show_button": 1}]})
+        self.assertIn("profiles[1].name a is used twice", str(ctx.exception))
+        self.assertIn("profiles[1]: show_button must be true or false", str(ctx.exception))
+        overlay = {"enabled": True}
+        with self.assertRaises(ConfigError) as ctx:
+            Config({"discord_application_id": "1", "overlay_server": overlay,
+                    "profiles": [{"name": "a"}, {"name": "b"}, {"name": "c", "overlay_server": {"port": 8766}}]})
+        self.assertIn("profiles[1].overlay_server.port 8765 is already used by profiles[0]", str(ctx.exception))
+        self.assertNotIn("profiles[2]", str(ctx.exception))
+        
+        reloader = ConfigReloader(self.config_path, config)
+        bay1 = ProfileReloader(reloader, "bay1", profiles["bay1"])
+        bay2 = ProfileReloader(reloader, "bay2", profiles["bay2"])
+        self.write_config(button_label="Ride")
+        stamp = time.time() + 5
+        os.utime(self.config_path, (stamp, stamp))
+        self.assertEqual(bay1.check()["button_label"], "Ride")
+        # bay2 picks up the file bay1 already loaded; its own label did not change
+        self.assertIsNone(bay2.check())
+        self.assertIsNone(bay1.check())
+    
+    def test_process_scan_is_shared(self):
+        """Test one process scan answers every profile and each profile finds its own game"""
+        now = [0.0]
+        scans = []
+        
+        def scan():
+            scans.append(now[0])
+            return [(11, os.path.join(self.games["bay2"], "SynthRiders.exe"))]
+        
+        shared = SharedProcessScan(scan, max_age=2.0, clock=lambda: now[0])
+        bay1 = shared.checker(game_dir_of(os.path.join(self.games["bay1"], "SynthRidersUC", "x.txt")))
+        bay2 = shared.checker(self.games["bay2"])
+        self.assertEqual((bay1(), bay2()), (False, 11))
+        now[0] = 1.0
+        self.assertEqual((bay1(), bay2()), (False, 11))
+        self.assertEqual(scans, [0.0])
+        now[0] = 2.5
+        bay2()
+        self.assertEqual(scans, [0.0, 2.5])
+    
+    def test_install_inside_a_prefix_is_not_claimed(self):
+        """Test a profile only claims the game of its own folder, not of a folder whose name starts the same"""
+        stable = os.path.join(self.test_dir, "Games", "SynthRiders")
+        beta = os.path.join(self.test_dir, "Games", "SynthRiders-Beta")
+        shared = SharedProcessScan(lambda: [(22, os.path.join(beta, "SynthRiders.exe"))])
+        self.assertFalse(shared.checker(stable)())
+        self.assertEqual(shared.checker(beta)(), 22)
+        self.assertEqual(shared.checker(beta + os.sep)(), 22)
+    
+    def test_shared_synthdb_lookups(self):
+        """Test profiles with the same SynthDB look a song up once, other SynthDBs separately"""
+        profiles = dict(profile_configs(load_config(self.config_path)))
+        shared = SharedEnrichment(workers=2)
+        watchers = [SongStatusWatcher(config, shared=shared) for config in profiles.values()]
+        other = dict(profiles["bay2"], synth_db_path=os.path.join(self.games["bay2"], "SynthDB"))
+        watchers.append(SongStatusWatcher(other, shared=shared))
+        for name in self.games:
+            self.write_status(name, "Berzerk by Eminem\nMaster (mapped by AudioTiZm)")
+        details = {'id': 1, 'duration': 180, 'bpm': 140, 'year': '', 'is_custom': True, 'environment': '',
+                   'mapper': 'AudioTiZm'}
+        try:
+            with patch('song_status.get_song_details_from_synthdb', return_value=details) as lookup:
+                results = [watcher.parse_song_status() for watcher in watchers]
+            self.assertEqual([result['synthdb_id'] for result in results], [1, 1, 1])
+            self.assertEqual(sorted(call.args[0] for call in lookup.call_args_list),
+                             sorted({watcher.db_path for watcher in watchers}))
+        finally:
+            shared.close()
+    
+    def test_supervisor_runs_profiles_on_one_loop(self):
+        """Test each profile gets its own session and sink, and stop() ends all of them"""
+        profiles = profile_configs(load_config(self.config_path))
+        shared = SharedEnrichment(workers=2)
+        scan = SharedProcessScan(lambda: [(11, os.path.join(self.games["bay2"], "SynthRiders.exe"))], max_age=0.5)
+        events = {name: [] for name, _ in profiles}
+        pipelines = []
+        for name, config in profiles:
+            sink = Mock()
+            sink.on_event.side_effect = lambda event, session_id, data, timestamp, name=name: \
+                events[name].append(event)
+            watcher = SongStatusWatcher(config, shared=shared)
+            watcher.upload_image = Mock(return_value=None)
+            pipelines.append(RPCPipeline(NullPresence(), watcher, config,
+                                         scan.checker(game_dir_of(watcher.song_status_path)), sinks=[sink]))
+        supervisor = PipelineSupervisor(pipelines, [name for name, _ in profiles])
+        self.write_status("bay2", "Berzerk by Eminem\nMaster (mapped by AudioTiZm)")
+        thread = threading.Thread(target=supervisor.run, daemon=True)
+        with patch('song_status.get_song_details_from_synthdb', return_value=None):
+            thread.start()
+            deadline = time.time() + 5
+            while "song_start" not in events["bay2"] and time.time() < deadline:
+                time.sleep(0.01)
+            supervisor.stop()
+            thread.join(5)
+        shared.close()
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(events["bay1"], [])
+        self.assertEqual(events["bay2"][:3], ["session_start", "game_start", "song_start"])
+        self.assertIsNone(supervisor.session_ids["bay1"])
+
+
 def run_smoke_tests():
     """Run all smoke tests"""
     print("Running Synth Riders Discord RPC Smoke Tests...")
@@ -536,10 +2247,31 @@ def run_smoke_tests():
     # Add test classes
     test_classes = [
         TestSongStatusWatcher,
+        TestSongInfo,
         TestSynthDB,
         TestDiscordPresence,
         TestIntegrationSmoke,
-        TestErrorHandlingSmoke
+        TestPipelineSmoke,
+        TestPollingCadence,
+        TestHeadlessSmoke,
+        TestErrorHandlingSmoke,
+        TestHistoryStore,
+        TestLogRetention,
+        TestSessionTimeline,
+        TestUpdateChecker,
+        TestReplayHarness,
+        TestMetrics,
+        TestProfiler,
+        TestConfig,
+        TestNowPlayingServer,
+        TestCoverCache,
+        TestSingleFlight,
+        TestShutdown,
+        TestInstallDiscovery,
+        TestPlayStats,
+        TestLogImport,
+        TestScrobble,
+        TestProfiles
     ]
     
     for test_class in test_classes:
@@ -0,0 +1,257 @@
+"""
+Local now-playing server for stream overlays.
+
+A pipeline sink that pushes song start/update/stop and idle events to browser
+sources over Server-Sent Events or WebSocket, without any extra packages:
+
+    GET /events       text/event-stream
+    GET /ws           WebSocket, text frames with the same JSON
+    GET /now-playing  current state as JSON
+    GET /cover        cover of the current song, served from memory
+
+New subscribers get the current state right away. Every event is encoded
+once and the same bytes are written to all clients; a client that stops
+reading is dropped instead of being buffered for.
+"""
+
+import json
+import base64
+import asyncio
+import hashlib
+import threading
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# Song fields sent to overlays; local paths stay private
+SONG_FIELDS = ("song_name", "artist", "difficulty", "mapper", "duration", "bpm", "year", "start_time", "cover_url")
+
+
+def ws_frame(payload, opcode=0x1):
+    """
+    Encode a single unmasked server-to-client WebSocket frame
+    """
+    length = len(payload)
+    if length < 126:
+        header = bytes([0x80 | opcode, length])
+    elif length < 65536:
+        header = bytes([0x80 | opcode, 126]) + length.to_bytes(2, "big")
+    else:
+        header = bytes([0x80 | opcode, 127]) + length.to_bytes(8, "big")
+    return header + payload
+
+
+async def read_ws_frame(reader, max_size=65536):
+    """
+    Read one client frame
+
+    Returns:
+        tuple: (opcode, payload)
+    """
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), "big")
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), "big")
+    if length > max_size:
+        raise ConnectionError("WebSocket frame too large")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return first & 0x0F, payload
+
+
+class NowPlayingServer:
+    """
+    Pipeline sink broadcasting now-playing state to overlay clients
+    """
+    def __init__(self, port=8765, host="127.0.0.1", max_buffer=256 * 1024, keepalive=15):
+        self.host = host
+        self.port = port
+        self.max_buffer = max_buffer
+        self.keepalive = keepalive
+        self.state = self._message("idle", None, None)
+        self.cover = None
+        self._clients = {}
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+
+    # Pipeline sink
+
+    def on_event(self, event, session_id, data, timestamp):
+        cover = None
+        if event in ("song_start", "song_update") and data:
+            cover = self._read_cover(data.get('cover_path'))
+            message = self._message(event, data, timestamp, cover)
+        elif event == "song_stop" and data:
+            message = self._message("song_stop", data, timestamp)
+        elif event in ("game_stop", "session_end"):
+            if self.state["event"] == "idle":
+                return
+            message = self._message("idle", None, timestamp)
+        else:
+            return
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._publish, message, cover)
+
+    def _message(self, event, song_info, timestamp, cover=None):
+        song = {key: song_info.get(key) for key in SONG_FIELDS} if song_info else None
+        if song and cover:
+            song["cover"] = f"http://{self.host}:{self.port}/cover?v={cover[0]}"
+        return {"event": event, "timestamp": timestamp, "song": song}
+
+    def _read_cover(self, path):
+        # Read now, the game overwrites the file for the next song
+        if not path:
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        return (hashlib.sha1(data).hexdigest()[:16], data) if data else None
+
+    # Server
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="NowPlayingServer", daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        if self._error:
+            raise self._error
+        return self
+
+    def stop(self, timeout=5.0):
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._stopping.set)
+        except RuntimeError:
+            pass
+        self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            asyncio.run(self._serve())
+        except OSError as e:
+            self._error = e
+            self._ready.set()
+
+    async def _serve(self):
+        self._stopping = asyncio.Event()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._loop = asyncio.get_running_loop()
+        self._ready.set()
+        keepalive = asyncio.create_task(self._keepalive())
+        try:
+            await self._stopping.wait()
+        finally:
+            keepalive.cancel()
+            self._server.close()
+            for writer in list(self._clients):
+                self._drop(writer)
+            await self._server.wait_closed()
+            self._loop = None
+
+    async def _keepalive(self):
+        # Proxies and some browsers close event streams that stay silent
+        while True:
+            await asyncio.sleep(self.keepalive)
+            for writer, kind in list(self._clients.items()):
+                if kind == "sse":
+                    self._send(writer, b": keepalive\n\n")
+
+    def _encode(self, message):
+        data = json.dumps(message, ensure_ascii=False)
+        return {
+            "sse": f"event: {message['event']}\ndata: {data}\n\n".encode("utf-8"),
+            "ws": ws_frame(data.encode("utf-8")),
+        }
+
+    def _publish(self, message, cover):
+        if cover:
+            self.cover = cover
+        self.state = message
+        frames = self._encode(message)
+        for writer, kind in list(self._clients.items()):
+            self._send(writer, frames[kind])
+
+    def _send(self, writer, frame):
+        if writer.transport.is_closing() or writer.transport.get_write_buffer_size() > self.max_buffer:
+            # Slow or gone client; drop it rather than buffer without limit
+            self._drop(writer)
+        else:
+            writer.write(frame)
+
+    def _drop(self, writer):
+        self._clients.pop(writer, None)
+        writer.close()
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            lines = request.decode("latin-1").split("\r\n")
+            method, target, _ = lines[0].split(" ", 2)
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                if value:
+                    headers[name.strip().lower()] = value.strip()
+            path = target.split("?")[0]
+            if method != "GET":
+                self._respond(writer, 405, b"Method Not Allowed")
+            elif path == "/events":
+                await self._serve_sse(reader, writer)
+            elif path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+                await self._serve_ws(reader, writer, headers)
+            elif path == "/now-playing":
+                body = json.dumps(self.state, ensure_ascii=False).encode("utf-8")
+                self._respond(writer, 200, body, "application/json; charset=utf-8")
+            elif path == "/cover" and self.cover:
+                self._respond(writer, 200, self.cover[1], "image/png", {"ETag": f'"{self.cover[0]}"'})
+            else:
+                self._respond(writer, 404, b"Not Found")
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ConnectionError, ValueError):
+            pass
+        finally:
+            self._clients.pop(writer, None)
+            writer.close()
+
+    def _respond(self, writer, status, body, content_type="text/plain; charset=utf-8", extra_headers=None):
+        reasons = {200: "OK", 404: "Not Found", 405: "Method Not Allowed"}
+        head = [f"HTTP/1.1 {status} {reasons[status]}", f"Content-Type: {content_type}",
+                f"Content-Length: {len(body)}", "Access-Control-Allow-Origin: *", "Cache-Control: no-cache",
+                "Connection: close"]
+        head.extend(f"{name}: {value}" for name, value in (extra_headers or {}).items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+
+    async def _serve_sse(self, reader, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Access-Control-Allow-Origin: *\r\nConnection: keep-alive\r\n\r\n")
+        writer.write(self._encode(dict(self.state, event="state"))["sse"])
+        self._clients[writer] = "sse"
+        # Event streams are one way; wait for the client to go away
+        while await reader.read(1024):
+            pass
+
+    async def _serve_ws(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode("latin-1")).digest()).decode("ascii")
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("latin-1"))
+        writer.write(self._encode(dict(self.state, event="state"))["ws"])
+        self._clients[writer] = "ws"
+        while True:
+            opcode, payload = await read_ws_frame(reader)
+            if opcode == 0x8:
+                writer.write(ws_frame(payload[:2], opcode=0x8))
+                return
+            if opcode == 0x9:
+                writer.write(ws_frame(payload, opcode=0xA))
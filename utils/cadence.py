@@ -0,0 +1,123 @@
+import time
+from collections import deque
+
+# The loop this replaces woke every 5 seconds no matter what
+LEGACY_INTERVAL = 5
+
+DEFAULT_CADENCE = {
+    "enabled": True,
+    # Game not running: only the process scan runs
+    "game_closed": 30,
+    # Game running: how often to check the process is still there
+    "game_running": 10,
+    # Browsing menus, nothing playing
+    "menu": 1.5,
+    # Right after a song stopped or the game started, the next change is likely soon
+    "fast": 0.5,
+    "fast_window": 15,
+    # Mid-song, with a known duration we only need to catch early quits
+    "mid_song": 10,
+    # Switch back to fast polling this many seconds before the expected end
+    "song_end_margin": 5,
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class PollingCadence:
+    """
+    Chooses poll intervals from the game state and keeps wakeup and
+    detection latency statistics, so the cost of the adaptive schedule can
+    be compared against the old fixed 5 second loop.
+
+    With adaptive polling disabled the fixed `poll_intervals` are used and
+    the statistics are still collected.
+    """
+    def __init__(self, settings=None, fixed_intervals=None, clock=time.time):
+        self.configure(settings, fixed_intervals)
+        self.clock = clock
+        self.started = clock()
+        self.wakeups = {}
+        self.latencies = deque(maxlen=1000)
+        self.fast_until = 0
+
+    def configure(self, settings=None, fixed_intervals=None):
+        """
+        Replace the intervals, keeping the collected statistics
+        """
+        self.settings = dict(DEFAULT_CADENCE)
+        self.settings.update(settings or {})
+        self.fixed = fixed_intervals or {}
+
+    @property
+    def adaptive(self):
+        return self.settings["enabled"]
+
+    def burst(self, now=None):
+        """
+        Poll fast for a while, e.g. after a song stopped or the game started
+        """
+        self.fast_until = (now or self.clock()) + self.settings["fast_window"]
+
+    def process_interval(self, game_running):
+        if not self.adaptive:
+            return self.fixed.get("process", LEGACY_INTERVAL)
+        return self.settings["game_running"] if game_running else self.settings["game_closed"]
+
+    def status_interval(self, current_song=None, now=None):
+        if not self.adaptive:
+            return self.fixed.get("status_file", LEGACY_INTERVAL)
+        now = now or self.clock()
+        fast = self.settings["fast"]
+        if now < self.fast_until:
+            return fast
+        if not current_song:
+            return self.settings["menu"]
+
+        mid_song = self.settings["mid_song"]
+        start = current_song.get('start_time')
+        duration = current_song.get('duration')
+        if not start or not duration:
+            return mid_song
+        expected_end = start + duration
+        remaining = expected_end - self.settings["song_end_margin"] - now
+        if remaining <= 0:
+            return fast
+        return max(fast, min(mid_song, remaining))
+
+    def record_wakeup(self, task):
+        self.wakeups[task] = self.wakeups.get(task, 0) + 1
+
+    def record_latency(self, seconds):
+        """
+        Record how long after the status file was written a change was seen
+        """
+        if seconds is not None and seconds >= 0:
+            self.latencies.append(seconds)
+
+    def report(self, now=None):
+        """
+        Wakeups per hour and detection latency next to the legacy fixed loop
+
+        Returns:
+            dict: Summary suitable for logging
+        """
+        hours = max((now or self.clock()) - self.started, 1e-9) / 3600
+        latencies = list(self.latencies)
+        return {
+            'adaptive': self.adaptive,
+            'wakeups_per_hour': round(sum(self.wakeups.values()) / hours, 1),
+            'wakeups_per_hour_by_task': {task: round(count / hours, 1) for task, count in self.wakeups.items()},
+            'legacy_wakeups_per_hour': round(3600 / LEGACY_INTERVAL, 1),
+            'detections': len(latencies),
+            'latency_p50': percentile(latencies, 0.5),
+            'latency_p95': percentile(latencies, 0.95),
+            'latency_max': max(latencies) if latencies else None,
+            'legacy_latency_mean': LEGACY_INTERVAL / 2,
+        }
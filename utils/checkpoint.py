@@ -0,0 +1,58 @@
+import os
+import json
+import time
+
+
+class SessionCheckpoint:
+    """
+    Small JSON snapshot of the running session.
+
+    Holds the session id, the timeline position, the song that is playing
+    and the last presence payload, so a restarted app (crash, update, reboot)
+    continues the session where it was instead of starting a new one or
+    parsing the session's log files. The file is replaced atomically, a crash
+    mid-write leaves the previous checkpoint intact.
+    """
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+
+    def load(self, max_age=None):
+        """
+        Returns:
+            dict: The saved state, or None if there is none, it is unreadable or older than `max_age` seconds
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable session checkpoint: {e}")
+            return None
+        if not isinstance(state, dict) or not state.get("session_id"):
+            return None
+        if max_age is not None and self.clock() - state.get("saved_at", 0) > max_age:
+            return None
+        return state
+
+    def save(self, state):
+        state = dict(state, saved_at=self.clock())
+        tmp_path = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Failed to write session checkpoint: {e}")
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Failed to remove session checkpoint: {e}")
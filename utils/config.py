@@ -0,0 +1,347 @@
+import re
+import json
+import threading
+from types import MappingProxyType
+from collections.abc import Mapping
+
+from utils.file_watch import FileWatch
+
+# Discord rejects button labels longer than this
+MAX_BUTTON_LABEL = 32
+
+STRING_KEYS = ("image_upload_url", "song_status_path", "cover_image_path", "synth_db_path", "button_label",
+               "button_url", "history_db_path", "record_session_dir", "game_dir")
+BOOL_KEYS = ("show_button", "promote_preference", "history_enabled", "show_stats", "discord_presence")
+# Sections whose values are switches or non-negative numbers
+SECTION_KEYS = ("poll_intervals", "adaptive_polling", "log_retention", "profiling", "overlay_server",
+                "cover_cache", "enrichment")
+# Intervals and counts that 0 would turn into a busy loop, a crash or a no-op; True marks whole numbers
+POSITIVE_KEYS = {
+    "adaptive_polling": {"game_closed": False, "game_running": False, "menu": False, "fast": False, "mid_song": False},
+    "log_retention": {"interval_minutes": False},
+    "profiling": {"interval_minutes": False, "top_n": True, "keep": True, "traceback_frames": True},
+    "cover_cache": {"max_mb": False, "max_files": True},
+    "enrichment": {"workers": True},
+}
+# Service types of utils.scrobble.BACKENDS, listed here so validating the config doesn't load the sender
+SCROBBLE_SERVICES = ("http", "listenbrainz")
+# Profile names become log folder names
+PROFILE_NAME_RE = re.compile(r"^[A-Za-z0-9_.-]{1,40}$")
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_config(data):
+    """
+    Check a parsed config.json
+
+    Returns:
+        list: Human readable problems, empty if the config is valid
+    """
+    if not isinstance(data, dict):
+        return ["config must be a JSON object"]
+    errors = []
+    app_id = data.get("discord_application_id")
+    if not isinstance(app_id, str) or not app_id.strip():
+        errors.append("discord_application_id must be a non-empty string")
+    for key in STRING_KEYS:
+        if key in data and not isinstance(data[key], str):
+            errors.append(f"{key} must be a string")
+    for key in BOOL_KEYS:
+        if key in data and not isinstance(data[key], bool):
+            errors.append(f"{key} must be true or false")
+    for key in SECTION_KEYS:
+        section = data.get(key)
+        if section is None:
+            continue
+        if not isinstance(section, dict):
+            errors.append(f"{key} must be an object")
+            continue
+        for name, value in section.items():
+            if not isinstance(value, bool) and not (is_number(value) and value >= 0):
+                errors.append(f"{key}.{name} must be true/false or a non-negative number")
+        for name, whole in POSITIVE_KEYS.get(key, {}).items():
+            value = section.get(name)
+            if whole and is_number(value) and (value <= 0 or value != int(value)):
+                errors.append(f"{key}.{name} must be a whole number greater than 0")
+            elif is_number(value) and value <= 0:
+                errors.append(f"{key}.{name} must be greater than 0")
+    errors.extend(validate_scrobble(data.get("scrobble")))
+    for name, value in (data.get("poll_intervals") or {}).items():
+        if is_number(value) and value <= 0:
+            errors.append(f"poll_intervals.{name} must be greater than 0")
+    if "update_check_interval_hours" in data and not (is_number(data["update_check_interval_hours"])
+                                                       and data["update_check_interval_hours"] >= 0):
+        errors.append("update_check_interval_hours must be a non-negative number")
+    port = data.get("metrics_port")
+    if port is not None and not (isinstance(port, int) and not isinstance(port, bool) and 0 <= port <= 65535):
+        errors.append("metrics_port must be a port number (0 to disable)")
+    if data.get("show_button", True):
+        label = data.get("button_label", "Synth Riders")
+        url = data.get("button_url", "https://synthridersvr.com")
+        if isinstance(label, str) and not 0 < len(label) <= MAX_BUTTON_LABEL:
+            errors.append(f"button_label must be 1 to {MAX_BUTTON_LABEL} characters")
+        if isinstance(url, str) and not url.startswith(("http://", "https://")):
+            errors.append("button_url must start with http:// or https://")
+    if not errors:
+        # Checked last, so problems of the main config are not repeated for every profile
+        errors.extend(validate_profiles(data))
+    return errors
+
+
+def validate_scrobble(section):
+    if section is None:
+        return []
+    if not isinstance(section, dict):
+        return ["scrobble must be an object"]
+    errors = []
+    for name, value in section.items():
+        if name == "services":
+            continue
+        if not isinstance(value, bool) and not (is_number(value) and value >= 0):
+            errors.append(f"scrobble.{name} must be true/false or a non-negative number")
+    for name in ("batch_size", "interval"):
+        if is_number(section.get(name)) and section[name] <= 0:
+            errors.append(f"scrobble.{name} must be greater than 0")
+    services = section.get("services", [])
+    if not isinstance(services, list):
+        return errors + ["scrobble.services must be a list"]
+    names = set()
+    for i, service in enumerate(services):
+        if not isinstance(service, dict) or service.get("type") not in SCROBBLE_SERVICES:
+            errors.append(f"scrobble.services[{i}].type must be one of: {', '.join(SCROBBLE_SERVICES)}")
+            continue
+        # Queued plays are kept per service name, which defaults to the type
+        name = service.get("name") or service["type"]
+        if name in names:
+            errors.append(f"scrobble.services[{i}] needs a name of its own, {name} is already used")
+        names.add(name)
+        if service["type"] == "http" and not str(service.get("url", "")).startswith(("http://", "https://")):
+            errors.append(f"scrobble.services[{i}].url must start with http:// or https://")
+        elif service["type"] == "listenbrainz" and not isinstance(service.get("token"), str):
+            errors.append(f"scrobble.services[{i}].token must be a string")
+    return errors
+
+
+def validate_profiles(data):
+    profiles = data.get("profiles")
+    if profiles is None:
+        return []
+    if not isinstance(profiles, list):
+        return ["profiles must be a list"]
+    errors = []
+    names = set()
+    ports = {}
+    for i, profile in enumerate(profiles):
+        if not isinstance(profile, dict):
+            errors.append(f"profiles[{i}] must be an object")
+            continue
+        name = profile.get("name")
+        if not isinstance(name, str) or not PROFILE_NAME_RE.match(name) or name.strip(".") == "":
+            errors.append(f"profiles[{i}].name must be 1 to 40 letters, digits, '.', '_' or '-'")
+        elif name in names:
+            errors.append(f"profiles[{i}].name {name} is used twice")
+        names.add(name)
+        if "profiles" in profile:
+            errors.append(f"profiles[{i}] cannot have profiles of its own")
+            continue
+        # A profile is the main config with its own values on top, which has to be valid as a whole
+        merged = merge_profile(data, profile)
+        errors.extend(f"profiles[{i}]: {error}" for error in validate_config(merged))
+        # Each profile runs its own overlay server, only one of them can listen on a port
+        overlay = merged.get("overlay_server")
+        if isinstance(overlay, dict) and overlay.get("enabled"):
+            port = overlay.get("port", 8765)
+            if port in ports:
+                errors.append(f"profiles[{i}].overlay_server.port {port} is already used by profiles[{ports[port]}]")
+            else:
+                ports[port] = i
+    return errors
+
+
+def presence_buttons(config):
+    """
+    Discord button payload for a config, or None when buttons are off
+    """
+    if not config.get("show_button", True):
+        return None
+    return [{
+        "label": config.get("button_label", "Synth Riders"),
+        "url": config.get("button_url", "https://synthridersvr.com"),
+    }]
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def merge_overrides(data, overrides):
+    """
+    Apply overrides to a config dict, merging one level into sections
+    """
+    merged = dict(data)
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = dict(merged[key], **value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def thaw(value):
+    if isinstance(value, Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+def merge_profile(data, profile):
+    """
+    Config dict of one profile: the main config without `profiles`, with the profile's values merged in
+    """
+    base = {key: value for key, value in data.items() if key != "profiles"}
+    return merge_overrides(base, {key: value for key, value in profile.items() if key != "name"})
+
+
+def profile_configs(config):
+    """
+    Configs of the profiles listed in a config
+
+    Returns:
+        list: (name, Config) pairs, empty if the config has no profiles
+    """
+    data = thaw(config)
+    return [(profile["name"], Config(merge_profile(data, profile))) for profile in data.get("profiles") or ()]
+
+
+class Config(Mapping):
+    """
+    Validated, read-only view of config.json.
+
+    Behaves like the dict it replaces (`config.get(...)`, `config[...]`),
+    with nested sections frozen as well. Values derived from the config,
+    such as the presence button payload, are built once here instead of on
+    every presence update.
+    """
+    __slots__ = ("_data", "presence_buttons")
+
+    def __init__(self, data):
+        errors = validate_config(data)
+        if errors:
+            raise ConfigError("; ".join(errors))
+        object.__setattr__(self, "_data", freeze(data))
+        object.__setattr__(self, "presence_buttons", presence_buttons(data))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Config is read-only")
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"Config({dict(self._data)!r})"
+
+
+def load_config(path, overrides=None):
+    """
+    Read, merge and validate a config file
+
+    Raises:
+        ConfigError: If the file is missing, not valid JSON or fails validation
+    """
+    try:
+        with open(path, "r", encoding="UTF-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ConfigError(f"Cannot read {path}: {e}") from e
+    if not isinstance(data, dict):
+        raise ConfigError("config must be a JSON object")
+    return Config(merge_overrides(data, overrides))
+
+
+class ConfigReloader:
+    """
+    Watches config.json and builds a new Config when it changes.
+
+    Invalid edits (half-saved files, typos) are reported and ignored, so the
+    last good config stays in effect until the file is fixed.
+    """
+    def __init__(self, path, config, overrides=None):
+        self.path = path
+        self.config = config
+        self.overrides = overrides
+        self.watch = FileWatch(path)
+        # The current file is what `config` was loaded from
+        self.watch.changed()
+        # Profile pipelines check the same file from their own threads
+        self._lock = threading.Lock()
+
+    def check(self):
+        """
+        Returns:
+            Config: The new config if the file changed to a valid, different config, otherwise None
+        """
+        with self._lock:
+            if not self.watch.changed():
+                return None
+            try:
+                config = load_config(self.path, self.overrides)
+            except ConfigError as e:
+                print(f"Ignoring invalid config change, keeping the last good config: {e}")
+                return None
+            if config == self.config:
+                return None
+            self.config = config
+            return config
+
+
+class ProfileReloader:
+    """
+    ConfigReloader for one profile, sharing the main config's file watch.
+
+    Every profile pipeline checks through its own ProfileReloader; whichever
+    notices the change first loads the file, the others pick up the new
+    main config on their next check. Adding or removing profiles needs a
+    restart.
+    """
+    def __init__(self, reloader, name, config):
+        self.reloader = reloader
+        self.name = name
+        self.config = config
+        self._base = reloader.config
+
+    def check(self):
+        self.reloader.check()
+        base = self.reloader.config
+        if base is self._base:
+            return None
+        self._base = base
+        try:
+            config = dict(profile_configs(base)).get(self.name)
+        except ConfigError as e:
+            print(f"Ignoring invalid config change for profile {self.name}: {e}")
+            return None
+        if config is None:
+            print(f"Profile {self.name} was removed from the config; it keeps running until the app is restarted")
+            return None
+        if config == self.config:
+            return None
+        self.config = config
+        return config
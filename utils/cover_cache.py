@@ -0,0 +1,185 @@
+import io
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import namedtuple
+
+DEFAULT_COVER_CACHE = {
+    "enabled": True,
+    "max_mb": 50,
+    "max_files": 500,
+    # Longest side of stored covers in pixels, 0 keeps the original
+    "thumbnail_px": 256,
+    # uguu.se keeps uploads for 3 hours
+    "upload_ttl_hours": 2.5,
+}
+
+CoverEntry = namedtuple("CoverEntry", "digest path")
+
+
+class CoverCache:
+    """
+    On-disk store of song covers.
+
+    SongStatusImage.png is overwritten for every song, so each cover is kept
+    as a thumbnail named after the hash of the original image, together with
+    the SynthDB track id and image file it belongs to and the URL it was last
+    uploaded to. Repeat plays then take the cover and, while it is still
+    valid, the upload URL from here. Least recently used covers are removed
+    once the size or file limits are exceeded.
+    """
+    INDEX_FILE = "index.json"
+    # Lookups only change access times, which are written with the next change or after this many seconds
+    TOUCH_SAVE_SECONDS = 300
+
+    def __init__(self, cache_dir, settings=None, clock=time.time):
+        self.settings = dict(DEFAULT_COVER_CACHE)
+        self.settings.update(settings or {})
+        self.cache_dir = cache_dir
+        self.clock = clock
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index = self._load()
+        self._saved_at = clock()
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.cache_dir, self.INDEX_FILE), "r", encoding="UTF-8") as f:
+                index = json.load(f)
+            if isinstance(index.get("covers"), dict) and isinstance(index.get("keys"), dict):
+                return index
+        except (OSError, ValueError, AttributeError):
+            pass
+        return {"covers": {}, "keys": {}}
+
+    def _save(self):
+        path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        try:
+            with open(path + ".tmp", "w", encoding="UTF-8") as f:
+                json.dump(self._index, f)
+            os.replace(path + ".tmp", path)
+            self._saved_at = self.clock()
+        except OSError as e:
+            print(f"Failed to save cover cache index: {e}")
+
+    @staticmethod
+    def _keys(synthdb_id=None, image_file=None):
+        keys = []
+        if synthdb_id is not None:
+            keys.append(f"id:{synthdb_id}")
+        if image_file:
+            keys.append(f"file:{image_file}")
+        return keys
+
+    def _entry(self, digest):
+        return CoverEntry(digest, os.path.join(self.cache_dir, self._index["covers"][digest]["file"]))
+
+    def put(self, data, synthdb_id=None, image_file=None):
+        """
+        Store a cover image (if new) and link it to the SynthDB track
+
+        Returns:
+            CoverEntry: Hash of the original image and path of the stored copy
+        """
+        digest = hashlib.sha1(data).hexdigest()
+        with self._lock:
+            covers = self._index["covers"]
+            cover = covers.get(digest)
+            if cover is None or not os.path.exists(os.path.join(self.cache_dir, cover["file"])):
+                cover = covers[digest] = {"file": self._store(digest, data), "upload_url": None, "uploaded_at": 0}
+                cover["size"] = os.path.getsize(os.path.join(self.cache_dir, cover["file"]))
+            cover["last_used"] = self.clock()
+            for key in self._keys(synthdb_id, image_file):
+                self._index["keys"][key] = digest
+            self._evict(keep=digest)
+            self._save()
+            return self._entry(digest)
+
+    def link(self, digest, synthdb_id=None, image_file=None):
+        """
+        Remember which SynthDB track a stored cover belongs to
+        """
+        with self._lock:
+            if digest not in self._index["covers"]:
+                return
+            keys = self._keys(synthdb_id, image_file)
+            if all(self._index["keys"].get(key) == digest for key in keys):
+                return
+            for key in keys:
+                self._index["keys"][key] = digest
+            self._save()
+
+    def lookup(self, synthdb_id=None, image_file=None):
+        """
+        Cached cover of a SynthDB track, or None
+        """
+        with self._lock:
+            for key in self._keys(synthdb_id, image_file):
+                digest = self._index["keys"].get(key)
+                cover = self._index["covers"].get(digest)
+                if cover and os.path.exists(os.path.join(self.cache_dir, cover["file"])):
+                    cover["last_used"] = self.clock()
+                    if cover["last_used"] - self._saved_at >= self.TOUCH_SAVE_SECONDS:
+                        self._save()
+                    return self._entry(digest)
+        return None
+
+    def upload_url(self, digest):
+        """
+        URL the cover was uploaded to, if it has not expired yet
+        """
+        with self._lock:
+            cover = self._index["covers"].get(digest)
+            if cover and cover.get("upload_url") and \
+                    self.clock() - cover["uploaded_at"] < self.settings["upload_ttl_hours"] * 3600:
+                return cover["upload_url"]
+        return None
+
+    def set_upload_url(self, digest, url):
+        with self._lock:
+            cover = self._index["covers"].get(digest)
+            if cover:
+                cover["upload_url"] = url
+                cover["uploaded_at"] = self.clock()
+                self._save()
+
+    def _store(self, digest, data):
+        stored = data
+        size = self.settings["thumbnail_px"]
+        if size:
+            try:
+                # Loaded on first use, PIL is only needed once a new cover shows up
+                from PIL import Image
+                image = Image.open(io.BytesIO(data))
+                if max(image.size) > size:
+                    image.thumbnail((size, size))
+                    out = io.BytesIO()
+                    image.save(out, "PNG", optimize=True)
+                    stored = out.getvalue()
+            except Exception as e:
+                print(f"Could not create cover thumbnail, keeping the original: {e}")
+        file_name = f"{digest}.png"
+        path = os.path.join(self.cache_dir, file_name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(stored)
+        os.replace(path + ".tmp", path)
+        return file_name
+
+    def _evict(self, keep):
+        covers = self._index["covers"]
+        max_bytes = self.settings["max_mb"] * 1024 * 1024
+        total = sum(cover["size"] for cover in covers.values())
+        while len(covers) > self.settings["max_files"] or total > max_bytes:
+            victim = min((digest for digest in covers if digest != keep), key=lambda d: covers[d]["last_used"],
+                         default=None)
+            if victim is None:
+                break
+            cover = covers.pop(victim)
+            total -= cover["size"]
+            try:
+                os.remove(os.path.join(self.cache_dir, cover["file"]))
+            except FileNotFoundError:
+                pass
+            self._index["keys"] = {key: digest for key, digest in self._index["keys"].items() if digest != victim}
@@ -0,0 +1,35 @@
+import os
+
+
+class FileWatch:
+    """
+    Detects writes to a file from its modification time and size
+    """
+    def __init__(self, path):
+        self.path = path
+        self.last_modified = 0
+        self._signature = None
+
+    def changed(self):
+        """
+        Check if the file was written since the last call
+
+        Returns:
+            bool: True if the file changed; a missing file is never a change
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        signature = (st.st_mtime_ns, st.st_size)
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        self.last_modified = st.st_mtime
+        return True
+
+    def reset(self):
+        """
+        Report the file as changed on the next check
+        """
+        self._signature = None
@@ -0,0 +1,402 @@
+import os
+import sys
+import time
+import queue
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, date, timedelta
+
+from utils.paths import app_dir
+
+# The app's log folder when started without --log-dir, the same one main.py writes to
+APP_LOG_DIR = os.path.join(app_dir(), "log")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    started_at REAL NOT NULL,
+    ended_at REAL,
+    log_name TEXT
+);
+CREATE TABLE IF NOT EXISTS plays (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT,
+    song_key TEXT NOT NULL,
+    synthdb_id INTEGER,
+    song_name TEXT,
+    artist TEXT,
+    mapper TEXT,
+    difficulty TEXT,
+    started_at REAL NOT NULL,
+    ended_at REAL,
+    duration REAL,
+    day TEXT NOT NULL,
+    UNIQUE (session_id, song_key, started_at)
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_started_at ON sessions (started_at);
+CREATE INDEX IF NOT EXISTS idx_plays_started_at ON plays (started_at);
+CREATE INDEX IF NOT EXISTS idx_plays_song_key ON plays (song_key, started_at);
+CREATE INDEX IF NOT EXISTS idx_plays_mapper ON plays (mapper, started_at);
+CREATE INDEX IF NOT EXISTS idx_plays_day ON plays (day, duration);
+"""
+
+INSERT_SESSION = "INSERT OR IGNORE INTO sessions (id, started_at, log_name) VALUES (?, ?, ?)"
+END_SESSION = "UPDATE sessions SET ended_at = ? WHERE id = ?"
+INSERT_PLAY = """
+INSERT OR IGNORE INTO plays (
+    session_id, song_key, synthdb_id, song_name, artist, mapper,
+    difficulty, started_at, ended_at, duration, day
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def open_history_db(db_path):
+    """
+    Open the history database in WAL mode and make sure the schema exists
+    """
+    directory = os.path.dirname(os.path.abspath(db_path))
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def play_row(session_id, song_info, ended_at):
+    """
+    Build an INSERT_PLAY parameter tuple from a song_info dict
+
+    Returns:
+        tuple: Row parameters, or None if the song has no key or start time
+    """
+    song_key = song_info.get('song_id')
+    started_at = song_info.get('start_time')
+    if not song_key or not started_at:
+        return None
+    duration = max(0.0, ended_at - started_at) if ended_at else None
+    day = datetime.fromtimestamp(started_at).strftime("%Y-%m-%d")
+    return (
+        session_id,
+        song_key,
+        song_info.get('synthdb_id'),
+        song_info.get('song_name'),
+        song_info.get('artist'),
+        song_info.get('mapper'),
+        song_info.get('difficulty'),
+        started_at,
+        ended_at,
+        duration,
+        day,
+    )
+
+
+class HistoryStore:
+    """
+    Indexed SQLite store for sessions and plays.
+
+    Writes are queued and committed in batches by a background thread so the
+    RPC loop never waits on disk. Queries open their own read connection,
+    which WAL mode allows while the writer is active.
+    """
+    def __init__(self, db_path, batch_size=50, flush_interval=2.0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._closed = False
+        # Create the schema up front so queries work before the first write
+        open_history_db(db_path).close()
+
+    def start(self):
+        """
+        Start the background writer thread
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._writer, name="HistoryWriter", daemon=True)
+            self._thread.start()
+        return self
+
+    def start_session(self, session_id, started_at, log_name=None):
+        self._queue.put((INSERT_SESSION, (session_id, started_at, log_name)))
+
+    def end_session(self, session_id, ended_at):
+        self._queue.put((END_SESSION, (ended_at, session_id)))
+
+    def record_play(self, session_id, song_info, ended_at):
+        """
+        Queue a finished play for insertion
+        """
+        if not song_info:
+            return
+        row = play_row(session_id, song_info, ended_at)
+        if row:
+            self._queue.put((INSERT_PLAY, row))
+
+    def flush(self, timeout=5.0):
+        """
+        Wait until everything queued so far has been committed
+        """
+        if self._thread is None or not self._thread.is_alive():
+            conn = open_history_db(self.db_path)
+            try:
+                self._drain(conn)
+            finally:
+                conn.close()
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """
+        Commit pending writes and stop the writer thread
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+        else:
+            self.flush(timeout)
+
+    def _drain(self, conn):
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, tuple):
+                batch.append(item)
+            elif isinstance(item, threading.Event):
+                item.set()
+        self._write_batch(conn, batch)
+
+    def _write_batch(self, conn, batch):
+        if not batch:
+            return
+        try:
+            with conn:
+                for sql, params in batch:
+                    conn.execute(sql, params)
+        except sqlite3.Error as e:
+            print(f"Failed to write play history: {e}")
+
+    def _writer(self):
+        conn = open_history_db(self.db_path)
+        try:
+            running = True
+            while running:
+                batch = []
+                waiters = []
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        running = False
+                        break
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                        break
+                    batch.append(item)
+                self._write_batch(conn, batch)
+                for waiter in waiters:
+                    waiter.set()
+            self._drain(conn)
+        finally:
+            conn.close()
+
+    # Queries
+
+    def _read(self, sql, params=()):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def top_songs(self, since=None, until=None, limit=10):
+        """
+        Most played songs as (song_name, artist, plays, seconds) rows
+        """
+        sql = """
+        SELECT song_name, artist, COUNT(*) AS plays, COALESCE(SUM(duration), 0)
+        FROM plays
+        WHERE started_at >= ? AND started_at < ?
+        GROUP BY song_key
+        ORDER BY plays DESC, song_name
+        LIMIT ?
+        """
+        return self._read(sql, (*_time_range(since, until), limit))
+
+    def play_count(self, song, since=None, until=None):
+        """
+        Number of plays of songs whose name matches `song`
+        """
+        sql = """
+        SELECT COUNT(*) FROM plays
+        WHERE started_at >= ? AND started_at < ? AND song_name LIKE ?
+        """
+        return self._read(sql, (*_time_range(since, until), f"%{song}%"))[0][0]
+
+    def playtime_per_day(self, since=None, until=None):
+        """
+        Played time per local day as (day, plays, seconds) rows
+        """
+        start, end = _time_range(since, until)
+        sql = """
+        SELECT day, COUNT(*), COALESCE(SUM(duration), 0)
+        FROM plays
+        WHERE day >= ? AND day < ?
+        GROUP BY day
+        ORDER BY day
+        """
+        return self._read(sql, (_day(start), _day(end)))
+
+    def playtime_per_mapper(self, since=None, until=None, limit=10):
+        """
+        Played time per mapper as (mapper, plays, seconds) rows
+        """
+        sql = """
+        SELECT mapper, COUNT(*), COALESCE(SUM(duration), 0) AS seconds
+        FROM plays
+        WHERE started_at >= ? AND started_at < ?
+        GROUP BY mapper
+        ORDER BY seconds DESC
+        LIMIT ?
+        """
+        return self._read(sql, (*_time_range(since, until), limit))
+
+    def streaks(self, today=None):
+        """
+        Longest and current run of consecutive days with at least one play
+
+        Returns:
+            dict: longest, longest_start, longest_end and current streak
+        """
+        days = [date.fromisoformat(row[0]) for row in self._read("SELECT DISTINCT day FROM plays ORDER BY day")]
+        result = {'longest': 0, 'longest_start': None, 'longest_end': None, 'current': 0}
+        if not days:
+            return result
+
+        run_start = days[0]
+        run_length = 1
+        for previous, current in zip(days, days[1:]):
+            if current - previous == timedelta(days=1):
+                run_length += 1
+            else:
+                run_start = current
+                run_length = 1
+            if run_length > result['longest']:
+                result.update(longest=run_length, longest_start=run_start, longest_end=current)
+        if result['longest'] == 0:
+            result.update(longest=1, longest_start=days[0], longest_end=days[0])
+
+        today = today or date.today()
+        # A streak is still current if the last play was today or yesterday
+        if today - days[-1] <= timedelta(days=1):
+            result['current'] = run_length
+        return result
+
+
+def _parse_date(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.strptime(value, "%Y-%m-%d").timestamp()
+
+
+def _time_range(since, until):
+    start = _parse_date(since)
+    end = _parse_date(until)
+    return (start if start is not None else 0.0, end if end is not None else float("inf"))
+
+
+def _day(timestamp):
+    if timestamp == float("inf"):
+        return "9999-12-31"
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+
+
+def _format_seconds(seconds):
+    seconds = int(seconds or 0)
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
+
+def main(argv=None):
+    """
+    Command line interface for querying the play history
+    """
+    parser = argparse.ArgumentParser(prog="python -m utils.history", description="Query Synth Riders play history")
+    parser.add_argument("--db", default=os.path.join(APP_LOG_DIR, "history.db"), help="Path to history database")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_range(p):
+        p.add_argument("--since", help="Start date (YYYY-MM-DD)")
+        p.add_argument("--until", help="End date, exclusive (YYYY-MM-DD)")
+
+    top = sub.add_parser("top", help="Most played songs")
+    add_range(top)
+    top.add_argument("--limit", type=int, default=10)
+
+    count = sub.add_parser("count", help="How often a song was played")
+    add_range(count)
+    count.add_argument("song", help="Song name (substring match)")
+
+    daily = sub.add_parser("daily", help="Playtime per day")
+    add_range(daily)
+
+    mappers = sub.add_parser("mappers", help="Playtime per mapper")
+    add_range(mappers)
+    mappers.add_argument("--limit", type=int, default=10)
+
+    sub.add_parser("streaks", help="Longest and current daily streak")
+
+    importer = sub.add_parser("import", help="Import plays from session logs (rpc*.log, .gz and monthly archives)")
+    importer.add_argument("paths", nargs="+", help="Log files or directories")
+    importer.add_argument("--workers", type=int, help="Parser processes (default: one per CPU)")
+
+    args = parser.parse_args(argv)
+    if args.command == "import":
+        # Only needed for imports
+        from utils.log_import import format_report, import_logs
+        print(format_report(import_logs(args.db, args.paths, args.workers)))
+        return 0
+    if not os.path.exists(args.db):
+        print(f"History database not found: {args.db}")
+        return 1
+    store = HistoryStore(args.db)
+
+    if args.command == "top":
+        for song_name, artist, plays, seconds in store.top_songs(args.since, args.until, args.limit):
+            print(f"{plays:5d}  {_format_seconds(seconds):>8}  {song_name} by {artist}")
+    elif args.command == "count":
+        print(store.play_count(args.song, args.since, args.until))
+    elif args.command == "daily":
+        for day, plays, seconds in store.playtime_per_day(args.since, args.until):
+            print(f"{day}  {plays:4d} plays  {_format_seconds(seconds):>8}")
+    elif args.command == "mappers":
+        for mapper, plays, seconds in store.playtime_per_mapper(args.since, args.until, args.limit):
+            print(f"{_format_seconds(seconds):>8}  {plays:5d} plays  {mapper}")
+    elif args.command == "streaks":
+        streaks = store.streaks()
+        print(f"Current streak: {streaks['current']} day(s)")
+        if streaks['longest']:
+            print(f"Longest streak: {streaks['longest']} day(s) "
+                  f"({streaks['longest_start']} - {streaks['longest_end']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
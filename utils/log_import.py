@@ -0,0 +1,194 @@
+"""
+Rebuild play history from existing session logs.
+
+Reads every rpc<session>.log (plain or gzipped, also inside the monthly
+rpc-archive-YYYYMM.tar files made by log retention) line by line, turns
+SONG STOP entries into play rows and inserts them into the history
+database. Files are parsed in a process pool; rows are inserted in batches
+with INSERT OR IGNORE, so importing the same logs twice adds nothing.
+"""
+
+import os
+import json
+import gzip
+import time
+import tarfile
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.history import INSERT_PLAY, INSERT_SESSION, open_history_db, play_row
+from utils.log_retention import ARCHIVE_RE, SESSION_FILE_RE
+
+START_MARK = b"SONG START: "
+STOP_MARK = b"SONG STOP: "
+
+
+def find_logs(paths):
+    """
+    Session logs and monthly archives to import from files and directories
+    """
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            entries = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        else:
+            entries = [path]
+        for entry in entries:
+            name = os.path.basename(entry)
+            match = SESSION_FILE_RE.match(name)
+            if (match and match.group(2) == "log") or ARCHIVE_RE.match(name):
+                sources.append(entry)
+    return sources
+
+
+def _line_time(line):
+    # b"[2025-06-01 20:03:00,123] ..." as written by the logging module; fromisoformat is far faster than strptime,
+    # but before Python 3.11 it only takes a dot before the milliseconds
+    try:
+        return datetime.fromisoformat(line[1:24].replace(b",", b".").decode("ascii")).timestamp()
+    except ValueError:
+        return None
+
+
+def parse_source(path):
+    """
+    Parse a session log, or every session log in a monthly archive
+
+    Returns:
+        list: (session row, play rows, lines read, bytes read) per session log
+    """
+    if not ARCHIVE_RE.match(os.path.basename(path)):
+        session_id = SESSION_FILE_RE.match(os.path.basename(path)).group(1)
+        try:
+            with open(path, "rb") as raw:
+                return [parse_log(raw, session_id, os.path.basename(path))]
+        except OSError as e:
+            print(f"Skipping unreadable log {path}: {e}")
+            return []
+    results = []
+    try:
+        # Streamed in one pass, members are read as the archive is
+        with tarfile.open(path, "r|") as tar:
+            for member in tar:
+                name = os.path.basename(member.name)
+                match = SESSION_FILE_RE.match(name)
+                if member.isfile() and match and match.group(2) == "log":
+                    results.append(parse_log(tar.extractfile(member), match.group(1), name))
+    except (OSError, tarfile.TarError) as e:
+        print(f"Skipping unreadable archive {path}: {e}")
+    return results
+
+
+def parse_log(raw, session_id, log_name):
+    """
+    Play rows of one session log, read line by line from a binary file object
+
+    Returns:
+        tuple: (session row, play rows, lines read, bytes read)
+    """
+    plays = []
+    lines = 0
+    size = 0
+    first_time = None
+    last_start = None
+    if log_name.endswith(".gz"):
+        raw = gzip.GzipFile(fileobj=raw)
+    try:
+        for line in raw:
+            lines += 1
+            size += len(line)
+            if first_time is None:
+                first_time = _line_time(line)
+            # Most lines are process checks; only song lines are decoded
+            index = line.find(START_MARK)
+            if index >= 0:
+                last_start = line
+                continue
+            index = line.find(STOP_MARK)
+            if index < 0:
+                continue
+            song_info = _load_song(line[index + len(STOP_MARK):])
+            if not song_info:
+                continue
+            if not song_info.get('start_time') and last_start:
+                # Logs where the start time was not recorded: take it from the SONG START line
+                song_info['start_time'] = _line_time(last_start)
+            row = play_row(session_id, song_info, _line_time(line))
+            if row:
+                plays.append(row)
+    except (OSError, EOFError) as e:
+        # Truncated gzip from a crash; keep what was read
+        print(f"Log {log_name} ends early: {e}")
+    if first_time is None:
+        first_time = datetime.strptime(session_id, "%Y%m%d%H%M%S%f").timestamp()
+    return (session_id, first_time, log_name), plays, lines, size
+
+
+def _load_song(data):
+    try:
+        song_info = json.loads(data)
+    except ValueError:
+        # "No song info available." and lines cut off by a crash
+        return None
+    return song_info if isinstance(song_info, dict) else None
+
+
+def import_logs(db_path, paths, workers=None, batch_size=500):
+    """
+    Import session logs into the history database
+
+    Returns:
+        dict: Session logs, lines, bytes, plays found and inserted, and the seconds it took
+    """
+    started = time.perf_counter()
+    sources = find_logs(paths)
+    report = {"files": 0, "lines": 0, "bytes": 0, "plays": 0, "inserted": 0}
+    conn = open_history_db(db_path)
+    try:
+        sessions, plays = [], []
+
+        def flush():
+            with conn:
+                conn.executemany(INSERT_SESSION, sessions)
+                before = conn.total_changes
+                conn.executemany(INSERT_PLAY, plays)
+                report["inserted"] += conn.total_changes - before
+            sessions.clear()
+            plays.clear()
+
+        workers = workers or os.cpu_count() or 1
+        if workers == 1 or len(sources) < 8:
+            # Starting worker processes costs more than a handful of logs
+            pool = None
+            results = map(parse_source, sources)
+        else:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            # Chunks keep the per-task overhead down for many small logs
+            results = pool.map(parse_source, sources, chunksize=max(1, min(64, len(sources) // (4 * workers))))
+        try:
+            for source_results in results:
+                for session, rows, lines, size in source_results:
+                    report["files"] += 1
+                    report["lines"] += lines
+                    report["bytes"] += size
+                    report["plays"] += len(rows)
+                    sessions.append(session)
+                    plays.extend(rows)
+                if len(plays) >= batch_size or len(sessions) >= batch_size:
+                    flush()
+            flush()
+        finally:
+            if pool:
+                pool.shutdown()
+    finally:
+        conn.close()
+    report["seconds"] = time.perf_counter() - started
+    return report
+
+
+def format_report(report):
+    seconds = max(report["seconds"], 1e-9)
+    return (f"{report['files']} logs, {report['lines']} lines, {report['plays']} plays "
+            f"({report['inserted']} new) in {report['seconds']:.2f}s: "
+            f"{report['files'] / seconds:.0f} files/s, {report['lines'] / seconds:.0f} lines/s, "
+            f"{report['bytes'] / seconds / 1e6:.1f} MB/s")
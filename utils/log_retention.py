@@ -0,0 +1,253 @@
+import os
+import re
+import sys
+import gzip
+import time
+import shutil
+import tarfile
+import threading
+from datetime import datetime, timedelta
+
+# rpc{%Y%m%d%H%M%S%f}.log / .srt, optionally gzipped
+SESSION_FILE_RE = re.compile(r"^rpc(\d{20})\.(log|srt|vtt)(\.gz)?$")
+ARCHIVE_RE = re.compile(r"^rpc-archive-(\d{6})\.tar$")
+
+DEFAULT_RETENTION = {
+    "enabled": True,
+    "interval_minutes": 60,
+    "compress_after_hours": 6,
+    "max_age_days": 365,
+    "max_files": 2000,
+    "max_total_mb": 200,
+    "merge_monthly": False,
+    "merge_max_kb": 64,
+}
+
+
+def _lower_thread_priority():
+    """
+    Drop the priority of the calling thread so housekeeping only uses idle CPU
+    """
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            THREAD_PRIORITY_IDLE = -15
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetThreadPriority(kernel32.GetCurrentThread(), THREAD_PRIORITY_IDLE)
+        elif hasattr(os, "setpriority"):
+            # On Linux the "process" id of a thread is its native thread id
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except Exception:
+        pass
+
+
+class SessionFile:
+    """
+    A file belonging to one RPC session in the log directory
+    """
+    __slots__ = ("name", "path", "session", "size", "mtime", "compressed")
+
+    def __init__(self, name, path, session, size, mtime, compressed):
+        self.name = name
+        self.path = path
+        self.session = session
+        self.size = size
+        self.mtime = mtime
+        self.compressed = compressed
+
+    @property
+    def started(self):
+        return datetime.strptime(self.session, "%Y%m%d%H%M%S%f")
+
+
+class LogRetentionManager:
+    """
+    Background housekeeping for the log directory.
+
+    Finished sessions are gzipped, and files beyond the configured age, count
+    or total size limits are removed oldest first. Small finished sessions can
+    optionally be merged into one uncompressed tar of .gz members per month.
+    The active session (as reported by `active_session`) is never touched.
+    """
+    def __init__(self, log_dir, settings=None, active_session=None, stop_event=None):
+        self.log_dir = log_dir
+        self.settings = dict(DEFAULT_RETENTION)
+        self.settings.update(settings or {})
+        self.active_session = active_session or (lambda: None)
+        # May be the app-wide shutdown event, which wakes this thread together with the others
+        self._stop_event = stop_event or threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start the housekeeping thread if retention is enabled
+        """
+        if self.settings["enabled"] and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="LogRetention", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        _lower_thread_priority()
+        # Give startup and the first presence update a head start
+        if self._stop_event.wait(60):
+            return
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error during log retention: {e}")
+            self._stop_event.wait(self.settings["interval_minutes"] * 60)
+
+    def _pause(self):
+        # Yield between file operations so a big backlog never hogs the disk
+        self._stop_event.wait(0.01)
+
+    def scan(self):
+        """
+        List session files and monthly archives in the log directory
+        """
+        files = []
+        archives = []
+        try:
+            entries = list(os.scandir(self.log_dir))
+        except FileNotFoundError:
+            return files, archives
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            match = SESSION_FILE_RE.match(entry.name)
+            if match:
+                stat = entry.stat()
+                files.append(SessionFile(entry.name, entry.path, match.group(1), stat.st_size,
+                                         stat.st_mtime, bool(match.group(3))))
+            elif ARCHIVE_RE.match(entry.name):
+                archives.append(entry)
+        return files, archives
+
+    def finished_files(self, files, now):
+        """
+        Files of sessions that are not active and haven't been written recently
+        """
+        active = self.active_session()
+        latest_write = {}
+        for f in files:
+            latest_write[f.session] = max(latest_write.get(f.session, 0), f.mtime)
+        compress_before = now - self.settings["compress_after_hours"] * 3600
+        return [f for f in files if f.session != active and latest_write[f.session] < compress_before]
+
+    def run_once(self, now=None):
+        """
+        Run one housekeeping pass
+
+        Returns:
+            dict: Number of files compressed, merged and deleted
+        """
+        now = now or time.time()
+        stats = {"compressed": 0, "merged": 0, "deleted": 0}
+        files, archives = self.scan()
+
+        for f in self.finished_files(files, now):
+            if self._stop_event.is_set():
+                return stats
+            if not f.compressed and self._compress(f):
+                stats["compressed"] += 1
+                self._pause()
+
+        if self.settings["merge_monthly"]:
+            files, archives = self.scan()
+            stats["merged"] = self._merge_monthly(self.finished_files(files, now), now)
+
+        files, archives = self.scan()
+        stats["deleted"] = self._enforce_limits(self.finished_files(files, now), archives, now)
+        return stats
+
+    def _compress(self, f):
+        target = f.path + ".gz"
+        try:
+            with open(f.path, "rb") as src, gzip.open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.utime(target, (f.mtime, f.mtime))
+            os.remove(f.path)
+            return True
+        except OSError as e:
+            # The file may still be held open by a logger, try again next pass
+            print(f"Could not compress {f.name}: {e}")
+            if os.path.exists(target) and os.path.exists(f.path):
+                os.remove(target)
+            return False
+
+    def _merge_monthly(self, finished, now):
+        limit = self.settings["merge_max_kb"] * 1024
+        current_month = datetime.fromtimestamp(now).strftime("%Y%m")
+        merged = 0
+        by_month = {}
+        for f in finished:
+            month = f.session[:6]
+            if f.compressed and f.size <= limit and month != current_month:
+                by_month.setdefault(month, []).append(f)
+        for month, members in sorted(by_month.items()):
+            archive_path = os.path.join(self.log_dir, f"rpc-archive-{month}.tar")
+            try:
+                with tarfile.open(archive_path, "a") as tar:
+                    # A run that failed before removing the logs already archived some of them
+                    archived = set(tar.getnames())
+                    for f in sorted(members, key=lambda m: m.name):
+                        if f.name not in archived:
+                            tar.add(f.path, arcname=f.name)
+                for f in members:
+                    os.remove(f.path)
+                    merged += 1
+            except (OSError, tarfile.TarError) as e:
+                print(f"Could not merge logs for {month}: {e}")
+            self._pause()
+        return merged
+
+    def _enforce_limits(self, finished, archives, now):
+        deleted = 0
+        cutoff = datetime.fromtimestamp(now) - timedelta(days=self.settings["max_age_days"])
+
+        # Oldest first; an archive counts as one file dated to the end of its month
+        candidates = [(f.started, f.path, f.size) for f in finished]
+        for entry in archives:
+            month = ARCHIVE_RE.match(entry.name).group(1)
+            candidates.append((_month_end(month), entry.path, entry.stat().st_size))
+        candidates.sort()
+
+        kept = []
+        for started, path, size in candidates:
+            if started < cutoff:
+                deleted += self._delete(path)
+            else:
+                kept.append((path, size))
+
+        max_files = self.settings["max_files"]
+        max_bytes = self.settings["max_total_mb"] * 1024 * 1024
+        total = sum(size for _, size in kept)
+        count = len(kept)
+        for path, size in kept:
+            if count <= max_files and total <= max_bytes:
+                break
+            if self._delete(path):
+                deleted += 1
+                count -= 1
+                total -= size
+        return deleted
+
+    def _delete(self, path):
+        try:
+            os.remove(path)
+            return 1
+        except OSError as e:
+            print(f"Could not delete {path}: {e}")
+            return 0
+
+
+def _month_end(month):
+    start = datetime.strptime(month, "%Y%m")
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(microseconds=1)
@@ -0,0 +1,14 @@
+import os
+import sys
+
+
+def app_dir():
+    """
+    Folder the app runs from, holding settings/, log/ and cache/
+
+    Next to the executable when built with PyInstaller (the modules are unpacked to a temporary folder), otherwise
+    the folder of main.py, also when a utils module is run on its own with python -m
+    """
+    if getattr(sys, "frozen", False):
+        return os.path.dirname(os.path.abspath(sys.executable))
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
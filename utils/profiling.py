@@ -0,0 +1,227 @@
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import functools
+import tracemalloc
+from datetime import datetime
+
+DEFAULT_PROFILING = {
+    "enabled": False,
+    "interval_minutes": 30,
+    # Functions and allocation sites listed in each report
+    "top_n": 25,
+    # Snapshots kept in the profile folder, oldest are removed first
+    "keep": 48,
+    # Stack depth recorded per allocation; more is slower
+    "traceback_frames": 1,
+}
+
+
+class Profiler:
+    """
+    Opt-in CPU and memory profiler for the pipeline's stages.
+
+    Wrapped callables run under a cProfile.Profile owned by the calling
+    thread, so the asyncio worker threads are profiled without touching the
+    tray thread. From Python 3.12 cProfile hooks into the whole interpreter
+    and only one profile can be enabled at a time, so all threads share one
+    that is on while any wrapped call runs. tracemalloc is process wide. Every snapshot writes the CPU
+    stats since the previous snapshot (`.pstats` plus a readable `.txt`) and
+    the allocation growth since the previous snapshot.
+
+    Nothing is wrapped when profiling is off, so the disabled cost is zero.
+    """
+    def __init__(self, out_dir, settings=None, clock=time.time, stop_event=None):
+        self.settings = dict(DEFAULT_PROFILING)
+        self.settings.update(settings or {})
+        self.out_dir = out_dir
+        self.clock = clock
+        self._local = threading.local()
+        self._profiles = []
+        self._profiles_lock = threading.Lock()
+        # Python 3.12+: the one profile and how many wrapped calls are running, guarded by _profiles_lock
+        self._shared = cProfile.Profile() if sys.version_info >= (3, 12) else None
+        self._running = 0
+        self._shared_enabled = False
+        self._snapshot_lock = threading.Lock()
+        self._last_memory = None
+        self._stop = stop_event or threading.Event()
+        self._thread = None
+
+    def _thread_profile(self):
+        entry = getattr(self._local, "entry", None)
+        if entry is None:
+            entry = (threading.RLock(), cProfile.Profile())
+            self._local.entry = entry
+            self._local.depth = 0
+            with self._profiles_lock:
+                self._profiles.append(entry)
+        return entry
+
+    def wrap(self, func):
+        """
+        Return `func` profiled in whichever thread calls it
+        """
+        if self._shared is not None:
+            return self._wrap_shared(func)
+
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            lock, profile = self._thread_profile()
+            with lock:
+                # Nested wrapped calls are already covered by the outer one
+                self._local.depth += 1
+                enabled = self._local.depth == 1 and self._enable(profile)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    if enabled:
+                        profile.disable()
+                    self._local.depth -= 1
+        return profiled
+
+    def _wrap_shared(self, func):
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            with self._profiles_lock:
+                self._running += 1
+                if not self._shared_enabled:
+                    self._shared_enabled = self._enable(self._shared)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._profiles_lock:
+                    self._running -= 1
+                    if self._running == 0 and self._shared_enabled:
+                        self._shared.disable()
+                        self._shared_enabled = False
+        return profiled
+
+    @staticmethod
+    def _enable(profile):
+        # Another profiler (a debugger, coverage) may hold the interpreter's hook; the stage then just runs
+        try:
+            profile.enable()
+            return True
+        except ValueError:
+            return False
+
+    def profile_methods(self, obj, *names):
+        for name in names:
+            setattr(obj, name, self.wrap(getattr(obj, name)))
+
+    def _collect_cpu(self):
+        stream = io.StringIO()
+        stats = None
+        with self._profiles_lock:
+            entries = list(self._profiles)
+            if self._shared is not None:
+                # create_stats() disables the profile; calls still running are profiled on from here
+                self._shared.create_stats()
+                if self._shared.stats:
+                    stats = pstats.Stats(self._shared, stream=stream)
+                self._shared.clear()
+                if self._shared_enabled:
+                    self._shared_enabled = self._enable(self._shared)
+        for lock, profile in entries:
+            # Holding the lock means the profile is not enabled in its thread
+            with lock:
+                profile.create_stats()
+                if profile.stats:
+                    if stats is None:
+                        stats = pstats.Stats(profile, stream=stream)
+                    else:
+                        stats.add(profile)
+                profile.clear()
+        return stats, stream
+
+    def _collect_memory(self):
+        if not tracemalloc.is_tracing():
+            return None, None
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+        previous, self._last_memory = self._last_memory, snapshot
+        if previous is None:
+            return snapshot.statistics("lineno"), False
+        return snapshot.compare_to(previous, "lineno"), True
+
+    def snapshot(self, label="periodic"):
+        """
+        Write CPU and memory reports for the time since the last snapshot
+
+        Returns:
+            str: Path of the readable report
+        """
+        top_n = self.settings["top_n"]
+        with self._snapshot_lock:
+            os.makedirs(self.out_dir, exist_ok=True)
+            name = datetime.fromtimestamp(self.clock()).strftime(f"profile-%Y%m%d%H%M%S%f-{label}")
+            base = os.path.join(self.out_dir, name)
+
+            stats, stream = self._collect_cpu()
+            memory, is_diff = self._collect_memory()
+
+            lines = [f"Profile snapshot ({label}) at {datetime.fromtimestamp(self.clock()).isoformat()}", ""]
+            lines.append("== CPU, cumulative time since previous snapshot ==")
+            if stats:
+                stats.dump_stats(base + ".pstats")
+                stats.sort_stats("cumulative").print_stats(top_n)
+                lines.append(stream.getvalue())
+            else:
+                lines.append("No profiled calls.")
+            lines.append("")
+            if memory is None:
+                lines.append("== Memory: tracemalloc is not running ==")
+            else:
+                current, peak = tracemalloc.get_traced_memory()
+                title = "growth since previous snapshot" if is_diff else "largest allocation sites"
+                lines.append(f"== Memory, {title} (current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB) ==")
+                lines.extend(str(stat) for stat in memory[:top_n])
+
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            self._prune()
+        return base + ".txt"
+
+    def _prune(self):
+        reports = sorted(f for f in os.listdir(self.out_dir) if f.startswith("profile-") and f.endswith(".txt"))
+        for report in reports[:-self.settings["keep"]]:
+            for path in (report, report[:-len(".txt")] + ".pstats"):
+                try:
+                    os.remove(os.path.join(self.out_dir, path))
+                except FileNotFoundError:
+                    pass
+
+    def _run(self):
+        while not self._stop.wait(self.settings["interval_minutes"] * 60):
+            try:
+                self.snapshot()
+            except Exception as e:
+                print(f"Error writing profile snapshot: {e}")
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.settings["traceback_frames"])
+        self._thread = threading.Thread(target=self._run, name="Profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        """
+        Stop the periodic thread and write a final snapshot
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        try:
+            self.snapshot("final")
+        except Exception as e:
+            print(f"Error writing profile snapshot: {e}")
+        tracemalloc.stop()
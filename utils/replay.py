@@ -0,0 +1,296 @@
+"""
+Record and replay of real sessions.
+
+TraceRecorder captures what the pipeline observed: status file contents,
+cover images and game process up/down transitions, each with a timestamp.
+ReplayDriver feeds a trace back through SongStatusWatcher and Presence on a
+fake clock, either at recorded speed or as fast as possible, and reports
+end-to-end latency percentiles and per-stage costs.
+
+    python -m utils.replay TRACE_DIR [--speed 1] [--synth-db PATH]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+
+TRACE_FILE = "trace.jsonl"
+COVERS_DIR = "covers"
+
+
+class TraceRecorder:
+    """
+    Append-only recorder of pipeline inputs
+    """
+    def __init__(self, trace_dir):
+        self.trace_dir = trace_dir
+        os.makedirs(os.path.join(trace_dir, COVERS_DIR), exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _write(self, record):
+        with self._lock, open(os.path.join(self.trace_dir, TRACE_FILE), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def record_process(self, pid, timestamp):
+        self._write({"t": timestamp, "type": "process", "running": bool(pid)})
+
+    def record_status(self, status_path, cover_path, timestamp):
+        """
+        Capture the status file and cover as they are right now
+
+        `timestamp` should be the status file's modification time, which is
+        when the game wrote the change.
+        """
+        try:
+            with open(status_path, "r", encoding="utf-8") as f:
+                content = f.read()
+        except OSError:
+            content = ""
+        cover = None
+        try:
+            with open(cover_path, "rb") as f:
+                data = f.read()
+            if data:
+                cover = hashlib.sha1(data).hexdigest()
+                blob = os.path.join(self.trace_dir, COVERS_DIR, f"{cover}.png")
+                if not os.path.exists(blob):
+                    with open(blob, "wb") as f:
+                        f.write(data)
+        except OSError:
+            pass
+        self._write({"t": timestamp, "type": "status", "content": content, "cover": cover})
+
+
+def load_trace(trace_dir):
+    with open(os.path.join(trace_dir, TRACE_FILE), "r", encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    events.sort(key=lambda e: e["t"])
+    return events
+
+
+class FakeClock:
+    """
+    Clock for replays; time only moves when advanced
+    """
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def advance_to(self, timestamp):
+        self.now = max(self.now, timestamp)
+
+
+class StageTimer:
+    """
+    Collects wall-clock costs per pipeline stage
+    """
+    def __init__(self):
+        self.samples = {}
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+        return timed
+
+    def add(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] * 1000
+
+    return {
+        "count": len(ordered),
+        "total_ms": round(sum(ordered) * 1000, 3),
+        "p50_ms": round(pick(0.5), 3),
+        "p95_ms": round(pick(0.95), 3),
+        "p99_ms": round(pick(0.99), 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+class ReplayDiscordClient:
+    """
+    Stand-in for pypresence that just remembers the activities it was sent
+    """
+    def __init__(self):
+        self.updates = []
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+    def update(self, **activity):
+        self.updates.append(activity)
+
+
+class ReplayDriver:
+    """
+    Replays a recorded trace through SongStatusWatcher and Presence.
+
+    The status task is simulated on a fake clock with the app's own
+    PollingCadence, so reported latency includes the poll delay the real
+    schedule would have had, plus the measured processing cost. With
+    `speed=None` the trace runs as fast as possible; otherwise wall time is
+    slept in proportion (1.0 = recorded speed).
+    """
+    def __init__(self, trace_dir, config=None, speed=None, upload=False):
+        from song_status import SongStatusWatcher
+        from discordrp import Presence
+        from utils.cadence import PollingCadence
+
+        self.events = load_trace(trace_dir)
+        self.trace_dir = trace_dir
+        self.speed = speed
+        self.work_dir = tempfile.mkdtemp(prefix="srrpc-replay-")
+        self.config = dict(config or {})
+        self.config["song_status_path"] = os.path.join(self.work_dir, "SongStatusOutput.txt")
+        self.config["cover_image_path"] = os.path.join(self.work_dir, "SongStatusImage.png")
+
+        start = self.events[0]["t"] if self.events else 0.0
+        self.clock = FakeClock(start)
+        self.timer = StageTimer()
+        self.cadence = PollingCadence(self.config.get("adaptive_polling"), self.config.get("poll_intervals"),
+                                      clock=self.clock.time)
+
+        self.watcher = SongStatusWatcher(self.config, clock=self.clock.time)
+        if not upload:
+            self.watcher.upload_image = lambda path: f"file://{path}"
+        self.watcher.upload_image = self.timer.wrap("upload_image", self.watcher.upload_image)
+        self.watcher.parse_song_status = self.timer.wrap("parse_song_status", self.watcher.parse_song_status)
+        self.watcher.check_for_updates = self.timer.wrap("check_for_updates", self.watcher.check_for_updates)
+
+        self.discord = ReplayDiscordClient()
+        self.presence = Presence(self.config.get("discord_application_id", "replay"))
+        self.presence.rpc = self.discord
+        self.presence.connected = True
+        self.presence.update_song_status = self.timer.wrap("presence_update", self.presence.update_song_status)
+
+    def close(self):
+        # Let the watcher's enrichment threads finish before their files go away
+        self.watcher.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _apply(self, event):
+        if event["type"] != "status":
+            return
+        with open(self.config["song_status_path"], "w", encoding="utf-8") as f:
+            f.write(event["content"])
+        os.utime(self.config["song_status_path"], (event["t"], event["t"]))
+        cover_path = self.config["cover_image_path"]
+        if event.get("cover"):
+            shutil.copyfile(os.path.join(self.trace_dir, COVERS_DIR, f"{event['cover']}.png"), cover_path)
+        elif os.path.exists(cover_path):
+            os.remove(cover_path)
+
+    def _sleep_until(self, timestamp, wall_start):
+        if self.speed:
+            delay = wall_start + (timestamp - self.events[0]["t"]) / self.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        self.clock.advance_to(timestamp)
+
+    def run(self):
+        """
+        Replay the whole trace
+
+        Returns:
+            dict: End-to-end latency and per-stage cost summaries
+        """
+        # SynthDB lookups are timed through the module reference song_status uses
+        import song_status
+        original_lookup = song_status.get_song_details_from_synthdb
+        song_status.get_song_details_from_synthdb = self.timer.wrap("synthdb_lookup", original_lookup)
+        wall_start = time.perf_counter()
+        latencies = []
+        try:
+            pending = list(self.events)
+            running = False
+            next_poll = self.clock.time()
+            while pending or (running and next_poll <= self.clock.time()):
+                # Apply everything that happened before the next poll
+                while pending and (not running or pending[0]["t"] <= next_poll):
+                    event = pending.pop(0)
+                    self._sleep_until(event["t"], wall_start)
+                    if event["type"] == "process":
+                        running = event["running"]
+                        if running:
+                            self.cadence.burst()
+                            next_poll = self.clock.time()
+                    else:
+                        self._apply(event)
+                if not running:
+                    continue
+
+                self._sleep_until(next_poll, wall_start)
+                self.cadence.record_wakeup("status_file")
+                started = time.perf_counter()
+                if self.watcher.check_for_updates():
+                    song_info = self.watcher.parse_song_status()
+                    self.presence.update_song_status(song_info, self.config)
+                    processing = time.perf_counter() - started
+                    latencies.append(self.clock.time() - self.watcher.last_modified + processing)
+                if not pending:
+                    break
+                next_poll = self.clock.time() + self.cadence.status_interval(self.watcher.current_song)
+        finally:
+            song_status.get_song_details_from_synthdb = original_lookup
+
+        simulated = (self.events[-1]["t"] - self.events[0]["t"]) if self.events else 0
+        return {
+            "events": len(self.events),
+            "simulated_seconds": round(simulated, 3),
+            "wall_seconds": round(time.perf_counter() - wall_start, 3),
+            "presence_updates": len(self.discord.updates),
+            "end_to_end": summarize(latencies),
+            "stages": {stage: summarize(samples) for stage, samples in self.timer.samples.items()},
+            "polling": self.cadence.report(),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m utils.replay", description="Replay a recorded session")
+    parser.add_argument("trace_dir", help="Directory written by TraceRecorder")
+    parser.add_argument("--speed", type=float, help="Replay speed (1 = recorded speed, default: as fast as possible)")
+    parser.add_argument("--synth-db", help="Path to SynthDB for enrichment")
+    parser.add_argument("--config", help="config.json to take poll settings from")
+    parser.add_argument("--upload", action="store_true", help="Really upload covers instead of using local paths")
+    args = parser.parse_args(argv)
+
+    config = {}
+    if args.config:
+        with open(args.config, "r", encoding="UTF-8") as f:
+            config = json.load(f)
+    if args.synth_db:
+        config["synth_db_path"] = args.synth_db
+
+    driver = ReplayDriver(args.trace_dir, config, speed=args.speed, upload=args.upload)
+    try:
+        report = driver.run()
+    finally:
+        driver.close()
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,506 @@
+"""
+Send finished plays to scrobbling and stats services.
+
+A pipeline sink: every song that was played long enough is written to an
+on-disk outbox (SQLite, one row per play and service) the moment it ends, so
+plays survive network outages, crashes and restarts. A background thread
+submits the outbox in batches, per service, and only removes rows once the
+service accepted them. Failed batches are retried with exponential backoff;
+every play carries an idempotency key derived from the song and its start
+time, so a batch that is sent again after a lost response can be recognised
+by the receiver.
+
+Services are backends registered in BACKENDS:
+
+    http          POST {"plays": [...]} as JSON to any URL (webhooks, own stats servers)
+    listenbrainz  ListenBrainz submit-listens API
+
+ScrobbleReceiver is a local stand-in for a service, used by the tests and
+handy for trying a setup without an account:
+
+    python -m utils.scrobble receive --port 8766
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+from utils.history import APP_LOG_DIR
+from utils.metrics import REGISTRY
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    service TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (service, key)
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_service ON outbox (service, id);
+"""
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    # Plays shorter than this are not scrobbled (Last.fm's rule is 30 seconds)
+    "min_play_seconds": 30,
+    "batch_size": 50,
+    # Seconds between sends; a full batch is sent right away
+    "interval": 60,
+    "max_backoff": 3600,
+    "timeout": 10,
+}
+
+CLIENT_NAME = "Synth Riders Discord RPC"
+
+queue_depth = REGISTRY.gauge("scrobble_queue_depth", "Plays waiting in the scrobble outbox")
+send_seconds = REGISTRY.histogram("scrobble_send_seconds", "Duration of scrobble batch submissions in seconds")
+sent_total = REGISTRY.counter("scrobble_sent_total", "Plays accepted by scrobble services")
+send_errors = REGISTRY.counter("scrobble_send_errors_total", "Failed scrobble batch submissions")
+rejected_total = REGISTRY.counter("scrobble_rejected_total", "Plays a scrobble service refused and that were dropped")
+
+
+class ScrobbleError(Exception):
+    """
+    A batch was not accepted. `retry` is False when sending it again cannot help
+    """
+    def __init__(self, message, retry=True, retry_after=None):
+        super().__init__(message)
+        self.retry = retry
+        self.retry_after = retry_after
+
+
+def play_key(song_info):
+    """
+    Idempotency key of a play: the same song started at the same moment is the same play
+    """
+    raw = f"{song_info.get('song_id')}|{song_info.get('start_time')!r}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def play_payload(song_info, ended_at):
+    """
+    Service independent description of a finished play
+    """
+    started_at = song_info.get('start_time')
+    return {
+        "song_id": song_info.get('song_id'),
+        "synthdb_id": song_info.get('synthdb_id'),
+        "song_name": song_info.get('song_name'),
+        "artist": song_info.get('artist'),
+        "mapper": song_info.get('mapper'),
+        "difficulty": song_info.get('difficulty'),
+        "duration": song_info.get('duration'),
+        "started_at": started_at,
+        "ended_at": ended_at,
+        "played_seconds": max(0.0, ended_at - started_at) if ended_at else None,
+    }
+
+
+def post_json(url, body, headers=None, timeout=10):
+    """
+    POST a JSON body; raises ScrobbleError unless the response is a success
+    """
+    # Deferred so startup doesn't pay for requests unless scrobbling is on
+    import requests
+    try:
+        response = requests.post(url, json=body, headers=headers, timeout=timeout)
+    except requests.RequestException as e:
+        raise ScrobbleError(f"request failed: {e}")
+    if response.status_code < 300:
+        return response
+    retry_after = response.headers.get("Retry-After")
+    retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+    # Malformed or refused plays stay refused; auth errors and outages can be fixed, so those are retried
+    retry = response.status_code not in (400, 413, 422)
+    raise ScrobbleError(f"HTTP {response.status_code}: {response.text[:200]}", retry, retry_after)
+
+
+class HttpBackend:
+    """
+    Posts batches as {"plays": [...]} to a URL, with an Idempotency-Key header per batch
+    """
+    def __init__(self, settings):
+        if not settings.get("url"):
+            raise ValueError("http scrobble service needs a url")
+        self.name = settings.get("name") or "http"
+        self.url = settings["url"]
+        self.token = settings.get("token")
+        self.batch_size = settings.get("batch_size")
+        self.timeout = settings.get("timeout", DEFAULT_SETTINGS["timeout"])
+
+    def send(self, plays):
+        batch_key = hashlib.sha1("".join(play["key"] for play in plays).encode("ascii")).hexdigest()
+        headers = {"Idempotency-Key": batch_key, "User-Agent": CLIENT_NAME}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        post_json(self.url, {"plays": plays}, headers, self.timeout)
+
+
+class ListenBrainzBackend:
+    """
+    Submits plays as listens to ListenBrainz (https://listenbrainz.org/settings/ for the token)
+    """
+    URL = "https://api.listenbrainz.org/1/submit-listens"
+    # The API takes at most 1000 listens per request
+    MAX_BATCH = 1000
+
+    def __init__(self, settings):
+        if not settings.get("token"):
+            raise ValueError("listenbrainz scrobble service needs a token")
+        self.name = settings.get("name") or "listenbrainz"
+        self.url = settings.get("url") or self.URL
+        self.token = settings["token"]
+        self.batch_size = min(settings.get("batch_size") or self.MAX_BATCH, self.MAX_BATCH)
+        self.timeout = settings.get("timeout", DEFAULT_SETTINGS["timeout"])
+
+    def send(self, plays):
+        listens = []
+        for play in plays:
+            additional_info = {"submission_client": CLIENT_NAME, "media_player": "Synth Riders"}
+            if play.get("duration"):
+                additional_info["duration_ms"] = int(play["duration"] * 1000)
+            listens.append({
+                "listened_at": int(play["started_at"]),
+                "track_metadata": {
+                    "artist_name": play.get("artist") or "Unknown",
+                    "track_name": play.get("song_name") or "Unknown",
+                    "additional_info": additional_info,
+                },
+            })
+        # "single" is for one listen that was just played, several at once are an "import"
+        body = {"listen_type": "single" if len(listens) == 1 else "import", "payload": listens}
+        post_json(self.url, body, {"Authorization": f"Token {self.token}"}, self.timeout)
+
+
+BACKENDS = {
+    "http": HttpBackend,
+    "listenbrainz": ListenBrainzBackend,
+}
+
+
+def make_backends(services):
+    """
+    Backends for the `scrobble.services` config entries; unusable entries are reported and skipped
+    """
+    backends = []
+    for settings in services or ():
+        backend_class = BACKENDS.get(settings.get("type"))
+        if backend_class is None:
+            print(f"Unknown scrobble service type: {settings.get('type')}")
+            continue
+        try:
+            backend = backend_class(settings)
+        except ValueError as e:
+            print(f"Skipping scrobble service: {e}")
+            continue
+        # The outbox keeps plays per name; a second service of the same name would never get any
+        if any(other.name == backend.name for other in backends):
+            print(f"Skipping scrobble service: the name {backend.name} is already used, give it a name of its own")
+            continue
+        backends.append(backend)
+    return backends
+
+
+class ScrobbleQueue:
+    """
+    Durable outbox of plays waiting to be sent, one row per play and service
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # Used from the pipeline's sink thread and the sender thread
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def put(self, services, key, payload, created_at=None):
+        """
+        Queue a play for each service; a play that is already queued is not added twice
+        """
+        data = json.dumps(payload, ensure_ascii=False)
+        created_at = created_at or time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO outbox (service, key, payload, created_at) "
+                                   "VALUES (?, ?, ?, ?)", [(service, key, data, created_at) for service in services])
+
+    def batch(self, service, limit):
+        """
+        Oldest queued plays of a service as (row id, play dict with its "key") pairs
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id, key, payload FROM outbox WHERE service = ? ORDER BY id LIMIT ?",
+                                      (service, limit)).fetchall()
+        return [(row_id, dict(json.loads(payload), key=key)) for row_id, key, payload in rows]
+
+    def remove(self, row_ids):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM outbox WHERE id = ?", [(row_id,) for row_id in row_ids])
+
+    def failed(self, row_ids):
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE outbox SET attempts = attempts + 1 WHERE id = ?",
+                                   [(row_id,) for row_id in row_ids])
+
+    def depth(self, service=None):
+        with self._lock:
+            if service is None:
+                return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM outbox WHERE service = ?", (service,)).fetchone()[0]
+
+    def summary(self):
+        """
+        (service, plays waiting, most failed attempts of one play) rows
+        """
+        with self._lock:
+            return self._conn.execute("SELECT service, COUNT(*), MAX(attempts) FROM outbox GROUP BY service "
+                                      "ORDER BY service").fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ScrobbleSender:
+    """
+    Pipeline sink queueing finished plays and sending them in the background
+    """
+    def __init__(self, queue, backends, settings=None, stop_event=None, clock=time.monotonic):
+        self.queue = queue
+        self.backends = list(backends)
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+        self.clock = clock
+        # May be the app-wide shutdown event
+        self._stop_event = stop_event or threading.Event()
+        self._wake = threading.Event()
+        self._retry_at = {}
+        self._failures = {}
+        self._thread = None
+        queue_depth.set(queue.depth())
+
+    # Pipeline sink
+
+    def on_event(self, event, session_id, data, timestamp):
+        if event != "song_stop" or not data or not data.get('song_id') or not data.get('start_time'):
+            return
+        if timestamp - data['start_time'] < self.settings["min_play_seconds"]:
+            return
+        self.queue.put([backend.name for backend in self.backends], play_key(data), play_payload(data, timestamp))
+        depth = self.queue.depth()
+        queue_depth.set(depth)
+        if depth >= self.settings["batch_size"] * max(1, len(self.backends)):
+            self._wake.set()
+
+    # Sending
+
+    def start(self):
+        if self.backends and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ScrobbleSender", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        # Whatever was not sent stays in the outbox for the next start
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread is None:
+            self.queue.close()
+            return
+        # A send still running past the timeout finishes on its own; the thread closes the queue then
+        self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            while not self._stop_event.is_set():
+                self._wake.clear()
+                try:
+                    wait = self.send_once()
+                except Exception as e:
+                    print(f"Error sending scrobbles: {e}")
+                    wait = None
+                interval = self.settings["interval"]
+                self._wake.wait(interval if wait is None else min(wait, interval))
+        finally:
+            self.queue.close()
+
+    def send_once(self):
+        """
+        Send queued plays to every service that is not backing off
+
+        Returns:
+            float: Seconds until the next service may be retried, or None if none is backing off
+        """
+        next_retry = None
+        for backend in self.backends:
+            now = self.clock()
+            retry_at = self._retry_at.get(backend.name, 0)
+            if retry_at > now:
+                next_retry = retry_at - now if next_retry is None else min(next_retry, retry_at - now)
+                continue
+            delay = self._send_service(backend)
+            if delay is not None:
+                next_retry = delay if next_retry is None else min(next_retry, delay)
+        queue_depth.set(self.queue.depth())
+        return next_retry
+
+    def _send_service(self, backend):
+        batch_size = backend.batch_size or self.settings["batch_size"]
+        while not self._stop_event.is_set():
+            rows = self.queue.batch(backend.name, batch_size)
+            if not rows:
+                return None
+            row_ids = [row_id for row_id, _ in rows]
+            try:
+                with send_seconds.time():
+                    backend.send([play for _, play in rows])
+            except ScrobbleError as e:
+                send_errors.inc()
+                if not e.retry:
+                    print(f"{backend.name} refused {len(rows)} plays, dropping them: {e}")
+                    rejected_total.inc(len(rows))
+                    self.queue.remove(row_ids)
+                    continue
+                self.queue.failed(row_ids)
+                failures = self._failures.get(backend.name, 0) + 1
+                self._failures[backend.name] = failures
+                delay = e.retry_after or self.backoff(failures)
+                self._retry_at[backend.name] = self.clock() + delay
+                print(f"Sending scrobbles to {backend.name} failed ({e}), retrying in {delay:.0f}s")
+                return delay
+            self.queue.remove(row_ids)
+            sent_total.inc(len(rows))
+            self._failures.pop(backend.name, None)
+            self._retry_at.pop(backend.name, None)
+        return None
+
+    def backoff(self, failures):
+        """
+        Seconds to wait after `failures` failures in a row: doubling from 5 seconds, with jitter
+        """
+        delay = min(self.settings["max_backoff"], 5 * 2 ** (failures - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+
+class ScrobbleReceiver:
+    """
+    Local stand-in for a scrobble service.
+
+    Accepts JSON posts on any path and keeps them in memory: `requests` holds
+    every accepted request as (path, headers, body), `plays` the plays by
+    idempotency key, and `duplicates` counts repeated batches and plays.
+    `fail_next(count, status)` answers the next requests with an error.
+    """
+    def __init__(self, port=0, host="127.0.0.1"):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        receiver = self
+        self.requests = []
+        self.plays = {}
+        self.duplicates = 0
+        self._batch_keys = set()
+        self._failures = []
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                except ValueError:
+                    self._reply(400, {"error": "invalid JSON"})
+                    return
+                status = receiver._receive(self.path, dict(self.headers), body)
+                self._reply(status, {"status": "ok" if status < 300 else "error"})
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.url = f"http://{host}:{self.port}/"
+        self._thread = None
+
+    def fail_next(self, count=1, status=503):
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def _receive(self, path, headers, body):
+        with self._lock:
+            if self._failures:
+                return self._failures.pop(0)
+            self.requests.append((path, headers, body))
+            batch_key = headers.get("Idempotency-Key")
+            if batch_key in self._batch_keys:
+                self.duplicates += 1
+                return 200
+            if batch_key:
+                self._batch_keys.add(batch_key)
+            for play in body.get("plays") or body.get("payload") or ():
+                key = play.get("key") or json.dumps(play, sort_keys=True)
+                if key in self.plays:
+                    self.duplicates += 1
+                self.plays[key] = play
+        return 200
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="ScrobbleReceiver", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scrobble tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    receive = sub.add_parser("receive", help="Run a local stand-in scrobble service and print what it receives")
+    receive.add_argument("--port", type=int, default=8766)
+    queued = sub.add_parser("queue", help="Show the number of plays waiting to be sent per service")
+    queued.add_argument("--db", default=os.path.join(APP_LOG_DIR, "scrobble.db"))
+    args = parser.parse_args(argv)
+
+    if args.command == "queue":
+        queue = ScrobbleQueue(args.db)
+        try:
+            for service, count, attempts in queue.summary():
+                print(f"{service}: {count} plays waiting, up to {attempts} failed attempts")
+        finally:
+            queue.close()
+        return 0
+
+    receiver = ScrobbleReceiver(args.port).start()
+    print(f"Receiving scrobbles at {receiver.url} (Ctrl+C to stop)")
+    seen = 0
+    try:
+        while True:
+            time.sleep(1)
+            for path, headers, body in receiver.requests[seen:]:
+                print(json.dumps(body, indent=2, ensure_ascii=False))
+            seen = len(receiver.requests)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
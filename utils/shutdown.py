@@ -0,0 +1,67 @@
+import time
+import threading
+
+
+class Shutdown:
+    """
+    Shared stop signal for the app's worker threads.
+
+    Background loops wait on `event` instead of sleeping, so a single
+    request() wakes all of them at once. Loops that run on their own asyncio
+    event loop register a callback instead. From the moment of the request
+    the remaining time of the exit budget is tracked, so the shutdown steps
+    together stay within it.
+    """
+    def __init__(self, budget=5.0, clock=time.monotonic):
+        self.event = threading.Event()
+        self.budget = budget
+        self.clock = clock
+        self._deadline = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def is_set(self):
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Sleep for up to `timeout` seconds
+
+        Returns:
+            bool: True if shutdown was requested
+        """
+        return self.event.wait(timeout)
+
+    def on_request(self, callback):
+        """
+        Call `callback` when shutdown is requested (right away if it already was)
+        """
+        with self._lock:
+            if self._deadline is None:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def request(self):
+        """
+        Wake every waiting worker; safe to call repeatedly, from any thread and from signal handlers
+        """
+        with self._lock:
+            if self._deadline is not None:
+                return
+            self._deadline = self.clock() + self.budget
+            callbacks, self._callbacks = self._callbacks, []
+        self.event.set()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error during shutdown: {e}")
+
+    def remaining(self):
+        """
+        Seconds left of the exit budget (the full budget before a request)
+        """
+        if self._deadline is None:
+            return self.budget
+        return max(0.0, self._deadline - self.clock())
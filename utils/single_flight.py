@@ -0,0 +1,82 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one.
+
+    While a call for a key is running, further calls with that key get the
+    same result (or exception) instead of starting their own. Once it has
+    finished the key is forgotten, so results are never served stale.
+    """
+    def __init__(self, duplicates=None):
+        # Optional Counter incremented for every call that joined one in flight
+        self.duplicates = duplicates
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        """
+        Returns:
+            tuple: (future, leader) where leader is True if the caller has to run the call
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                if self.duplicates:
+                    self.duplicates.inc()
+                return future, False
+            future = self._flights[key] = Future()
+            return future, True
+
+    def _land(self, key, future, source):
+        with self._lock:
+            self._flights.pop(key, None)
+        if source.cancelled():
+            future.cancel()
+        elif source.exception() is not None:
+            future.set_exception(source.exception())
+        else:
+            future.set_result(source.result())
+
+    def submit(self, executor, key, fn, *args):
+        """
+        Run fn(*args) on the executor unless a call for key is in flight
+
+        Returns:
+            Future: Shared by every caller of the same flight
+        """
+        future, leader = self._join(key)
+        if leader:
+            try:
+                source = executor.submit(fn, *args)
+            except Exception:
+                with self._lock:
+                    self._flights.pop(key, None)
+                raise
+            source.add_done_callback(lambda done: self._land(key, future, done))
+        return future
+
+    def do(self, key, fn, *args):
+        """
+        Run fn(*args) in this thread, or wait for the call for key already in flight
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            with self._lock:
+                self._flights.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._flights.pop(key, None)
+        future.set_result(result)
+        return result
+
+    def __len__(self):
+        with self._lock:
+            return len(self._flights)
@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime
+
+from utils.history import play_row
+
+
+def format_duration(seconds):
+    seconds = int(seconds or 0)
+    if seconds < 3600:
+        return f"{seconds // 60}m"
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
+
+def format_plays(plays):
+    return f"{plays} song" if plays == 1 else f"{plays} songs"
+
+
+class PlayStats:
+    """
+    Running play totals per session, day, song and mapper.
+
+    A pipeline sink: every finished song adds one play and its played time
+    to four counters, so the tray and presence can show totals without
+    reading logs or history. The totals are saved now and then and can be
+    rebuilt from the play history database if the file is lost.
+    """
+    def __init__(self, path=None, save_interval=60, clock=time.time):
+        self.path = path
+        self.save_interval = save_interval
+        self.clock = clock
+        self.session_id = None
+        # Optional callable run after the totals changed, e.g. to refresh the tray menu
+        self.on_change = None
+        self.sessions = {}
+        self.days = {}
+        self.songs = {}
+        self.mappers = {}
+        # Per-profile views when several profiles count into these totals
+        self.profiles = []
+        self._dirty = False
+        self._saved_at = clock()
+        self._lock = threading.Lock()
+
+    # Pipeline sink
+
+    def on_event(self, event, session_id, data, timestamp):
+        if session_id:
+            self.session_id = session_id
+        if event == "song_stop" and data:
+            self.add(session_id, data, timestamp)
+        elif event == "session_end":
+            self.save()
+
+    def resume(self, session_id, state):
+        self.session_id = session_id
+
+    def profile(self, name):
+        """
+        Sink for one profile's pipeline, counting into these totals with a current session of its own
+        """
+        view = ProfileStats(self, name)
+        self.profiles.append(view)
+        return view
+
+    def add(self, session_id, song_info, ended_at):
+        """
+        Count a finished play
+        """
+        row = play_row(session_id, song_info, ended_at)
+        if not row:
+            return
+        _, song_key, _, song_name, artist, mapper, _, _, _, duration, day = row
+        seconds = duration or 0.0
+        with self._lock:
+            self._count(self.sessions, session_id, seconds)
+            self._count(self.days, day, seconds)
+            self._count(self.songs, song_key, seconds, f"{song_name} by {artist}")
+            self._count(self.mappers, mapper or "Unknown", seconds)
+            self._dirty = True
+        if self.clock() - self._saved_at >= self.save_interval:
+            self.save()
+        if self.on_change:
+            self.on_change()
+
+    @staticmethod
+    def _count(totals, key, seconds, label=None):
+        entry = totals.get(key)
+        if entry is None:
+            entry = totals[key] = [0, 0.0] if label is None else [0, 0.0, label]
+        entry[0] += 1
+        entry[1] += seconds
+
+    # Queries
+
+    def session(self, session_id=None):
+        """
+        (plays, seconds) of a session, the current one by default
+        """
+        entry = self.sessions.get(session_id or self.session_id)
+        return (entry[0], entry[1]) if entry else (0, 0.0)
+
+    def day(self, day=None):
+        """
+        (plays, seconds) of a local day (YYYY-MM-DD), today by default
+        """
+        entry = self.days.get(day or datetime.fromtimestamp(self.clock()).strftime("%Y-%m-%d"))
+        return (entry[0], entry[1]) if entry else (0, 0.0)
+
+    def song(self, song_key):
+        entry = self.songs.get(song_key)
+        return (entry[0], entry[1]) if entry else (0, 0.0)
+
+    def mapper(self, mapper):
+        entry = self.mappers.get(mapper)
+        return (entry[0], entry[1]) if entry else (0, 0.0)
+
+    def summary_lines(self):
+        """
+        Short lines for the tray menu
+        """
+        lines = []
+        if self.session_id:
+            plays, seconds = self.session()
+            lines.append(f"This session: {format_plays(plays)}, {format_duration(seconds)}")
+        for view in self.profiles:
+            if view.session_id:
+                plays, seconds = self.session(view.session_id)
+                lines.append(f"{view.name} session: {format_plays(plays)}, {format_duration(seconds)}")
+        plays, seconds = self.day()
+        lines.append(f"Today: {format_plays(plays)}, {format_duration(seconds)}")
+        return lines
+
+    def presence_text(self):
+        """
+        Today's totals for the Discord state line
+        """
+        plays, seconds = self.day()
+        return f"{format_plays(plays)}, {format_duration(seconds)} today" if plays else None
+
+    # Persistence
+
+    def load(self, history_db=None):
+        """
+        Read saved totals, or rebuild them from the play history if there are none
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            with self._lock:
+                self.sessions = data["sessions"]
+                self.days = data["days"]
+                self.songs = data["songs"]
+                self.mappers = data["mappers"]
+            return self
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring unreadable play stats: {e}")
+        if history_db and os.path.exists(history_db):
+            self.rebuild(history_db)
+        return self
+
+    def rebuild(self, history_db):
+        """
+        Recount all totals from the plays table of a history database
+        """
+        conn = sqlite3.connect(history_db)
+        try:
+            totals = {
+                "sessions": conn.execute(
+                    "SELECT session_id, COUNT(*), COALESCE(SUM(duration), 0) FROM plays GROUP BY session_id"),
+                "days": conn.execute("SELECT day, COUNT(*), COALESCE(SUM(duration), 0) FROM plays GROUP BY day"),
+                "songs": conn.execute(
+                    "SELECT song_key, COUNT(*), COALESCE(SUM(duration), 0), song_name || ' by ' || artist "
+                    "FROM plays GROUP BY song_key"),
+                "mappers": conn.execute(
+                    "SELECT COALESCE(mapper, 'Unknown'), COUNT(*), COALESCE(SUM(duration), 0) FROM plays "
+                    "GROUP BY COALESCE(mapper, 'Unknown')"),
+            }
+            totals = {name: {row[0]: list(row[1:]) for row in rows} for name, rows in totals.items()}
+        except sqlite3.Error as e:
+            print(f"Failed to rebuild play stats from history: {e}")
+            return
+        finally:
+            conn.close()
+        with self._lock:
+            self.sessions = totals["sessions"]
+            self.days = totals["days"]
+            self.songs = totals["songs"]
+            self.mappers = totals["mappers"]
+            self._dirty = True
+        self.save()
+
+    def save(self):
+        self._saved_at = self.clock()
+        if not self.path or not self._dirty:
+            return
+        with self._lock:
+            data = json.dumps({"sessions": self.sessions, "days": self.days, "songs": self.songs,
+                               "mappers": self.mappers}, ensure_ascii=False)
+            self._dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            print(f"Failed to save play stats: {e}")
+
+    def stop(self, timeout=None):
+        self.save()
+
+
+class ProfileStats:
+    """
+    One profile's sink for shared PlayStats.
+
+    Plays of every profile add up in the shared totals, while the current
+    session is the profile's own, so the tray doesn't jump between the
+    sessions of profiles playing at the same time.
+    """
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.session_id = None
+
+    def on_event(self, event, session_id, data, timestamp):
+        if session_id:
+            self.session_id = session_id
+        if event == "song_stop" and data:
+            self.stats.add(session_id, data, timestamp)
+        elif event == "session_end":
+            self.stats.save()
+
+    def resume(self, session_id, state):
+        self.session_id = session_id
+
+    def session(self):
+        """
+        (plays, seconds) of the profile's current session
+        """
+        return self.stats.session(self.session_id) if self.session_id else (0, 0.0)
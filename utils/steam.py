@@ -0,0 +1,256 @@
+import os
+import sys
+import json
+import time
+
+SYNTHRIDERS_APP_ID = "885000"
+GAME_DIR_NAME = "SynthRiders"
+
+# Where the game keeps its files, relative to the install directory
+GAME_FILES = {
+    "song_status_path": os.path.join("SynthRidersUC", "SongStatusOutput.txt"),
+    "cover_image_path": os.path.join("SynthRidersUC", "SongStatusImage.png"),
+    "synth_db_path": "SynthDB",
+}
+
+DEFAULT_PATHS = {
+    "song_status_path": "C:\\Program Files (x86)\\Steam\\steamapps\\common\\SynthRiders\\SynthRidersUC\\SongStatusOutput.txt",
+    "cover_image_path": "C:\\Program Files (x86)\\Steam\\steamapps\\common\\SynthRiders\\SynthRidersUC\\SongStatusImage.png",
+    "synth_db_path": "C:\\Program Files (x86)\\Steam\\steamapps\\common\\SynthRiders\\SynthDB",
+}
+
+
+def parse_vdf(text):
+    """
+    Parse Valve's text KeyValues format (libraryfolders.vdf) into nested dicts
+    """
+    root = {}
+    stack = [root]
+    key = None
+    i, length = 0, len(text)
+    while i < length:
+        char = text[i]
+        if char.isspace():
+            i += 1
+        elif text.startswith("//", i):
+            end = text.find("\n", i)
+            i = length if end < 0 else end + 1
+        elif char == "{":
+            section = {}
+            if key is not None:
+                stack[-1][key] = section
+                key = None
+            stack.append(section)
+            i += 1
+        elif char == "}":
+            if len(stack) > 1:
+                stack.pop()
+            i += 1
+        elif char == '"':
+            i += 1
+            chars = []
+            while i < length and text[i] != '"':
+                if text[i] == "\\" and i + 1 < length:
+                    i += 1
+                    chars.append({"n": "\n", "t": "\t"}.get(text[i], text[i]))
+                else:
+                    chars.append(text[i])
+                i += 1
+            i += 1
+            token = "".join(chars)
+            if key is None:
+                key = token
+            else:
+                stack[-1][key] = token
+                key = None
+        else:
+            # Unquoted token, e.g. a conditional like [$WIN32]; not used by libraryfolders.vdf
+            end = i
+            while end < length and not text[end].isspace() and text[end] not in '{}"':
+                end += 1
+            i = end
+    return root
+
+
+def steam_roots(platform=None, home=None):
+    """
+    Candidate Steam installation directories for this platform, most likely first
+    """
+    platform = platform or sys.platform
+    home = home or os.path.expanduser("~")
+    roots = []
+    if platform == "win32":
+        roots.extend(_registry_steam_paths())
+        for env in ("ProgramFiles(x86)", "ProgramFiles"):
+            if os.environ.get(env):
+                roots.append(os.path.join(os.environ[env], "Steam"))
+        roots.append("C:\\Program Files (x86)\\Steam")
+    elif platform == "darwin":
+        roots.append(os.path.join(home, "Library", "Application Support", "Steam"))
+    else:
+        # Native, Debian/Ubuntu symlink, Flatpak and Snap installs; the game itself runs through Proton
+        roots.extend([
+            os.path.join(home, ".local", "share", "Steam"),
+            os.path.join(home, ".steam", "steam"),
+            os.path.join(home, ".steam", "root"),
+            os.path.join(home, ".var", "app", "com.valvesoftware.Steam", ".local", "share", "Steam"),
+            os.path.join(home, "snap", "steam", "common", ".local", "share", "Steam"),
+        ])
+    unique = []
+    for root in roots:
+        if root and root not in unique:
+            unique.append(root)
+    return unique
+
+
+def _registry_steam_paths():
+    try:
+        import winreg
+    except ImportError:
+        return []
+    paths = []
+    for hive, key, value in ((winreg.HKEY_CURRENT_USER, r"Software\Valve\Steam", "SteamPath"),
+                             (winreg.HKEY_LOCAL_MACHINE, r"SOFTWARE\WOW6432Node\Valve\Steam", "InstallPath")):
+        try:
+            with winreg.OpenKey(hive, key) as handle:
+                paths.append(os.path.normpath(winreg.QueryValueEx(handle, value)[0]))
+        except OSError:
+            pass
+    return paths
+
+
+def library_folders(steam_root):
+    """
+    Steam library directories listed in a Steam installation's libraryfolders.vdf
+
+    Returns:
+        list: (path, has_synthriders) pairs; the Steam directory itself is always a library
+    """
+    libraries = [(steam_root, False)]
+    for vdf_path in (os.path.join(steam_root, "steamapps", "libraryfolders.vdf"),
+                     os.path.join(steam_root, "config", "libraryfolders.vdf")):
+        try:
+            with open(vdf_path, "r", encoding="utf-8", errors="replace") as f:
+                data = parse_vdf(f.read())
+        except OSError:
+            continue
+        folders = data.get("libraryfolders") or data.get("LibraryFolders") or {}
+        for name, entry in folders.items():
+            if not name.isdigit():
+                continue
+            if isinstance(entry, dict):
+                # Current format: "0" { "path" "..." "apps" { "885000" "..." } }
+                path = entry.get("path")
+                has_game = SYNTHRIDERS_APP_ID in (entry.get("apps") or {})
+            else:
+                # Old format: "1" "D:\\SteamLibrary"
+                path, has_game = entry, False
+            if not path:
+                continue
+            libraries = [(p, g) for p, g in libraries if os.path.normcase(p) != os.path.normcase(path)]
+            libraries.append((path, has_game))
+        break
+    return libraries
+
+
+def find_game_dir(roots=None):
+    """
+    Install directory of Synth Riders in any Steam library, or None
+    """
+    candidates = []
+    for root in roots if roots is not None else steam_roots():
+        if not os.path.isdir(root):
+            continue
+        for library, has_game in library_folders(root):
+            candidates.append((not has_game, os.path.join(library, "steamapps", "common", GAME_DIR_NAME)))
+    # Libraries Steam lists the game in come first
+    for _, game_dir in sorted(candidates, key=lambda c: c[0]):
+        if os.path.isdir(game_dir):
+            return game_dir
+    return None
+
+
+class InstallDiscovery:
+    """
+    Finds the Synth Riders install for paths missing from the config.
+
+    Configured paths that exist are always used as they are. For the others
+    the game is looked up in every Steam library (including Linux, Flatpak
+    and Snap Steam for Proton); the install directory is cached on disk and
+    only searched again when the cached directory is gone. A search that
+    found nothing is retried after `retry_interval` seconds, so a game
+    installed while the app runs is picked up with the next config reload.
+    """
+    def __init__(self, cache_path=None, roots=None, retry_interval=300, clock=time.monotonic):
+        self.cache_path = cache_path
+        self.roots = roots
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self._game_dir = None
+        self._searched_at = None
+
+    def game_dir(self):
+        if self._game_dir and os.path.isdir(self._game_dir):
+            return self._game_dir
+        cached = self._load_cache()
+        if cached and os.path.isdir(cached):
+            self._game_dir = cached
+            return cached
+        if self._game_dir is None and self._searched_at is not None \
+                and self.clock() - self._searched_at < self.retry_interval:
+            return None
+        self._searched_at = self.clock()
+        self._game_dir = find_game_dir(self.roots)
+        if self._game_dir:
+            self._save_cache(self._game_dir)
+        return self._game_dir
+
+    def resolve(self, config):
+        """
+        Paths of the status file, cover image and SynthDB for a config
+
+        Returns:
+            dict: song_status_path, cover_image_path and synth_db_path
+        """
+        paths = {}
+        for key, default in DEFAULT_PATHS.items():
+            configured = config.get(key) or default
+            if self._exists(key, configured):
+                paths[key] = configured
+                continue
+            game_dir = self.game_dir()
+            found = os.path.join(game_dir, GAME_FILES[key]) if game_dir else None
+            if found and found != configured and self._exists(key, found):
+                print(f"{key}: {configured} not found, using {found}")
+                paths[key] = found
+            else:
+                paths[key] = configured
+        return paths
+
+    @staticmethod
+    def _exists(key, path):
+        # The game creates the status files only once it runs, so their folder is what has to exist
+        if key == "synth_db_path":
+            return os.path.isfile(path)
+        return os.path.isdir(os.path.dirname(path))
+
+    def _load_cache(self):
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path, "r", encoding="UTF-8") as f:
+                return json.load(f).get("game_dir")
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def _save_cache(self, game_dir):
+        if not self.cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, "w", encoding="UTF-8") as f:
+                json.dump({"game_dir": game_dir}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"Failed to save install path cache: {e}")
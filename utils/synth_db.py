@@ -1,6 +1,8 @@
 import os
 import sqlite3
+from utils.metrics import timed
 
+@timed("get_song_details_from_synthdb")
 def get_song_details_from_synthdb(db_path, song_name, artist):
     """
     Query SynthDB to get all available song details based on song name and artist
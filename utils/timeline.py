@@ -0,0 +1,116 @@
+import os
+import time
+
+
+def format_timestamp(seconds, separator=","):
+    """
+    Format elapsed seconds as HH:MM:SS,mmm (SRT) or HH:MM:SS.mmm (WebVTT)
+    """
+    millis = max(0, int(round(seconds * 1000)))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}"
+
+
+def song_label(song_info):
+    return f"{song_info.get('artist', 'Unknown')} - {song_info.get('song_name', 'Unknown')}"
+
+
+class SessionTimeline:
+    """
+    Subtitle timeline of a session in SRT and WebVTT format.
+
+    Cue times are wall-clock seconds since the session started, so the track
+    lines up with a recording that was started together with the game. Files
+    are only ever appended to; the one exception is the cue of the song that
+    is currently playing, which is written with its expected SynthDB end time
+    and rewritten in place (by truncating back to where it started) once the
+    real stop time is known.
+    """
+    def __init__(self, log_dir, session_id, started_at=None, cue_seconds=5, clock=time.time):
+        self.clock = clock
+        self.started_at = started_at if started_at is not None else clock()
+        self.cue_seconds = cue_seconds
+        os.makedirs(log_dir, exist_ok=True)
+        self.srt_path = os.path.join(log_dir, f"rpc{session_id}.srt")
+        self.vtt_path = os.path.join(log_dir, f"rpc{session_id}.vtt")
+        self.index = 0
+        # (index, start, text, srt offset, vtt offset) of the playing song's cue
+        self.open_cue = None
+        if not os.path.exists(self.vtt_path):
+            with open(self.vtt_path, "wb") as f:
+                f.write(b"WEBVTT\n\n")
+
+    def elapsed(self, at=None):
+        return (at if at is not None else self.clock()) - self.started_at
+
+    def song_start(self, song_info, at=None):
+        """
+        Add a cue spanning the song's expected duration
+        """
+        if self.open_cue:
+            self.song_stop(None, at)
+        start = self.elapsed(at if at is not None else song_info.get('start_time'))
+        duration = song_info.get('duration') or self.cue_seconds
+        text = f"START: {song_label(song_info)}"
+        self.index += 1
+        offsets = self._append(self.index, start, start + duration, text)
+        self.open_cue = (self.index, start, text) + offsets
+
+    def song_stop(self, song_info, at=None):
+        """
+        Close the playing song's cue at the real stop time and add a STOP cue
+        """
+        stop = self.elapsed(at)
+        if self.open_cue:
+            index, start, text, srt_offset, vtt_offset = self.open_cue
+            self._truncate(srt_offset, vtt_offset)
+            self._append(index, start, max(stop, start), text)
+            self.open_cue = None
+        if song_info:
+            self.index += 1
+            self._append(self.index, stop, stop + self.cue_seconds, f"STOP: {song_label(song_info)}")
+
+    def idle(self, at=None):
+        """
+        Add a short cue marking that the game is no longer running
+        """
+        if self.open_cue:
+            self.song_stop(None, at)
+        start = self.elapsed(at)
+        self.index += 1
+        self._append(self.index, start, start + self.cue_seconds, "Idle")
+
+    def state(self):
+        """
+        Snapshot of the timeline position, enough to continue appending later
+        """
+        return {
+            'started_at': self.started_at,
+            'index': self.index,
+            'open_cue': list(self.open_cue) if self.open_cue else None,
+        }
+
+    def restore(self, state):
+        self.started_at = state['started_at']
+        self.index = state['index']
+        self.open_cue = tuple(state['open_cue']) if state.get('open_cue') else None
+
+    def _append(self, index, start, end, text):
+        srt_cue = f"{index}\n{format_timestamp(start)} --> {format_timestamp(end)}\n{text}\n\n"
+        vtt_cue = f"{index}\n{format_timestamp(start, '.')} --> {format_timestamp(end, '.')}\n{text}\n\n"
+        offsets = []
+        for path, cue in ((self.srt_path, srt_cue), (self.vtt_path, vtt_cue)):
+            with open(path, "ab") as f:
+                offsets.append(f.tell())
+                f.write(cue.encode("utf-8"))
+        return tuple(offsets)
+
+    def _truncate(self, srt_offset, vtt_offset):
+        for path, offset in ((self.srt_path, srt_offset), (self.vtt_path, vtt_offset)):
+            try:
+                with open(path, "r+b") as f:
+                    f.truncate(offset)
+            except OSError as e:
+                print(f"Failed to update subtitle file {path}: {e}")
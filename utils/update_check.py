@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import threading
+import configparser
+
+APPINFO_URL = "https://raw.githubusercontent.com/6uhrmittag/Synth-Riders-DiscordRPC/master/settings/appinfo.ini"
+
+
+class UpdateChecker:
+    """
+    Looks up the latest released version without blocking startup.
+
+    The last answer is cached on disk together with the ETag/Last-Modified
+    headers, the server is asked at most once per interval, and then only
+    with a conditional request so an unchanged appinfo.ini costs a 304.
+    """
+    def __init__(self, cache_path, interval_hours=24, url=APPINFO_URL, timeout=5):
+        self.cache_path = cache_path
+        self.interval = interval_hours * 3600
+        self.url = url
+        self.timeout = timeout
+        self._thread = None
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path, "r", encoding="UTF-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_cache(self, cache):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, "w", encoding="UTF-8") as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"Failed to save update check cache: {e}")
+
+    def cached_version(self):
+        """
+        Server version from the last successful check, or None
+        """
+        return self.load_cache().get("version")
+
+    def check(self, now=None):
+        """
+        Return the server version, asking the server only if the cache is stale
+
+        Returns:
+            str: Server version, or None if it has never been fetched
+        """
+        now = now or time.time()
+        cache = self.load_cache()
+        if cache.get("version") and now - cache.get("checked_at", 0) < self.interval:
+            return cache["version"]
+
+        headers = {}
+        if cache.get("version"):
+            if cache.get("etag"):
+                headers["If-None-Match"] = cache["etag"]
+            if cache.get("last_modified"):
+                headers["If-Modified-Since"] = cache["last_modified"]
+        # Deferred so the tray can start before requests is loaded
+        import requests
+        try:
+            r = requests.get(self.url, headers=headers, timeout=self.timeout)
+        except Exception as e:
+            print(f"Error fetching server version: {e}")
+            return cache.get("version")
+
+        if r.status_code == 304:
+            cache["checked_at"] = now
+        elif r.status_code == 200:
+            try:
+                conf = configparser.ConfigParser()
+                conf.read_string(r.text)
+                version = conf["PROFILE"]["AppVersion"]
+            except (configparser.Error, KeyError) as e:
+                print(f"Unexpected appinfo.ini content: {e}")
+                return cache.get("version")
+            cache = {
+                "version": version,
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+                "checked_at": now,
+            }
+        else:
+            print(f"Version check failed with status code {r.status_code}")
+            return cache.get("version")
+        self.save_cache(cache)
+        return cache.get("version")
+
+    def start(self, on_result):
+        """
+        Run check() in a background thread and pass the version to on_result
+        """
+        def run():
+            version = self.check()
+            if version:
+                on_result(version)
+
+        self._thread = threading.Thread(target=run, name="UpdateCheck", daemon=True)
+        self._thread.start()
+        return self._thread